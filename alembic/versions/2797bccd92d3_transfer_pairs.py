@@ -0,0 +1,63 @@
+"""transfer pairs
+
+Revision ID: 2797bccd92d3
+Revises: b45f0e4967f4
+Create Date: 2026-10-18 13:40:52.118406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2797bccd92d3'
+down_revision = 'b45f0e4967f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('transfer_pairs',
+    sa.Column('low_user_id', sa.Integer(), nullable=False),
+    sa.Column('high_user_id', sa.Integer(), nullable=False),
+    sa.Column('low_to_high_amount', sa.Numeric(precision=18, scale=2), nullable=False),
+    sa.Column('low_to_high_count', sa.Integer(), nullable=False),
+    sa.Column('high_to_low_amount', sa.Numeric(precision=18, scale=2), nullable=False),
+    sa.Column('high_to_low_count', sa.Integer(), nullable=False),
+    sa.Column('first_transfer_at', sa.DateTime(), nullable=True),
+    sa.Column('last_transfer_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['high_user_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['low_user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('low_user_id', 'high_user_id')
+    )
+    op.create_index(
+        'ix_transactions_pair_created_at',
+        'transactions',
+        [sa.text('least(sender_id, receiver_id)'), sa.text('greatest(sender_id, receiver_id)'), 'created_at', 'id'],
+        unique=False,
+        postgresql_where=sa.text("type = 'TRANSFER'")
+    )
+    # totals of transfers made before this migration
+    op.execute("""
+        INSERT INTO transfer_pairs (
+            low_user_id, high_user_id, low_to_high_amount, low_to_high_count, high_to_low_amount, high_to_low_count,
+            first_transfer_at, last_transfer_at
+        )
+        SELECT
+            least(sender_id, receiver_id),
+            greatest(sender_id, receiver_id),
+            coalesce(sum(amount) FILTER (WHERE sender_id <= receiver_id), 0),
+            count(*) FILTER (WHERE sender_id <= receiver_id),
+            coalesce(sum(amount) FILTER (WHERE sender_id > receiver_id), 0),
+            count(*) FILTER (WHERE sender_id > receiver_id),
+            min(created_at),
+            max(created_at)
+        FROM transactions
+        WHERE type = 'TRANSFER' AND sender_id IS NOT NULL AND receiver_id IS NOT NULL
+        GROUP BY 1, 2
+    """)
+
+
+def downgrade():
+    op.drop_index('ix_transactions_pair_created_at', table_name='transactions')
+    op.drop_table('transfer_pairs')
@@ -0,0 +1,107 @@
+"""partition transactions by month
+
+Revision ID: 5f3a9c1d7e20
+Revises: 2797bccd92d3
+Create Date: 2026-10-18 16:12:37.904215
+
+"""
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f3a9c1d7e20'
+down_revision = '2797bccd92d3'
+branch_labels = None
+depends_on = None
+
+# months after current one which get partition right away, later ones are created by manage_partitions.py
+MONTHS_AHEAD = 3
+COLUMNS = "id, type, sender_id, receiver_id, amount, created_at"
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def create_indexes():
+    op.create_index('ix_transactions_sender_id_created_at', 'transactions', ['sender_id', 'created_at'], unique=False)
+    op.create_index('ix_transactions_receiver_id_created_at', 'transactions', ['receiver_id', 'created_at'], unique=False)
+    op.create_index('ix_transactions_sender_id_type_created_at', 'transactions', ['sender_id', 'type', 'created_at'], unique=False)
+    op.create_index('ix_transactions_receiver_id_type_created_at', 'transactions', ['receiver_id', 'type', 'created_at'], unique=False)
+    op.create_index('ix_transactions_created_at_id', 'transactions', ['created_at', 'id'], unique=False)
+    op.create_index(
+        'ix_transactions_pair_created_at',
+        'transactions',
+        [sa.text('least(sender_id, receiver_id)'), sa.text('greatest(sender_id, receiver_id)'), 'created_at', 'id'],
+        unique=False,
+        postgresql_where=sa.text("type = 'TRANSFER'")
+    )
+
+
+def upgrade():
+    # old table is kept until its rows are copied, its primary key index name is taken by the new table
+    op.execute("ALTER TABLE transactions RENAME TO transactions_unpartitioned")
+    op.execute("ALTER INDEX transactions_pkey RENAME TO transactions_unpartitioned_pkey")
+    # partition key has to be part of primary key, ids still come from one sequence so they stay unique
+    op.execute("""
+        CREATE TABLE transactions (
+            id integer NOT NULL DEFAULT nextval('transactions_id_seq'),
+            type transactiontype,
+            sender_id integer REFERENCES users (id),
+            receiver_id integer REFERENCES users (id),
+            amount numeric(12, 2),
+            created_at timestamp without time zone NOT NULL,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+
+    bind = op.get_bind()
+    first, last = bind.execute(sa.text("SELECT min(created_at), max(created_at) FROM transactions_unpartitioned")).one()
+    current = date.today().replace(day=1)
+    month = (first.date() if first else current).replace(day=1)
+    end = max(add_months(current, MONTHS_AHEAD), (last.date() if last else current).replace(day=1))
+    while month <= end:
+        op.execute(
+            f"CREATE TABLE transactions_{month:%Y_%m} PARTITION OF transactions "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+        )
+        month = add_months(month, 1)
+
+    # rows are routed to their partitions, rows without created_at land in current month
+    op.execute(f"""
+        INSERT INTO transactions ({COLUMNS})
+        SELECT id, type, sender_id, receiver_id, amount, coalesce(created_at, now()::timestamp)
+        FROM transactions_unpartitioned
+    """)
+    # sequence would be dropped together with the table owning it
+    op.execute("ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id")
+    op.execute("DROP TABLE transactions_unpartitioned")
+    # indexes are built once after copy instead of being updated by every inserted row, primary key covers
+    # lookups by id, so single column id index is not created again
+    create_indexes()
+
+
+def downgrade():
+    op.execute("ALTER TABLE transactions RENAME TO transactions_partitioned")
+    op.execute("ALTER INDEX transactions_pkey RENAME TO transactions_partitioned_pkey")
+    op.execute("""
+        CREATE TABLE transactions (
+            id integer NOT NULL DEFAULT nextval('transactions_id_seq'),
+            type transactiontype,
+            sender_id integer REFERENCES users (id),
+            receiver_id integer REFERENCES users (id),
+            amount numeric(12, 2),
+            created_at timestamp without time zone,
+            PRIMARY KEY (id)
+        )
+    """)
+    op.execute(f"INSERT INTO transactions ({COLUMNS}) SELECT {COLUMNS} FROM transactions_partitioned")
+    op.execute("ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id")
+    # drops partitions too
+    op.execute("DROP TABLE transactions_partitioned")
+    op.create_index(op.f('ix_transactions_id'), 'transactions', ['id'], unique=False)
+    create_indexes()
@@ -0,0 +1,35 @@
+"""transaction user indexes
+
+Revision ID: 605640f84797
+Revises: 83ea89ad468a
+Create Date: 2026-10-18 10:12:41.182334
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '605640f84797'
+down_revision = '83ea89ad468a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_transactions_sender_id_created_at', 'transactions', ['sender_id', 'created_at'], unique=False)
+    op.create_index('ix_transactions_receiver_id_created_at', 'transactions', ['receiver_id', 'created_at'], unique=False)
+    op.create_index('ix_transactions_sender_id_type_created_at', 'transactions', ['sender_id', 'type', 'created_at'], unique=False)
+    op.create_index('ix_transactions_receiver_id_type_created_at', 'transactions', ['receiver_id', 'type', 'created_at'], unique=False)
+    # single column indexes are covered by the leading column of the composite ones
+    op.drop_index(op.f('ix_transactions_sender_id'), table_name='transactions')
+    op.drop_index(op.f('ix_transactions_receiver_id'), table_name='transactions')
+
+
+def downgrade():
+    op.create_index(op.f('ix_transactions_receiver_id'), 'transactions', ['receiver_id'], unique=False)
+    op.create_index(op.f('ix_transactions_sender_id'), 'transactions', ['sender_id'], unique=False)
+    op.drop_index('ix_transactions_receiver_id_type_created_at', table_name='transactions')
+    op.drop_index('ix_transactions_sender_id_type_created_at', table_name='transactions')
+    op.drop_index('ix_transactions_receiver_id_created_at', table_name='transactions')
+    op.drop_index('ix_transactions_sender_id_created_at', table_name='transactions')
@@ -0,0 +1,57 @@
+"""ledger reconciliation
+
+Revision ID: 9c2e6b4f1a37
+Revises: 5f3a9c1d7e20
+Create Date: 2026-10-18 17:25:09.316842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c2e6b4f1a37'
+down_revision = '5f3a9c1d7e20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ledger_totals',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('debits', sa.Numeric(precision=18, scale=2), nullable=False),
+    sa.Column('credits', sa.Numeric(precision=18, scale=2), nullable=False),
+    sa.Column('transaction_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    op.create_table('reconciliation_checkpoints',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('last_transaction_id', sa.Integer(), nullable=False),
+    sa.Column('last_created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.add_column('users', sa.Column('opening_balance', sa.Numeric(precision=12, scale=2), nullable=True))
+    # opening balance of existing users is not known, it is derived from current balance, so balances are
+    # taken as correct at this point and mismatches are reported from now on
+    op.execute("""
+        UPDATE users SET opening_balance = coalesce(users.balance, 0) - coalesce(ledger.amount, 0)
+        FROM (
+            SELECT user_id, sum(amount) AS amount FROM (
+                SELECT receiver_id AS user_id, amount FROM transactions WHERE receiver_id IS NOT NULL
+                UNION ALL
+                SELECT sender_id, -amount FROM transactions WHERE sender_id IS NOT NULL
+            ) AS movements
+            GROUP BY user_id
+        ) AS ledger
+        WHERE ledger.user_id = users.id
+    """)
+    op.execute("UPDATE users SET opening_balance = coalesce(balance, 0) WHERE opening_balance IS NULL")
+    op.alter_column('users', 'opening_balance', nullable=False)
+
+
+def downgrade():
+    op.drop_column('users', 'opening_balance')
+    op.drop_table('reconciliation_checkpoints')
+    op.drop_table('ledger_totals')
@@ -0,0 +1,26 @@
+"""keyset pagination indexes
+
+Revision ID: b45f0e4967f4
+Revises: 605640f84797
+Create Date: 2026-10-18 11:03:27.540912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b45f0e4967f4'
+down_revision = '605640f84797'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_transactions_created_at_id', 'transactions', ['created_at', 'id'], unique=False)
+    op.create_index('ix_users_created_at_id', 'users', ['created_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_users_created_at_id', table_name='users')
+    op.drop_index('ix_transactions_created_at_id', table_name='transactions')
@@ -0,0 +1,38 @@
+"""balance shards
+
+Revision ID: b8f4c2d91e05
+Revises: e71d0a58c3b6
+Create Date: 2026-10-18 18:47:13.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8f4c2d91e05'
+down_revision = 'e71d0a58c3b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('balance_shards',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('shard', sa.Integer(), nullable=False),
+    sa.Column('balance', sa.Numeric(precision=12, scale=2), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'shard')
+    )
+    op.add_column('users', sa.Column('shard_count', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    # balance of shards goes back to users rows, otherwise it would be lost with the table
+    op.execute("""
+        UPDATE users SET balance = users.balance + shards.balance
+        FROM (SELECT user_id, sum(balance) AS balance FROM balance_shards GROUP BY user_id) AS shards
+        WHERE users.id = shards.user_id
+    """)
+    op.drop_column('users', 'shard_count')
+    op.drop_table('balance_shards')
@@ -0,0 +1,58 @@
+"""user daily stats
+
+Revision ID: e71d0a58c3b6
+Revises: 9c2e6b4f1a37
+Create Date: 2026-10-18 18:02:44.581930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e71d0a58c3b6'
+down_revision = '9c2e6b4f1a37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_daily_stats',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('type', postgresql.ENUM('TRANSFER', 'WITHDRAWAL', name='transactiontype', create_type=False), nullable=False),
+    sa.Column('sent_amount', sa.Numeric(precision=18, scale=2), nullable=False),
+    sa.Column('sent_count', sa.Integer(), nullable=False),
+    sa.Column('received_amount', sa.Numeric(precision=18, scale=2), nullable=False),
+    sa.Column('received_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'day', 'type')
+    )
+    # stats of transactions made before this migration
+    op.execute("""
+        INSERT INTO user_daily_stats (
+            user_id, day, type, sent_amount, sent_count, received_amount, received_count
+        )
+        SELECT
+            user_id,
+            day,
+            type,
+            coalesce(sum(amount) FILTER (WHERE sent), 0),
+            count(*) FILTER (WHERE sent),
+            coalesce(sum(amount) FILTER (WHERE NOT sent), 0),
+            count(*) FILTER (WHERE NOT sent)
+        FROM (
+            SELECT sender_id AS user_id, created_at::date AS day, type, amount, true AS sent
+            FROM transactions WHERE sender_id IS NOT NULL
+            UNION ALL
+            SELECT receiver_id, created_at::date, type, amount, false
+            FROM transactions WHERE receiver_id IS NOT NULL
+        ) AS sides
+        WHERE type IS NOT NULL
+        GROUP BY 1, 2, 3
+    """)
+
+
+def downgrade():
+    op.drop_table('user_daily_stats')
@@ -0,0 +1,21 @@
+"""
+Load tests for API, withdrawal consumer and transaction queries. Redis and RabbitMQ are replaced with in-process
+stand-ins, database is SQLite file in temp directory unless BENCH_DATABASE_URL points somewhere else. DATABASE_URL
+of the app is never used, ledger build drops and recreates the whole schema.
+
+Run with ``python -m benchmarks --help``.
+"""
+import os
+import tempfile
+
+# app modules read settings at import time, defaults have to be in place before anything else is imported
+BENCH_DATABASE_URL = os.environ.get(
+    "BENCH_DATABASE_URL", f"sqlite:///{os.path.join(tempfile.gettempdir(), 'trumo_bench.db')}"
+)
+os.environ["DATABASE_URL"] = BENCH_DATABASE_URL
+os.environ.setdefault("RABBITMQ_QUEUE", "withdrawals")
+os.environ.setdefault("RABBITMQ_HOST", "localhost")
+os.environ.setdefault("RABBITMQ_PORT", "5672")
+os.environ.setdefault("RABBITMQ_USERNAME", "guest")
+os.environ.setdefault("RABBITMQ_PASSWORD", "guest")
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379")
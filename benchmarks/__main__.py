@@ -0,0 +1,65 @@
+import argparse
+import logging
+import sys
+
+import benchmarks  # noqa: F401 settings defaults
+
+from db import engine
+from models import MoneyTransaction
+from benchmarks import ledger
+from benchmarks.runner import DEFAULT_TOLERANCE, compare, format_table, load, report, save
+from benchmarks.scenarios import SCENARIOS, Bench
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Runs load test scenarios against synthetic ledger")
+    parser.add_argument("--rows", type=int, default=10000, help="transactions in synthetic ledger")
+    parser.add_argument("--users", type=int, help="users in synthetic ledger, defaults to rows / 100")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--iterations", type=int, default=200, help="measured calls per scenario")
+    parser.add_argument("--warmup", type=int, default=10, help="calls per scenario which are not measured")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="can be repeated, all by default")
+    parser.add_argument("--reuse-ledger", action="store_true", help="do not rebuild ledger if it has expected size")
+    parser.add_argument("--save", metavar="PATH", help="write results as JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare with JSON baseline, exits with 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="allowed relative p95 growth")
+    args = parser.parse_args()
+
+    # consumer logs every simulated failure, it would flood the report
+    logging.basicConfig(level=logging.CRITICAL)
+    users = args.users or max(args.rows // 100, 10)
+    # scenarios add rows, so reused ledger is only checked for minimal size
+    if not (args.reuse_ledger and _ledger_rows() >= args.rows):
+        print(f"Building ledger with {args.rows} transactions and {users} users on {engine.url.get_backend_name()}...")
+        ledger.build(args.rows, users, args.seed)
+
+    bench = Bench(users, args.seed, args.iterations, args.warmup)
+    results = {}
+    for name in args.scenario or SCENARIOS:
+        bench.reset()
+        results[name] = SCENARIOS[name](bench)
+
+    baseline = load(args.compare)["results"] if args.compare else None
+    print(format_table(results, baseline))
+
+    if args.save:
+        save(args.save, report(results, {
+            "rows": args.rows, "users": users, "seed": args.seed, "iterations": args.iterations,
+            "database": engine.url.get_backend_name(),
+        }))
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"p95 regression over {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+def _ledger_rows() -> int:
+    try:
+        return ledger.count(MoneyTransaction)
+    except Exception:
+        return 0
+
+
+if __name__ == "__main__":
+    main()
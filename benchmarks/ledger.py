@@ -0,0 +1,77 @@
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import event, func, insert, make_url, select
+
+from benchmarks import BENCH_DATABASE_URL
+from db import SessionLocal, async_engine, engine
+from models import MoneyTransaction, TransactionType, User
+from models.base_model import Base
+
+INSERT_CHUNK_SIZE = 10000
+USER_BALANCE = Decimal("1000000.00")
+LEDGER_DAYS = 90
+
+
+@event.listens_for(engine, "connect")
+@event.listens_for(async_engine.sync_engine, "connect")
+def add_sqlite_functions(dbapi_connection, connection_record):
+    # pair queries and index use postgres least/greatest
+    if engine.url.get_backend_name() == "sqlite":
+        dbapi_connection.create_function("least", 2, _ignoring_nulls(min), deterministic=True)
+        dbapi_connection.create_function("greatest", 2, _ignoring_nulls(max), deterministic=True)
+
+
+def _ignoring_nulls(aggregate):
+    # postgres least/greatest skip nulls, withdrawals have no receiver
+    def function(*values):
+        values = [value for value in values if value is not None]
+        return aggregate(values) if values else None
+    return function
+
+
+def build(rows: int, users: int, seed: int, days: int = LEDGER_DAYS):
+    """
+    Recreates schema and fills it with synthetic ledger, transactions are spread over last `days` days so cache
+    has both history and recent segments. Same seed gives same ledger.
+    """
+    # db imported before benchmarks keeps URL of the app, its schema must not be dropped
+    if engine.url != make_url(BENCH_DATABASE_URL):
+        raise RuntimeError(f"Refusing to rebuild {engine.url!r}, it is not BENCH_DATABASE_URL")
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    rnd = random.Random(seed)
+    now = datetime.utcnow()
+    start = now - timedelta(days=days)
+    span = (now - start).total_seconds()
+
+    with SessionLocal() as db:
+        db.execute(insert(User), [
+            {"id": user_id, "name": f"bench user {user_id}", "main_balance": USER_BALANCE, "created_at": start}
+            for user_id in range(1, users + 1)
+        ])
+        for offset in range(0, rows, INSERT_CHUNK_SIZE):
+            db.execute(insert(MoneyTransaction), [
+                _transaction(rnd, users, start + timedelta(seconds=rnd.random() * span))
+                for _ in range(offset, min(offset + INSERT_CHUNK_SIZE, rows))
+            ])
+            db.commit()
+        db.commit()
+
+
+def count(model) -> int:
+    with SessionLocal() as db:
+        return db.scalar(select(func.count()).select_from(model))
+
+
+def _transaction(rnd: random.Random, users: int, created_at: datetime) -> dict:
+    sender_id = rnd.randint(1, users)
+    amount = Decimal(rnd.randint(1, 10000)) / 100
+    if rnd.random() < 0.2:
+        return {"type": TransactionType.WITHDRAWAL, "sender_id": sender_id, "receiver_id": None, "amount": amount, "created_at": created_at}
+    # receiver is any other user
+    receiver_id = rnd.randint(1, users - 1)
+    receiver_id += receiver_id >= sender_id
+    return {"type": TransactionType.TRANSFER, "sender_id": sender_id, "receiver_id": receiver_id, "amount": amount, "created_at": created_at}
@@ -0,0 +1,104 @@
+import asyncio
+import json
+import math
+import platform
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+# relative p95 growth which counts as regression
+DEFAULT_TOLERANCE = 0.2
+
+
+def measure(op: Callable, iterations: int, warmup: int = 10, setup: Optional[Callable] = None) -> dict:
+    """Calls op() sequentially, only op call is timed, setup() runs before every call outside of measurement."""
+    latencies = []
+    for i in range(warmup + iterations):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        op()
+        if i >= warmup:
+            latencies.append(time.perf_counter() - started)
+    return summarize(latencies)
+
+
+def measure_async(op: Callable, iterations: int, warmup: int = 10, setup: Optional[Callable] = None) -> dict:
+    """Same as measure for coroutine functions, whole run is in one event loop."""
+    async def run():
+        latencies = []
+        for i in range(warmup + iterations):
+            if setup:
+                await setup()
+            started = time.perf_counter()
+            await op()
+            if i >= warmup:
+                latencies.append(time.perf_counter() - started)
+        return latencies
+
+    return summarize(asyncio.run(run()))
+
+
+def summarize(latencies: List[float]) -> dict:
+    ordered = sorted(latencies)
+    total = sum(ordered)
+    return {
+        "ops": len(ordered),
+        "ops_per_sec": round(len(ordered) / total, 1) if total else None,
+        "mean_ms": round(total / len(ordered) * 1000, 3),
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+    }
+
+
+def percentile(ordered: List[float], pct: float) -> float:
+    """Nearest rank percentile of sorted values."""
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def report(results: Dict[str, dict], meta: dict) -> dict:
+    return {
+        "meta": {
+            **meta,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+        },
+        "results": results,
+    }
+
+
+def save(path: str, data: dict):
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """Returns names of scenarios which p95 grew more than tolerance compared to baseline."""
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected and result["p95_ms"] > expected["p95_ms"] * (1 + tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def format_table(results: Dict[str, dict], baseline: Dict[str, dict] = None) -> str:
+    lines = [f"{'scenario':<32}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'p95 vs base':>14}"]
+    for name, result in results.items():
+        change = ""
+        expected = (baseline or {}).get(name)
+        if expected and expected["p95_ms"]:
+            change = f"{(result['p95_ms'] / expected['p95_ms'] - 1) * 100:+.1f}%"
+        lines.append(
+            f"{name:<32}{result['ops_per_sec']:>10}{result['p50_ms']:>10}{result['p95_ms']:>10}{result['p99_ms']:>10}{change:>14}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,193 @@
+import json
+import os
+import random
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from fakeredis import FakeServer
+from fastapi.testclient import TestClient
+
+import main
+import rabbit_consumer
+from db import AsyncSessionLocal, SessionLocal, async_engine
+from pydantic_models.page import PageParams
+from services.rabbit_service import get_async_rabbitmq_publisher
+from services.redis_service import get_redis_service
+from services.transaction_service import TransactionService
+
+from benchmarks.ledger import LEDGER_DAYS
+from benchmarks.runner import measure, measure_async
+from benchmarks.stand_ins import FakeRedisService, InMemoryBroker, InMemoryChannel, InMemoryPublisher, sync_redis
+
+CONSUMER_BATCH_SIZE = 100
+
+
+class Bench:
+    """State shared by scenarios, every scenario starts from the same random state."""
+
+    def __init__(self, users: int, seed: int, iterations: int, warmup: int = 10):
+        self.users = users
+        self.seed = seed
+        self.iterations = iterations
+        self.warmup = warmup
+        self.rnd = random.Random(seed)
+
+    def reset(self):
+        self.rnd.seed(self.seed)
+        # consumer simulates failures with global random
+        random.seed(self.seed)
+
+    def user_id(self) -> int:
+        return self.rnd.randint(1, self.users)
+
+    def user_pair(self) -> tuple:
+        return tuple(self.rnd.sample(range(1, self.users + 1), 2))
+
+    def amount(self) -> str:
+        return str(Decimal(self.rnd.randint(1, 100)) / 100)
+
+
+@contextmanager
+def app_client(publisher: InMemoryPublisher, redis_server: FakeServer):
+    """TestClient of the app with stand-ins in place of RabbitMQ and Redis."""
+    setup_rabbitmq = main.setup_rabbitmq
+    main.setup_rabbitmq = lambda: None
+    main.app.dependency_overrides[get_async_rabbitmq_publisher] = lambda: publisher
+    main.app.dependency_overrides[get_redis_service] = lambda: FakeRedisService(redis_server)
+    try:
+        with sync_redis(redis_server), TestClient(main.app) as client:
+            yield client
+    finally:
+        main.setup_rabbitmq = setup_rabbitmq
+        main.app.dependency_overrides.pop(get_async_rabbitmq_publisher)
+        main.app.dependency_overrides.pop(get_redis_service)
+        # pooled async connections belong to event loop of the client
+        async_engine.sync_engine.dispose(close=False)
+
+
+def api_transfer(bench: Bench) -> dict:
+    def op():
+        sender_id, receiver_id = bench.user_pair()
+        client.post("/transactions/transfer", json={"sender_id": sender_id, "receiver_id": receiver_id, "amount": bench.amount()}).raise_for_status()
+
+    with app_client(InMemoryPublisher(InMemoryBroker()), FakeServer()) as client:
+        return measure(op, bench.iterations, bench.warmup)
+
+
+def api_withdraw(bench: Bench) -> dict:
+    def op():
+        client.post("/transactions/withdraw", json={"sender_id": bench.user_id(), "amount": bench.amount()}).raise_for_status()
+
+    with app_client(InMemoryPublisher(InMemoryBroker()), FakeServer()) as client:
+        return measure(op, bench.iterations, bench.warmup)
+
+
+def api_user_transactions(bench: Bench) -> dict:
+    def op():
+        client.get(f"/transactions/{bench.user_id()}", params={"limit": 100}).raise_for_status()
+
+    with app_client(InMemoryPublisher(InMemoryBroker()), FakeServer()) as client:
+        return measure(op, bench.iterations, bench.warmup)
+
+
+def api_transaction_history(bench: Bench) -> dict:
+    def op():
+        client.get("/transactions/history/{}/{}".format(*bench.user_pair()), params={"limit": 100}).raise_for_status()
+
+    with app_client(InMemoryPublisher(InMemoryBroker()), FakeServer()) as client:
+        return measure(op, bench.iterations, bench.warmup)
+
+
+def _publish_withdrawals(bench: Bench, broker: InMemoryBroker, count: int):
+    for _ in range(count):
+        broker.put(os.environ["RABBITMQ_QUEUE"], json.dumps({"sender_id": bench.user_id(), "amount": bench.amount()}))
+
+
+def consumer_withdrawal(bench: Bench) -> dict:
+    broker = InMemoryBroker()
+    queue_name = os.environ["RABBITMQ_QUEUE"]
+    channel = InMemoryChannel()
+    _publish_withdrawals(bench, broker, bench.warmup + bench.iterations)
+
+    def op():
+        rabbit_consumer.callback(channel, *broker.get(queue_name))
+
+    with sync_redis(FakeServer()):
+        return measure(op, bench.iterations, bench.warmup)
+
+
+def consumer_batch(bench: Bench) -> dict:
+    """One op is one batch of CONSUMER_BATCH_SIZE messages."""
+    broker = InMemoryBroker()
+    queue_name = os.environ["RABBITMQ_QUEUE"]
+    channel = InMemoryChannel()
+    _publish_withdrawals(bench, broker, (bench.warmup + bench.iterations) * CONSUMER_BATCH_SIZE)
+
+    def op():
+        batch = [broker.get(queue_name) for _ in range(CONSUMER_BATCH_SIZE)]
+        with SessionLocal() as db:
+            rabbit_consumer.process_batch(db, channel, batch)
+
+    with sync_redis(FakeServer()):
+        return measure(op, bench.iterations, bench.warmup)
+
+
+def _service_scenario(bench: Bench, query, cold: bool) -> dict:
+    """Runs query(db, redis_service), cold run starts every call with empty cache."""
+    server = FakeServer()
+
+    async def setup():
+        nonlocal server
+        if cold:
+            server = FakeServer()
+
+    async def op():
+        async with AsyncSessionLocal() as db:
+            await query(db, FakeRedisService(server))
+
+    try:
+        return measure_async(op, bench.iterations, bench.warmup, setup)
+    finally:
+        async_engine.sync_engine.dispose(close=False)
+
+
+def service_user_transactions(bench: Bench, cold: bool) -> dict:
+    # warm run cycles through small set of users, so most calls hit cache
+    users = [bench.user_id() for _ in range(10)]
+    return _service_scenario(bench, lambda db, redis_service: TransactionService.get_user_transactions(
+        db, redis_service, bench.rnd.choice(users), page=PageParams(limit=100)
+    ), cold)
+
+
+def service_pair_history(bench: Bench, cold: bool) -> dict:
+    pairs = [bench.user_pair() for _ in range(10)]
+    return _service_scenario(bench, lambda db, redis_service: TransactionService.get_transactions_between_users(
+        db, redis_service, *bench.rnd.choice(pairs), PageParams(limit=100)
+    ), cold)
+
+
+def service_all_transactions_deep(bench: Bench) -> dict:
+    """Pages starting at random point of ledger, cost should not depend on how deep the page is."""
+    now = datetime.utcnow()
+
+    def query(db, redis_service):
+        after = now - timedelta(seconds=bench.rnd.random() * timedelta(days=LEDGER_DAYS).total_seconds())
+        return TransactionService.get_all_transactions(db, PageParams(limit=100, after=(after, 0)))
+
+    return _service_scenario(bench, query, cold=False)
+
+
+SCENARIOS = {
+    "api_transfer": api_transfer,
+    "api_withdraw": api_withdraw,
+    "api_user_transactions": api_user_transactions,
+    "api_transaction_history": api_transaction_history,
+    "consumer_withdrawal": consumer_withdrawal,
+    "consumer_batch": consumer_batch,
+    "service_user_transactions_cold": lambda bench: service_user_transactions(bench, cold=True),
+    "service_user_transactions_warm": lambda bench: service_user_transactions(bench, cold=False),
+    "service_pair_history_cold": lambda bench: service_pair_history(bench, cold=True),
+    "service_pair_history_warm": lambda bench: service_pair_history(bench, cold=False),
+    "service_all_transactions_deep": service_all_transactions_deep,
+}
@@ -0,0 +1,79 @@
+import collections
+import itertools
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import fakeredis
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeRedis
+from pika.spec import BasicProperties
+
+from services import redis_service
+from services.redis_service import RedisService
+
+
+class FakeRedisService(RedisService):
+    """RedisService on fakeredis, instances created from one server share data like connections to one redis."""
+
+    def __init__(self, server: FakeServer):
+        super().__init__(FakeRedis(server=server))
+
+
+@contextmanager
+def sync_redis(server: FakeServer):
+    """Replaces process wide client used by commit hooks."""
+    client = redis_service._sync_redis
+    redis_service._sync_redis = fakeredis.FakeRedis(server=server)
+    try:
+        yield
+    finally:
+        redis_service._sync_redis = client
+
+
+class InMemoryBroker:
+    """Direct exchanges bound to queue of the same name, which is how withdrawals queue is declared."""
+
+    def __init__(self):
+        self.queues = collections.defaultdict(collections.deque)
+        self._delivery_tags = itertools.count(1)
+
+    def put(self, exchange: str, body):
+        self.queues[exchange].append(body)
+
+    def get(self, queue_name: str):
+        """Returns (method, properties, body) like pika consumer gets or None when queue is empty."""
+        queue = self.queues[queue_name]
+        if not queue:
+            return None
+        return SimpleNamespace(delivery_tag=next(self._delivery_tags)), BasicProperties(delivery_mode=2), queue.popleft()
+
+
+class InMemoryChannel:
+    """Channel part used by consumer, only counts acks, nacks and published retries."""
+
+    def __init__(self):
+        self.acked = 0
+        self.nacked = 0
+        self.published = 0
+
+    def basic_ack(self, delivery_tag: int, multiple: bool = False):
+        self.acked += 1
+
+    def basic_nack(self, delivery_tag: int, multiple: bool = False, requeue: bool = True):
+        self.nacked += 1
+
+    def basic_publish(self, exchange: str, routing_key: str, body, properties: BasicProperties = None, mandatory: bool = False):
+        self.published += 1
+
+
+class InMemoryPublisher:
+    """Same interface as AsyncRabbitMQPublisher, published messages end up in broker queue."""
+
+    def __init__(self, broker: InMemoryBroker):
+        self.broker = broker
+
+    async def publish(self, exchange: str, routing_key: str, body: bytes, retries: int = 1):
+        self.broker.put(exchange, body)
+
+    async def close(self):
+        pass
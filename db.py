@@ -1,18 +1,35 @@
+import logging
 import os
+import random
+import time
 
 from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy_utils import database_exists, create_database
 
 SQLALCHEMY_DATABASE_URL = os.environ.get("DATABASE_URL")
+# engine connects on first use, importing db does not need database to be up
 engine = create_engine(SQLALCHEMY_DATABASE_URL)
-if not database_exists(engine.url):
-    # If not, create it
-    create_database(engine.url)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# async engine for read endpoints, so queries do not block event loop
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+async_engine = create_async_engine(engine.url.set(drivername=ASYNC_DRIVERS[engine.url.get_backend_name()]))
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# serialization_failure and deadlock_detected, transaction can be safely repeated
+RETRYABLE_SQLSTATES = {"40001", "40P01"}
+
+
+def ensure_database():
+    """Creates database if it does not exist yet, called by app startup once Postgres is reachable."""
+    if not database_exists(engine.url):
+        create_database(engine.url)
+
 
 def get_db():
     db = SessionLocal()
@@ -20,3 +37,32 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def get_sqlstate(e: OperationalError):
+    return getattr(e.orig, "pgcode", None) or getattr(e.orig, "sqlstate", None)
+
+
+def run_in_transaction(db: Session, work, retries: int = 3):
+    """Runs work() and commits, work is repeated from scratch when transaction is rolled back by serialization failure."""
+    for attempt in range(retries + 1):
+        try:
+            result = work()
+            db.commit()
+            return result
+        except OperationalError as e:
+            db.rollback()
+            sqlstate = get_sqlstate(e)
+            if sqlstate not in RETRYABLE_SQLSTATES or attempt == retries:
+                raise
+            logging.warning(f"Transaction rolled back ({sqlstate}), retrying")
+            time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+        except Exception:
+            # business errors (e.g. insufficient balance) must not leave first leg of transfer applied
+            db.rollback()
+            raise
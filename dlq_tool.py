@@ -0,0 +1,72 @@
+import argparse
+import json
+import logging
+import os
+import sys
+
+from pika import BasicProperties
+
+from services.rabbit_service import (
+    RETRY_COUNT_HEADER, RETRY_ID_HEADER, dead_letter_queue, get_rabbitmq_connection, withdrawal_route
+)
+
+
+def read_messages(channel, queue_name: str, limit: int):
+    """Yields up to limit (method, properties, body) from the queue, messages stay unacked until caller settles them."""
+    for _ in range(limit):
+        method, properties, body = channel.basic_get(queue=queue_name, auto_ack=False)
+        if method is None:
+            return
+        yield method, properties, body
+
+
+def list_messages(channel, queue_name: str, limit: int):
+    for method, properties, body in read_messages(channel, queue_name, limit):
+        headers = properties.headers or {}
+        print(json.dumps({"retry_count": headers.get(RETRY_COUNT_HEADER, 0), "body": body.decode(errors="replace")}))
+    # nothing was acked, closing channel returns messages to the queue
+
+
+def replay_messages(channel, queue_name: str, withdrawal_queue: str, limit: int) -> int:
+    """
+    Publishes messages back to withdrawal queue with fresh retry count and id, dead letter copy is removed once
+    confirmed.
+    """
+    channel.confirm_delivery()
+    replayed = 0
+    for method, properties, body in read_messages(channel, queue_name, limit):
+        headers = {key: value for key, value in (properties.headers or {}).items()
+                   if key not in (RETRY_COUNT_HEADER, RETRY_ID_HEADER)}
+        # routed by sender again, partition count could be changed since the message failed
+        exchange, routing_key = withdrawal_route(withdrawal_queue, json.loads(body).get("sender_id"))
+        channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body,
+                              properties=BasicProperties(delivery_mode=2, headers=headers), mandatory=True)
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+        replayed += 1
+    return replayed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and replay withdrawals from dead letter queue")
+    parser.add_argument("command", choices=["list", "replay"])
+    parser.add_argument("--limit", type=int, default=100, help="number of messages to list or replay")
+    args = parser.parse_args()
+
+    withdrawal_queue = os.environ.get("RABBITMQ_QUEUE")
+    if not withdrawal_queue:
+        logging.error("Environment variable RABBITMQ_QUEUE not set")
+        sys.exit(1)
+
+    rabbitmq = get_rabbitmq_connection()
+    try:
+        if args.command == "list":
+            list_messages(rabbitmq.channel, dead_letter_queue(withdrawal_queue), args.limit)
+        else:
+            replayed = replay_messages(rabbitmq.channel, dead_letter_queue(withdrawal_queue), withdrawal_queue, args.limit)
+            print(json.dumps({"replayed": replayed}))
+    finally:
+        rabbitmq.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+class TransferError(Exception):
+    def __init__(self, message=""):
+        self.message = message
+        super().__init__(self.message)
+
+
+class TransferBatchError(TransferError):
+    def __init__(self, results, message="Batch rolled back"):
+        self.results = results
+        super().__init__(message)
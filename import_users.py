@@ -0,0 +1,40 @@
+import argparse
+import json
+import logging
+import sys
+
+from db import SessionLocal
+from services.user_import_service import ImportFormat, UserImportService
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import users from JSONL or CSV file")
+    parser.add_argument("path", help="file to import, - reads stdin")
+    parser.add_argument("--format", dest="import_format", choices=[f.value for f in ImportFormat],
+                        help="defaults to file extension, jsonl when it can not be guessed")
+    args = parser.parse_args()
+
+    import_format = ImportFormat(args.import_format or (ImportFormat.CSV if args.path.endswith(".csv") else ImportFormat.JSONL))
+    lines = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8", errors="replace", newline="")
+
+    db = SessionLocal()
+    try:
+        result = UserImportService.import_users(db, lines, import_format)
+        db.commit()
+    except Exception as e:
+        logging.exception(e)
+        db.rollback()
+        sys.exit(1)
+    finally:
+        db.close()
+        if lines is not sys.stdin:
+            lines.close()
+
+    # rejects go to stderr one per line, so they can be fixed and imported again
+    for reject in result["rejected"]:
+        print(json.dumps(reject), file=sys.stderr)
+    print(json.dumps({"imported": result["imported"], "rejected": len(result["rejected"])}))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,47 +1,109 @@
+import asyncio
 import logging
 import os
-import time
-from typing import List
-
-from fastapi import FastAPI, Depends, HTTPException
-from pika import exceptions
-from pika.spec import BasicProperties
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+from typing import Callable, Optional
+
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from aio_pika import exceptions as aio_exceptions
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from db import get_db
-from models import TransactionType
-from pydantic_models.transaction import TransactionOut, TransactionCreate, WithdrawCreate
-from services.rabbit_service import RabbitMQConnection, get_rabbitmq_connection
-from services.redis_service import RedisService, get_redis_service
+from db import SessionLocal, ensure_database, get_db, get_async_db, run_in_transaction
+from errors.transfer_error import TransferBatchError, TransferError
+from models import MoneyTransaction, TransactionType
+from pydantic_models.health import HealthOut, ReadinessOut
+from pydantic_models.page import Page, PageParams, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor
+from pydantic_models.transaction import TransactionOut, TransactionCreate, WithdrawCreate, TransferBatchCreate, TransferBatchOut, TransferPairSummary
+from services.export_service import ExportFormat, ExportService, EXPORT_MEDIA_TYPES
+from services.rabbit_service import (
+    AsyncRabbitMQPublisher, close_async_rabbitmq_publisher, declare_withdrawal_queues, get_async_rabbitmq_publisher,
+    get_rabbitmq_connection, withdrawal_route
+)
+from services.group_commit_service import GROUP_COMMIT_SIZE, close_transfer_committer, get_transfer_committer
+from services.health_service import HealthService
+from services.redis_service import RedisService, close_redis, get_redis, get_redis_service
+from services.pagination import page_response
+from services.partition_service import PartitionService
 from services.transaction_service import TransactionService
+from services.transfer_pair_service import TransferPairService
+from services.user_import_service import ImportFormat, UserImportService
 from services.user_service import UserService
-from pydantic_models.user import UserOut, UserCreate
-
-app = FastAPI()
+from services.user_stats_service import UserStatsService
+from pydantic_models.user import UserOut, UserCreate, UserImportOut, UserStatsOut
 
 
-def setup_rabbitmq_with_retry(retries=5, delay=5):
-    rabbitmq = None
-    queue_name = os.environ.get("RABBITMQ_QUEUE")
-    for _ in range(retries):
-        try:
-            rabbitmq = get_rabbitmq_connection()
-            rabbitmq.channel.exchange_declare(exchange=queue_name, exchange_type="direct", durable=True)
-            rabbitmq.channel.queue_declare(queue=queue_name, durable=True)
-            rabbitmq.channel.queue_bind(exchange=queue_name, queue=queue_name, routing_key="")
-            break
-        except exceptions.AMQPConnectionError as e:
-            logging.warning(f"RabbitMQ connection failed: {e}. Retrying in {delay} seconds...")
-            time.sleep(delay)
-    if not rabbitmq:
-        logging.error("Failed to connect to RabbitMQ after several attempts.")
-        raise ConnectionError("RabbitMQ setup failed")
-    return rabbitmq
-
-
-@app.on_event("startup")
 def setup_rabbitmq():
-    setup_rabbitmq_with_retry()
+    rabbitmq = get_rabbitmq_connection()
+    try:
+        declare_withdrawal_queues(rabbitmq.channel, os.environ.get("RABBITMQ_QUEUE"))
+    finally:
+        rabbitmq.close()
+
+
+def setup_database():
+    ensure_database()
+    # inserts fail once current month has no partition, app start makes sure upcoming ones exist
+    db = SessionLocal()
+    try:
+        created = PartitionService.ensure_partitions(db)
+        db.commit()
+        if created:
+            logging.info(f"Created transaction partitions: {created}")
+    finally:
+        db.close()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # app serves right away, dependencies are set up in background and /ready tells when they are reachable
+    setup_tasks = [
+        HealthService.start_setup("postgres", setup_database),
+        HealthService.start_setup("rabbitmq", setup_rabbitmq),
+    ]
+    # shared by all requests, one connection pool per process
+    get_redis()
+    yield
+    for task in setup_tasks:
+        task.cancel()
+    # transfers already queued for group commit are still applied
+    await run_in_threadpool(close_transfer_committer)
+    await close_async_rabbitmq_publisher()
+    await close_redis()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+def get_page_params(
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        cursor: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+) -> PageParams:
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return PageParams(limit=limit, after=after, since=since, until=until)
+
+
+@app.get("/health", response_model=HealthOut)
+async def health():
+    # liveness only, slow dependency must not get the process restarted
+    return {"status": "ok"}
+
+
+@app.get("/ready", response_model=ReadinessOut)
+async def ready(response: Response):
+    readiness = await HealthService.readiness()
+    if not readiness["ready"]:
+        response.status_code = 503
+    return readiness
 
 
 @app.post("/users/", response_model=UserOut)
@@ -56,68 +118,122 @@ def create_user(user: UserCreate, db: Session = Depends(get_db)):
     return db_user
 
 
-@app.get("/users/", response_model=List[UserOut])
-def get_users(db: Session = Depends(get_db)):
-    # if there are a lot of users then paging is needed
-    return UserService.get_users(db)
+@app.post("/users/import", response_model=UserImportOut)
+async def import_users(request: Request, import_format: ImportFormat = Query(ImportFormat.JSONL, alias="format"), db: Session = Depends(get_db)):
+    # raw body instead of multipart upload, file is sent with curl --data-binary
+    with await UserImportService.spool(request.stream()) as lines:
+        try:
+            result = await run_in_threadpool(UserImportService.import_users, db, lines, import_format)
+            await run_in_threadpool(db.commit)
+        except Exception as e:
+            logging.exception(e)
+            await run_in_threadpool(db.rollback)
+            raise HTTPException(status_code=400, detail="Unable to import users, please try again later")
+
+    return result
+
+
+@app.get("/users/", response_model=Page[UserOut])
+async def get_users(db: AsyncSession = Depends(get_async_db), page: PageParams = Depends(get_page_params)):
+    return page_response(await UserService.get_users(db, page), UserOut)
 
 
-@app.post("/transactions/transfer", response_model=TransactionOut)
-def transfer_money(transaction: TransactionCreate, db: Session = Depends(get_db)):
-    sender = UserService.fetch(db, transaction.sender_id)
-    receiver = UserService.fetch(db, transaction.receiver_id)
-    if not sender or not receiver:
-        raise HTTPException(status_code=404, detail="User not found")
+@app.get("/users/{user_id}/stats", response_model=UserStatsOut)
+async def get_user_stats(user_id: int, since: Optional[date] = None, until: Optional[date] = None, db: AsyncSession = Depends(get_async_db)):
+    # read from daily rollups, transactions table is not scanned
+    return await UserStatsService.get_stats(db, user_id, since, until)
 
-    if sender.balance < transaction.amount:
-        raise HTTPException(status_code=404, detail="Insufficient balance")
 
+def transfer_response(transfer: Callable[[], MoneyTransaction]) -> MoneyTransaction:
     try:
-        db_transaction = TransactionService.transfer_money(db, sender, receiver, transaction.amount, TransactionType.TRANSFER)
-        db.commit()
+        return transfer()
+    except TransferError as e:
+        raise HTTPException(status_code=404, detail=e.message)
     except Exception as e:
         logging.exception(e)
         raise HTTPException(status_code=400, detail="Unable to transfer money, please try again later")
 
-    return db_transaction
+
+if GROUP_COMMIT_SIZE > 1:
+    @app.post("/transactions/transfer", response_model=TransactionOut)
+    def transfer_money(transaction: TransactionCreate):
+        # waits until the transfer is committed together with transfers of concurrent requests, committer has its
+        # own sessions, so request does not open one
+        return transfer_response(lambda: get_transfer_committer().transfer(transaction))
+else:
+    @app.post("/transactions/transfer", response_model=TransactionOut)
+    def transfer_money(transaction: TransactionCreate, db: Session = Depends(get_db)):
+        return transfer_response(lambda: run_in_transaction(db, lambda: TransactionService.transfer_money(
+            db, transaction.sender_id, transaction.receiver_id, transaction.amount, TransactionType.TRANSFER
+        )))
+
+
+@app.post("/transactions/transfer/batch", response_model=TransferBatchOut)
+def transfer_money_batch(batch: TransferBatchCreate, db: Session = Depends(get_db)):
+    try:
+        results = run_in_transaction(db, lambda: TransactionService.transfer_batch(db, batch.items, batch.mode))
+    except TransferBatchError as e:
+        return TransferBatchOut(committed=False, results=e.results)
+    except Exception as e:
+        logging.exception(e)
+        raise HTTPException(status_code=400, detail="Unable to transfer money, please try again later")
+
+    return TransferBatchOut(committed=True, results=results)
 
 
 @app.post("/transactions/withdraw")
-def withdraw_money(transaction: WithdrawCreate, rabbitmq: RabbitMQConnection = Depends(get_rabbitmq_connection)):
-    message = transaction.json()
-    queue_name = os.environ.get("RABBITMQ_QUEUE")
+async def withdraw_money(transaction: WithdrawCreate, publisher: AsyncRabbitMQPublisher = Depends(get_async_rabbitmq_publisher)):
+    message = transaction.json().encode()
+    exchange, routing_key = withdrawal_route(os.environ.get("RABBITMQ_QUEUE"), transaction.sender_id)
 
     try:
-        rabbitmq.channel.basic_publish(
-            exchange=queue_name,
-            routing_key="",
-            body=message,
-            properties=BasicProperties(
-                delivery_mode=2
-            )
-        )
-    except exceptions.AMQPError as e:
+        # waits for broker confirm without holding a thread
+        await publisher.publish(exchange=exchange, routing_key=routing_key, body=message)
+    except (aio_exceptions.AMQPError, asyncio.TimeoutError) as e:
         logging.error(f"Failed to publish message: {e}")
         raise HTTPException(status_code=500, detail="Failed to publish message")
 
     return {"message": "Withdrawal request submitted"}
 
 
-@app.get("/transactions/", response_model=List[TransactionOut])
-async def get_all_transactions(db: Session = Depends(get_db), redis_service: RedisService = Depends(get_redis_service)):
-    return await TransactionService.get_all_transactions(db, redis_service)
+@app.get("/transactions/", response_model=Page[TransactionOut])
+async def get_all_transactions(db: AsyncSession = Depends(get_async_db), page: PageParams = Depends(get_page_params)):
+    return page_response(await TransactionService.get_all_transactions(db, page), TransactionOut)
+
+
+# declared before /transactions/{user_id}, otherwise "export" would be matched as user id
+@app.get("/transactions/export")
+async def export_transactions(
+        export_format: ExportFormat = Query(ExportFormat.NDJSON, alias="format"),
+        user_id: Optional[int] = None,
+        transaction_type: Optional[TransactionType] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+):
+    page = PageParams(since=since, until=until)
+    statement = TransactionService.filter_transactions(select(MoneyTransaction), user_id, transaction_type, page.since, page.until)
+    return StreamingResponse(
+        ExportService.stream_transactions(statement, export_format),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f"attachment; filename=transactions.{export_format.value}"}
+    )
+
+
+@app.get("/transactions/{user_id}", response_model=Page[TransactionOut])
+async def get_transactions_for_user(user_id: int, db: AsyncSession = Depends(get_async_db), redis_service: RedisService = Depends(get_redis_service), page: PageParams = Depends(get_page_params)):
+    return page_response(await TransactionService.get_user_transactions(db, redis_service, user_id, page=page), TransactionOut)
 
 
-@app.get("/transactions/{user_id}", response_model=List[TransactionOut])
-async def get_transactions_for_user(user_id: int, db: Session = Depends(get_db), redis_service: RedisService = Depends(get_redis_service)):
-    return await TransactionService.get_user_transactions(db, redis_service, user_id)
+@app.get("/transactions/{user_id}/{transaction_type}", response_model=Page[TransactionOut])
+async def get_transactions_for_user(user_id: int, transaction_type: TransactionType, db: AsyncSession = Depends(get_async_db), redis_service: RedisService = Depends(get_redis_service), page: PageParams = Depends(get_page_params)):
+    return page_response(await TransactionService.get_user_transactions(db, redis_service, user_id, transaction_type, page), TransactionOut)
 
 
-@app.get("/transactions/{user_id}/{transaction_type}", response_model=List[TransactionOut])
-async def get_transactions_for_user(user_id: int, transaction_type: TransactionType, db: Session = Depends(get_db), redis_service: RedisService = Depends(get_redis_service)):
-    return await TransactionService.get_user_transactions(db, redis_service, user_id, transaction_type)
+@app.get("/transactions/history/{user1_id}/{user2_id}", response_model=Page[TransactionOut])
+async def get_transaction_history(user1_id: int, user2_id: int, db: AsyncSession = Depends(get_async_db), redis_service: RedisService = Depends(get_redis_service), page: PageParams = Depends(get_page_params)):
+    return page_response(await TransactionService.get_transactions_between_users(db, redis_service, user1_id, user2_id, page), TransactionOut)
 
 
-@app.get("/transactions/history/{user1_id}/{user2_id}", response_model=List[TransactionOut])
-async def get_transaction_history(user1_id: int, user2_id: int, db: Session = Depends(get_db), redis_service: RedisService = Depends(get_redis_service)):
-    return await TransactionService.get_transactions_between_users(db, redis_service, user1_id, user2_id)
+@app.get("/transactions/history/{user1_id}/{user2_id}/summary", response_model=TransferPairSummary)
+async def get_transaction_history_summary(user1_id: int, user2_id: int, db: AsyncSession = Depends(get_async_db)):
+    return await TransferPairService.get_summary(db, user1_id, user2_id)
@@ -0,0 +1,35 @@
+import argparse
+import json
+import logging
+import sys
+
+from db import SessionLocal
+from services.partition_service import PARTITIONS_AHEAD, RETENTION_MONTHS, PartitionService
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create upcoming monthly partitions of transactions and drop expired ones")
+    parser.add_argument("--ahead", type=int, default=PARTITIONS_AHEAD, help="months to create partitions for ahead")
+    # dropping detaches partitions, which locks whole transactions table (ACCESS EXCLUSIVE) until commit
+    parser.add_argument("--retention-months", type=int, default=RETENTION_MONTHS,
+                        help="drop partitions older than this many months, 0 keeps all of them, dropping blocks "
+                             "all transfers, withdrawals and transaction reads until it commits, run it off-peak")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        created = PartitionService.ensure_partitions(db, args.ahead)
+        dropped = PartitionService.drop_expired_partitions(db, args.retention_months)
+        db.commit()
+    except Exception as e:
+        logging.exception(e)
+        db.rollback()
+        sys.exit(1)
+    finally:
+        db.close()
+
+    print(json.dumps({"created": created, "dropped": dropped}))
+
+
+if __name__ == "__main__":
+    main()
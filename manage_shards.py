@@ -0,0 +1,49 @@
+import argparse
+import json
+import logging
+import sys
+
+from db import SessionLocal
+from services.balance_shard_service import BalanceShardService
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split balance of hot accounts over shards and consolidate shards")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    shard_parser = subparsers.add_parser("shard", help="set number of balance shards of a user, 0 turns sharding off")
+    shard_parser.add_argument("user_id", type=int)
+    shard_parser.add_argument("--shards", type=int, required=True)
+    consolidate_parser = subparsers.add_parser("consolidate", help="move balance of shards to users rows")
+    consolidate_parser.add_argument("user_ids", type=int, nargs="*", help="users to consolidate, all sharded users by default")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.command == "shard":
+            if not BalanceShardService.set_shards(db, args.user_id, args.shards):
+                print(f"User {args.user_id} not found", file=sys.stderr)
+                sys.exit(1)
+            db.commit()
+            summary = {"user_id": args.user_id, "shards": args.shards}
+        else:
+            consolidated = {}
+            for user_id in args.user_ids or BalanceShardService.sharded_users(db):
+                # every user in own short transaction, its users row is locked only while its shards are moved
+                consolidated[user_id] = str(BalanceShardService.consolidate(db, user_id))
+                db.commit()
+            summary = {"consolidated": consolidated}
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        logging.exception(e)
+        db.rollback()
+        sys.exit(1)
+    finally:
+        db.close()
+
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,7 @@
 from models.base_model import BaseModel
 from models.money_transaction import MoneyTransaction, TransactionType
+from models.balance_shard import BalanceShard
 from models.user import User
+from models.transfer_pair import TransferPair
+from models.ledger_total import LedgerTotal, ReconciliationCheckpoint
+from models.user_daily_stat import UserDailyStat
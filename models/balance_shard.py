@@ -0,0 +1,11 @@
+from sqlalchemy import Column, Integer, ForeignKey, Numeric
+from models import BaseModel
+
+
+class BalanceShard(BaseModel):
+    """Part of balance of a sharded user, credits of the user are spread over its shards (see User.shard_count)."""
+    __tablename__ = "balance_shards"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    balance = Column(Numeric(precision=12, scale=2), nullable=False, default=0)
@@ -1,11 +1,28 @@
 from datetime import datetime
 from decimal import Decimal
+from functools import lru_cache
+from operator import attrgetter
+from typing import Callable, Optional, Tuple
 
+from sqlalchemy import DateTime, Numeric
 from sqlalchemy.orm import declared_attr, declarative_base
 MAX_FLOAT = 999999999999
 Base = declarative_base()
 
 
+def _decimal_to_str(value):
+    # numeric attribute of not yet flushed row could still hold float or int
+    return str(value) if isinstance(value, Decimal) else value
+
+
+def _converter(column_type) -> Optional[Callable]:
+    if isinstance(column_type, DateTime):
+        return datetime.isoformat  # Convert datetime to ISO format string
+    if isinstance(column_type, Numeric):
+        return _decimal_to_str  # Convert Decimal to string
+    return None
+
+
 class BaseModel(Base):
     __abstract__ = True
 
@@ -13,13 +30,27 @@ class BaseModel(Base):
     def __tablename__(cls):
         return cls.__name__.lower()
 
+    @classmethod
+    @lru_cache(maxsize=None)
+    def row_encoder(cls, fields: Tuple[str, ...] = None) -> Callable[["BaseModel"], dict]:
+        """
+        Returns function which converts row to json compatible dict of given fields (all columns by default).
+        Conversions are picked once per model from column types, not for every value.
+        """
+        columns = cls.__table__.columns
+        names = tuple(fields or (column.name for column in columns))
+        get_values = attrgetter(*names)
+        converters = [(i, converter) for i, name in enumerate(names) if (converter := _converter(columns[name].type))]
+
+        def encode(row) -> dict:
+            values = get_values(row)
+            values = list(values) if len(names) > 1 else [values]
+            for i, converter in converters:
+                if values[i] is not None:
+                    values[i] = converter(values[i])
+            return dict(zip(names, values))
+
+        return encode
+
     def to_dict(self):
-        result = {}
-        for column in self.__table__.columns:
-            value = getattr(self, column.name)
-            if isinstance(value, datetime):
-                value = value.isoformat()  # Convert datetime to ISO format string
-            elif isinstance(value, Decimal):
-                value = str(value)  # Convert Decimal to string
-            result[column.name] = value
-        return result
\ No newline at end of file
+        return self.row_encoder()(self)
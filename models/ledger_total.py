@@ -0,0 +1,23 @@
+from sqlalchemy import Column, Integer, ForeignKey, Numeric, DateTime, String, func
+from models import BaseModel
+
+
+class LedgerTotal(BaseModel):
+    """Debits and credits of a user summed over ledger up to reconciliation checkpoint."""
+    __tablename__ = "ledger_totals"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    debits = Column(Numeric(precision=18, scale=2), nullable=False, default=0)
+    credits = Column(Numeric(precision=18, scale=2), nullable=False, default=0)
+    transaction_count = Column(Integer, nullable=False, default=0)
+
+
+class ReconciliationCheckpoint(BaseModel):
+    """Last transaction folded into ledger totals, transactions with higher id are not reconciled yet."""
+    __tablename__ = "reconciliation_checkpoints"
+
+    name = Column(String(50), primary_key=True)
+    last_transaction_id = Column(Integer, nullable=False, default=0)
+    # created_at of checkpoint transaction, next run reads only partitions from around this time on
+    last_created_at = Column(DateTime)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
@@ -1,6 +1,6 @@
 import enum
 
-from sqlalchemy import Column, Integer, Enum, ForeignKey, Numeric, DateTime, func
+from sqlalchemy import Column, Integer, Enum, ForeignKey, Numeric, DateTime, func, Index
 from models import BaseModel
 
 
@@ -10,11 +10,38 @@ class TransactionType(str, enum.Enum):
 
 
 class MoneyTransaction(BaseModel):
+    """
+    In postgres the table is partitioned by created_at month (see PartitionService), its primary key is
+    (id, created_at). Ids come from one sequence and are unique, so id alone identifies the row for ORM.
+    """
     __tablename__ = "transactions"
+    __table_args__ = (
+        # per user history is read in created_at order, so created_at is part of every index
+        Index("ix_transactions_sender_id_created_at", "sender_id", "created_at"),
+        Index("ix_transactions_receiver_id_created_at", "receiver_id", "created_at"),
+        Index("ix_transactions_sender_id_type_created_at", "sender_id", "type", "created_at"),
+        Index("ix_transactions_receiver_id_type_created_at", "receiver_id", "type", "created_at"),
+        # keyset pagination order
+        Index("ix_transactions_created_at_id", "created_at", "id"),
+    )
+    # created_at is returned by INSERT, so inserted rows can be used without refresh
+    __mapper_args__ = {"eager_defaults": True}
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     type = Column(Enum(TransactionType))
-    sender_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
-    receiver_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
+    sender_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    receiver_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     amount = Column(Numeric(precision=12, scale=2), default=0.0)
-    created_at = Column(DateTime, default=func.now())
+    # partition key, row without it could not be routed to partition
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+
+
+# transfers between two users regardless of direction, used by history between users
+Index(
+    "ix_transactions_pair_created_at",
+    func.least(MoneyTransaction.sender_id, MoneyTransaction.receiver_id),
+    func.greatest(MoneyTransaction.sender_id, MoneyTransaction.receiver_id),
+    MoneyTransaction.created_at,
+    MoneyTransaction.id,
+    postgresql_where=MoneyTransaction.type == TransactionType.TRANSFER
+)
@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Integer, ForeignKey, Numeric, DateTime
+from models import BaseModel
+
+
+class TransferPair(BaseModel):
+    """Running totals of transfers between two users, keyed by ordered (low_user_id, high_user_id) pair."""
+    __tablename__ = "transfer_pairs"
+
+    low_user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    high_user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    low_to_high_amount = Column(Numeric(precision=18, scale=2), nullable=False, default=0)
+    low_to_high_count = Column(Integer, nullable=False, default=0)
+    high_to_low_amount = Column(Numeric(precision=18, scale=2), nullable=False, default=0)
+    high_to_low_count = Column(Integer, nullable=False, default=0)
+    first_transfer_at = Column(DateTime)
+    last_transfer_at = Column(DateTime)
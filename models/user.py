@@ -1,11 +1,37 @@
-from sqlalchemy import Column, Integer, String, DateTime, func, Numeric
+from sqlalchemy import Column, Integer, String, DateTime, event, func, Numeric, Index, select
+from sqlalchemy.orm import column_property
 from models import BaseModel
+from models.balance_shard import BalanceShard
 
 
 class User(BaseModel):
     __tablename__ = "users"
+    __table_args__ = (
+        # keyset pagination order
+        Index("ix_users_created_at_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100))
-    balance = Column(Numeric(precision=12, scale=2), default=0.0)
+    # part of balance kept on users row, writes go here, balance of sharded user is split with its balance shards
+    main_balance = Column("balance", Numeric(precision=12, scale=2), default=0.0)
+    # credits of user with shards go to one of its shard_count balance_shards rows, 0 keeps whole balance on users row
+    shard_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # balance the user was created with, balance is always opening_balance + credits - debits of the ledger
+    opening_balance = Column(
+        Numeric(precision=12, scale=2), nullable=False,
+        default=lambda context: context.get_current_parameters()["balance"]
+    )
     created_at = Column(DateTime, default=func.now())
+    # whole balance, users row plus shards, loaded together with the row
+    balance = column_property(
+        main_balance + func.coalesce(
+            select(func.sum(BalanceShard.balance)).where(BalanceShard.user_id == id).scalar_subquery(), 0
+        )
+    )
+
+
+@event.listens_for(User.balance, "set")
+def refuse_balance_write(target, value, oldvalue, initiator):
+    # balance is computed from users row and shards, assigned value would never be persisted
+    raise AttributeError("User.balance is read only, write main_balance instead")
@@ -0,0 +1,19 @@
+from sqlalchemy import Column, Integer, Enum, ForeignKey, Numeric, Date
+from models import BaseModel
+from models.money_transaction import TransactionType
+
+
+class UserDailyStat(BaseModel):
+    """
+    Running totals of user transactions of one type in one day. Withdrawals have only sender, so their amounts are
+    in sent columns of WITHDRAWAL rows.
+    """
+    __tablename__ = "user_daily_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    type = Column(Enum(TransactionType), primary_key=True)
+    sent_amount = Column(Numeric(precision=18, scale=2), nullable=False, default=0)
+    sent_count = Column(Integer, nullable=False, default=0)
+    received_amount = Column(Numeric(precision=18, scale=2), nullable=False, default=0)
+    received_count = Column(Integer, nullable=False, default=0)
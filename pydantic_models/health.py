@@ -0,0 +1,18 @@
+from typing import Dict, Optional
+
+from pydantic import BaseModel
+
+
+class HealthOut(BaseModel):
+    status: str
+
+
+class DependencyReadiness(BaseModel):
+    ready: bool
+    latency_ms: float
+    error: Optional[str] = None
+
+
+class ReadinessOut(BaseModel):
+    ready: bool
+    dependencies: Dict[str, DependencyReadiness]
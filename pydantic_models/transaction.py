@@ -1,11 +1,15 @@
+import enum
+from datetime import datetime
 from decimal import Decimal
 
 from pydantic import BaseModel, field_validator, Field
-from typing import Optional
+from typing import List, Optional
 
 from models import TransactionType
 from models.base_model import MAX_FLOAT
 
+MAX_TRANSFER_BATCH_SIZE = 10000
+
 
 class TransactionBase(BaseModel):
     amount: Decimal = Field(..., ge=0.01, le=MAX_FLOAT, decimal_places=2)
@@ -26,6 +30,41 @@ class TransactionOut(BaseModel):
     receiver_id: Optional[int]
     type: TransactionType
     amount: Decimal
+    created_at: Optional[datetime] = None
 
     class Config:
         orm_mode = True
+
+
+class TransferBatchMode(str, enum.Enum):
+    ALL_OR_NOTHING = "all_or_nothing"
+    BEST_EFFORT = "best_effort"
+
+
+class TransferBatchCreate(BaseModel):
+    items: List[TransactionCreate] = Field(..., min_length=1, max_length=MAX_TRANSFER_BATCH_SIZE)
+    mode: TransferBatchMode = TransferBatchMode.ALL_OR_NOTHING
+
+
+class TransferResult(BaseModel):
+    index: int
+    ok: bool
+    transaction: Optional[TransactionOut] = None
+    error: Optional[str] = None
+
+
+class TransferBatchOut(BaseModel):
+    committed: bool
+    results: List[TransferResult]
+
+
+class TransferPairSummary(BaseModel):
+    user1_id: int
+    user2_id: int
+    # amounts and counts are from user1 point of view
+    sent_amount: Decimal
+    sent_count: int
+    received_amount: Decimal
+    received_count: int
+    first_transfer_at: Optional[datetime] = None
+    last_transfer_at: Optional[datetime] = None
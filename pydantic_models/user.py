@@ -1,5 +1,7 @@
 import math
+from datetime import date
 from decimal import Decimal
+from typing import List, Optional
 
 from pydantic import BaseModel, Field, field_validator
 
@@ -18,3 +20,38 @@ class UserOut(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+class UserImportReject(BaseModel):
+    line: int
+    error: str
+
+
+class UserImportOut(BaseModel):
+    imported: int
+    rejected: List[UserImportReject]
+
+
+class UserDayStats(BaseModel):
+    day: date
+    sent_amount: Decimal
+    sent_count: int
+    received_amount: Decimal
+    received_count: int
+    withdrawn_amount: Decimal
+    withdrawn_count: int
+
+
+class UserStatsOut(BaseModel):
+    user_id: int
+    since: Optional[date] = None
+    until: Optional[date] = None
+    # totals over the whole range, sent and received are transfers
+    sent_amount: Decimal
+    sent_count: int
+    received_amount: Decimal
+    received_count: int
+    withdrawn_amount: Decimal
+    withdrawn_count: int
+    # only days with transactions
+    days: List[UserDayStats]
@@ -1,20 +1,50 @@
 import json
 import logging
+import multiprocessing
+import multiprocessing.connection
 import os
 import random
+import signal
 import sys
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
 
+from pika import BasicProperties, exceptions
 from sqlalchemy.orm import Session
 
-from db import SessionLocal
+from db import SessionLocal, engine
 from errors.withdraw_error import WithdrawError
 from pydantic_models.transaction import WithdrawCreate
-from services.rabbit_service import RabbitMQConnection, get_rabbitmq_connection
+from services.rabbit_service import (
+    MAX_ATTEMPTS, RETRY_COUNT_HEADER, RETRY_DELAYS_MS, RETRY_ID_HEADER, RabbitMQConnection, dead_letter_queue,
+    declare_withdrawal_queues, get_rabbitmq_connection, parse_partitions, retry_exchange, withdrawal_route
+)
 from services.transaction_service import TransactionService
 
 
-def process_withdrawal(db: Session, channel, method, body):
+QUEUE_NAME = os.environ.get("RABBITMQ_QUEUE")
+# batch mode is enabled when batch size is bigger than 1
+BATCH_SIZE = int(os.environ.get("WITHDRAWAL_BATCH_SIZE", 1))
+BATCH_TIMEOUT_MS = int(os.environ.get("WITHDRAWAL_BATCH_TIMEOUT_MS", 50))
+PREFETCH_COUNT = int(os.environ.get("RABBITMQ_PREFETCH_COUNT", BATCH_SIZE))
+# consumer processes, more than 1 runs supervisor which forks them
+WORKERS = int(os.environ.get("WITHDRAWAL_WORKERS", 1))
+# seconds worker has to drain its deliveries before it is killed
+SHUTDOWN_TIMEOUT = int(os.environ.get("WITHDRAWAL_SHUTDOWN_TIMEOUT", 30))
+SHUTDOWN_CHECK_INTERVAL = 1
+RESTART_DELAY = 1
 
+# set by SIGTERM/SIGINT, every process has its own copy
+shutdown = threading.Event()
+
+
+def settle_withdrawal(db: Session, body, commit) -> bool:
+    """
+    Applies withdrawal message and calls commit. Returns True when message should be acked, False when it should be
+    retried.
+    """
     try:
         # Introduce a 10% chance of failure
         if random.random() < 0.1:
@@ -24,48 +54,360 @@ def process_withdrawal(db: Session, channel, method, body):
         transaction = WithdrawCreate(**transaction_data)  # Convert to WithdrawCreate object
 
         TransactionService.withdraw_money(db, transaction)
-        db.commit()
-        channel.basic_ack(delivery_tag=method.delivery_tag)
+        commit()
+        return True
     except json.JSONDecodeError as e:
         logging.error(f"Failed to decode JSON: {e}")
-        channel.basic_ack(delivery_tag=method.delivery_tag)
+        return True
     except TypeError:
         # incorrect messages we do not process
-        channel.basic_ack(delivery_tag=method.delivery_tag)
+        return True
     except WithdrawError as e:
         logging.error(f"Failed to transfer money: {e}")
         # incorrect messages we do not process
+        return True
+    except Exception as e:
+        logging.exception(e)
+        return False
+
+
+class SenderRetries:
+    """
+    Withdrawals of every sender waiting in retry queues, in the order they have to be applied. Message of the sender
+    which arrives while an earlier one waits is parked, i.e. sent to retry queue of the first waiting one with its
+    attempts kept, so it comes back behind it. Partition has single active consumer, so the process sees all messages
+    of its senders, after restart or failover of the consumer messages coming back from retry queues are applied as
+    they arrive.
+    """
+
+    def __init__(self):
+        # sender id -> retry id -> delay of retry queue the message waits in, first one is applied next
+        self.waiting: Dict[int, Dict[str, int]] = {}
+
+    def parked_delay(self, sender_id, retry_id: Optional[str], settled=()) -> Optional[int]:
+        """Delay message has to be parked with, None when nothing of its sender waits before it."""
+        for waiting_id, delay_ms in self.waiting.get(sender_id, {}).items():
+            if waiting_id == retry_id:
+                return None
+            # already settled in the same batch, it is just not committed yet
+            if waiting_id not in settled:
+                return delay_ms
+        return None
+
+    def retried(self, sender_id, retry_id: str, delay_ms: int):
+        # message which waits already keeps its place
+        if sender_id is not None:
+            self.waiting.setdefault(sender_id, {})[retry_id] = delay_ms
+
+    def settled(self, sender_id, retry_id: Optional[str]):
+        """Message was applied, rejected or dead lettered, later messages of the sender do not wait for it anymore."""
+        waiting = self.waiting.get(sender_id)
+        if waiting and waiting.pop(retry_id, None) is not None and not waiting:
+            del self.waiting[sender_id]
+
+
+# every process has its own copy
+sender_retries = SenderRetries()
+
+
+def process_withdrawal(db: Session, channel, method, properties, body):
+    sender_id, retry_id = get_sender_id(body), get_retry_id(properties)
+    parked_delay = sender_retries.parked_delay(sender_id, retry_id)
+    if parked_delay is not None:
+        settle(channel, [], [(method, properties, body, parked_delay)])
+    elif settle_withdrawal(db, body, db.commit):
         channel.basic_ack(delivery_tag=method.delivery_tag)
+        sender_retries.settled(sender_id, retry_id)
+    else:
+        settle(channel, [], [(method, properties, body, None)])
+
+
+def process_batch(db: Session, channel, batch: list):
+    """
+    Applies all messages in one DB transaction, every message in its own savepoint, so failing message does not
+    roll back the others. Successful messages are acked with one multiple ack and appended to cached views after
+    commit, released savepoints do not publish anything. Once message of a user fails, the following messages of
+    the same user are sent to the same retry queue, so they do not overtake it. Messages of a user whose earlier
+    message waits in retry queue from previous batch are parked behind it the same way.
+    """
+    acked_tags = []
+    failed = []
+    # (sender id, retry id) of applied and rejected messages
+    applied = []
+    # retry ids of messages which will not come back from retry queue
+    settled = set()
+    # sender id -> retry delay of its failed message
+    failed_senders = {}
+    try:
+        for method, properties, body in batch:
+            sender_id, retry_id = get_sender_id(body), get_retry_id(properties)
+            if sender_id is not None and sender_id in failed_senders:
+                failed.append((method, properties, body, failed_senders[sender_id]))
+                continue
+            parked_delay = sender_retries.parked_delay(sender_id, retry_id, settled)
+            if parked_delay is not None:
+                failed.append((method, properties, body, parked_delay))
+                continue
+            savepoint = db.begin_nested()
+            if settle_withdrawal(db, body, savepoint.commit):
+                acked_tags.append(method.delivery_tag)
+                applied.append((sender_id, retry_id))
+                settled.add(retry_id)
+            else:
+                failed.append((method, properties, body, None))
+                delay_ms = next_delay(properties)
+                # dead lettered message can not be overtaken anymore
+                if delay_ms is not None:
+                    failed_senders[sender_id] = delay_ms
+                else:
+                    settled.add(retry_id)
+            if savepoint.is_active:
+                savepoint.rollback()
+        db.commit()
     except Exception as e:
         logging.exception(e)
-        channel.basic_nack(delivery_tag=method.delivery_tag)
+        db.rollback()
+        # nothing from the batch was applied, every message is retried
+        settle(channel, [], [(method, properties, body, None) for method, properties, body in batch])
+        return
+
+    for sender_id, retry_id in applied:
+        sender_retries.settled(sender_id, retry_id)
+    settle(channel, acked_tags, failed)
+
+
+def next_delay(properties) -> Optional[int]:
+    """Delay of the next retry of failed message, None when it ran out of attempts."""
+    attempts = get_attempts(properties) + 1
+    return RETRY_DELAYS_MS[attempts - 1] if attempts < MAX_ATTEMPTS else None
+
+
+def retry_withdrawal(channel, properties, body, delay_ms: int = None):
+    """
+    Publishes failed message to retry queue, after the delay it goes back to its partition. Delay grows with every
+    failed attempt, after MAX_ATTEMPTS message goes to dead letter queue. Message which did not fail itself (it was
+    blocked by failed message of the same sender) is retried with given delay_ms and keeps its attempts. Retry copy
+    keeps retry id of the message, so it is recognized in order of its sender when it comes back.
+    """
+    headers = dict(properties.headers or {}) if properties else {}
+    attempts = headers.get(RETRY_COUNT_HEADER, 0)
+    if delay_ms is None:
+        delay_ms = next_delay(properties)
+        attempts += 1
+    headers[RETRY_COUNT_HEADER] = attempts
+    retry_id = headers.setdefault(RETRY_ID_HEADER, uuid.uuid4().hex)
+    properties = BasicProperties(delivery_mode=2, headers=headers)
+    sender_id = get_sender_id(body)
+
+    if delay_ms is None:
+        logging.error(f"Withdrawal failed {attempts} times, moving it to dead letter queue: {body}")
+        channel.basic_publish(exchange="", routing_key=dead_letter_queue(QUEUE_NAME), body=body,
+                              properties=properties, mandatory=True)
+        sender_retries.settled(sender_id, retry_id)
+        return
+    exchange, routing_key = withdrawal_route(QUEUE_NAME, sender_id)
+    channel.basic_publish(exchange=retry_exchange(exchange, delay_ms), routing_key=routing_key, body=body,
+                          properties=properties, mandatory=True)
+    # sender waits for the message only once its copy is stored
+    sender_retries.retried(sender_id, retry_id, delay_ms)
+
+
+def settle(channel, acked_tags: List[int], failed: list):
+    """
+    Sends failed (method, properties, body, delay_ms) messages to retry and acks them together with acked ones.
+    Channel is in confirm mode, so message is acked only after its retry copy is stored. When it can not be
+    published, it is returned to the queue.
+    """
+    for method, properties, body, delay_ms in failed:
+        try:
+            retry_withdrawal(channel, properties, body, delay_ms)
+            acked_tags.append(method.delivery_tag)
+        except exceptions.AMQPError as e:
+            logging.error(f"Failed to retry withdrawal: {e}")
+            channel.basic_nack(delivery_tag=method.delivery_tag)
+    if acked_tags:
+        # nacked messages are already settled, multiple ack covers only acked ones
+        channel.basic_ack(delivery_tag=max(acked_tags), multiple=len(acked_tags) > 1)
+
+
+def get_attempts(properties) -> int:
+    return (properties and properties.headers or {}).get(RETRY_COUNT_HEADER, 0)
+
+
+def get_retry_id(properties) -> Optional[str]:
+    return (properties and properties.headers or {}).get(RETRY_ID_HEADER)
+
+
+def get_sender_id(body):
+    try:
+        return json.loads(body).get("sender_id")
+    except (ValueError, AttributeError):
+        # invalid message, settle_withdrawal acks it
+        return None
 
 
 def callback(ch, method, properties, body):
     db: Session = SessionLocal()
-    process_withdrawal(db, ch, method, body)
+    process_withdrawal(db, ch, method, properties, body)
     db.close()
 
 
-def main():
-    queue_name = os.environ.get("RABBITMQ_QUEUE")
-    if not queue_name:
-        logging.error("Environment variable RABBITMQ_QUEUE not set")
-        sys.exit(1)
+class PartitionBatch:
+    """Messages collected from one partition queue, they are settled on the channel they came from."""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.messages = []
+        self.deadline = None
+
+    def add(self, channel, method, properties, body):
+        self.messages.append((method, properties, body))
+        self.deadline = self.deadline or time.monotonic() + BATCH_TIMEOUT_MS / 1000
+
+    def flush(self, batch_size: int, force: bool = False):
+        if not self.messages:
+            return
+        if not force and len(self.messages) < batch_size and time.monotonic() < self.deadline:
+            return
+        db: Session = SessionLocal()
+        try:
+            process_batch(db, self.channel, self.messages)
+        finally:
+            db.close()
+        self.messages = []
+        self.deadline = None
 
-    rabbitmq: RabbitMQConnection = get_rabbitmq_connection()
-    rabbitmq.channel.exchange_declare(exchange=queue_name, exchange_type="direct", durable=True)
-    result = rabbitmq.channel.queue_declare(queue=queue_name, durable=True)
-    rabbitmq.channel.queue_bind(exchange=queue_name, queue=result.method.queue)
 
-    rabbitmq.channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=False)
+def consume(rabbitmq: RabbitMQConnection, queue_names: List[str], batch_size: int = BATCH_SIZE,
+            timeout_ms: int = BATCH_TIMEOUT_MS):
+    """
+    Consumes every queue on its own channel until shutdown is set. Delivery tags are per channel, so multiple ack
+    of one partition batch can not settle messages of another partition. In batch mode up to batch_size messages
+    are collected per queue, or whatever came in timeout_ms after the first one.
+    """
+    consumers = []
+    batches = []
+    for queue_name in queue_names:
+        channel = rabbitmq.connection.channel()
+        channel.basic_qos(prefetch_count=PREFETCH_COUNT)
+        # failed message is acked only after broker confirms its retry copy
+        channel.confirm_delivery()
+        if batch_size > 1:
+            batch = PartitionBatch(channel)
+            batches.append(batch)
+            consumer_tag = channel.basic_consume(queue=queue_name, on_message_callback=batch.add, auto_ack=False)
+        else:
+            consumer_tag = channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=False)
+        consumers.append((channel, consumer_tag))
 
-    print("Waiting for withdrawal messages...")
+    while not shutdown.is_set():
+        # time limit bounds how long shutdown waits for the loop
+        rabbitmq.connection.process_data_events(time_limit=timeout_ms / 1000 if batches else SHUTDOWN_CHECK_INTERVAL)
+        for batch in batches:
+            batch.flush(batch_size)
+
+    # no new deliveries, messages collected so far are applied and settled before connection is closed
+    for channel, consumer_tag in consumers:
+        channel.basic_cancel(consumer_tag)
+    for batch in batches:
+        batch.flush(batch_size, force=True)
+
+
+def stop(signum, frame):
+    logging.info(f"Received signal {signum}, shutting down")
+    shutdown.set()
+
+
+def run_worker(queue_names: List[str]):
+    """Consumes queues with its own DB pool and AMQP connection, returns after graceful shutdown."""
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    # forked process must not use pooled connections of its parent
+    engine.dispose(close=False)
+
+    rabbitmq: RabbitMQConnection = get_rabbitmq_connection()
+    print(f"Waiting for withdrawal messages from {', '.join(queue_names)}...")
     try:
-        rabbitmq.channel.start_consuming()
+        consume(rabbitmq, queue_names)
     except Exception as e:
         logging.exception(f"Error during consuming: {e}")
-        rabbitmq.connection.close()
+        # supervisor restarts crashed worker
+        sys.exit(1)
+    finally:
+        if rabbitmq.connection.is_open:
+            rabbitmq.close()
+        engine.dispose()
+
+
+def worker_queues(queue_names: List[str], worker: int, workers: int) -> List[str]:
+    """
+    Queues consumed by the worker. Queues are split between workers, when there are fewer queues than workers,
+    some queues get more consumers (competing on single queue, standby on partitioned queue).
+    """
+    return queue_names[worker % len(queue_names)::workers]
+
+
+def supervise(queue_names: List[str], workers: int):
+    """Forks workers, restarts the ones that crashed and on shutdown waits for workers to drain their deliveries."""
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    context = multiprocessing.get_context("fork")
+    processes = {}
+
+    def start(worker: int):
+        process = context.Process(target=run_worker, args=(worker_queues(queue_names, worker, workers),),
+                                  name=f"withdrawal-worker-{worker}")
+        process.start()
+        processes[worker] = process
+
+    for worker in range(workers):
+        start(worker)
+
+    while not shutdown.is_set():
+        multiprocessing.connection.wait([process.sentinel for process in processes.values()], SHUTDOWN_CHECK_INTERVAL)
+        for worker, process in list(processes.items()):
+            if process.is_alive() or shutdown.is_set():
+                continue
+            logging.error(f"Worker {worker} exited with code {process.exitcode}, restarting")
+            # crashing worker (e.g. broker is down) is not restarted in tight loop
+            if not shutdown.wait(RESTART_DELAY):
+                start(worker)
+
+    stop_workers(list(processes.values()))
+
+
+def stop_workers(processes: List[multiprocessing.Process], timeout: float = SHUTDOWN_TIMEOUT):
+    """
+    Asks workers to stop and kills those still running after timeout. Joins share one deadline, stuck workers do not
+    add up beyond stop grace period of the container.
+    """
+    for process in processes:
+        process.terminate()
+    deadline = time.monotonic() + timeout
+    for process in processes:
+        process.join(max(deadline - time.monotonic(), 0))
+        if process.is_alive():
+            logging.error(f"Worker {process.name} did not stop in {timeout}s, killing it")
+            process.kill()
+            process.join()
+
+
+def main():
+    if not QUEUE_NAME:
+        logging.error("Environment variable RABBITMQ_QUEUE not set")
+        sys.exit(1)
+
+    rabbitmq: RabbitMQConnection = get_rabbitmq_connection()
+    queue_names = declare_withdrawal_queues(rabbitmq.channel, QUEUE_NAME)
+    # declaring connection is not shared with workers
+    rabbitmq.close()
+    # consumer can take only some partitions, e.g. WITHDRAWAL_PARTITIONS=0-3, others are consumed by other processes
+    queue_names = [queue_names[partition] for partition in parse_partitions(os.environ.get("WITHDRAWAL_PARTITIONS"))]
+
+    if WORKERS > 1:
+        supervise(queue_names, WORKERS)
+    else:
+        run_worker(queue_names)
 
 
 if __name__ == "__main__":
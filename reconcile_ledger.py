@@ -0,0 +1,35 @@
+import argparse
+import json
+import logging
+import sys
+
+from db import SessionLocal
+from services.reconciliation_service import RECONCILE_CHUNK_SIZE, ReconciliationService
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fold new transactions into ledger totals and check user balances")
+    parser.add_argument("--chunk-size", type=int, default=RECONCILE_CHUNK_SIZE, help="transactions folded per commit")
+    parser.add_argument("--full", action="store_true", help="check balances of all users, not only of users with new transactions")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        result = ReconciliationService.reconcile(db, args.chunk_size, full=args.full)
+    except Exception as e:
+        logging.exception(e)
+        db.rollback()
+        sys.exit(1)
+    finally:
+        db.close()
+
+    # mismatches go to stderr one per line, exit code 2 lets scheduler alert on them
+    for mismatch in result["mismatches"]:
+        print(json.dumps(mismatch), file=sys.stderr)
+    print(json.dumps({"reconciled": result["reconciled"], "checkpoint": result["checkpoint"], "mismatches": len(result["mismatches"])}))
+    if result["mismatches"]:
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import os
+import random
+from decimal import Decimal
+from typing import List, Optional
+
+from sqlalchemy import Integer, delete, insert, literal, select, update
+from sqlalchemy.orm import Session
+
+from models import BalanceShard, User
+
+# users with more shards are refused, every shard is one more row summed on every read of the balance
+MAX_SHARDS = int(os.environ.get("BALANCE_MAX_SHARDS", 64))
+
+
+class BalanceShardService:
+    """
+    Balance of a hot account (e.g. merchant receiving thousands of transfers) can be split over shard_count
+    balance_shards rows. Credits go to a random shard, so concurrent transfers to the account do not queue on its
+    users row. Debits are taken from users row, shards are consolidated into it when it does not have enough.
+    Balance shards only grow unless users row is locked, so consolidation under that lock never misses a credit.
+    """
+
+    @classmethod
+    def credit(cls, db: Session, user_id: int, amount: Decimal) -> Optional[Decimal]:
+        """Adds amount to random shard of the user, returns new balance of the shard or None if user is not sharded."""
+        # shard is picked by the statement from shard_count, users row is read without lock
+        shard = (
+            select(literal(random.randrange(2 ** 31 - 1), Integer) % User.shard_count)
+            .where(User.id == user_id, User.shard_count > 0)
+            .scalar_subquery()
+        )
+        return db.execute(
+            update(BalanceShard)
+            .where(BalanceShard.user_id == user_id, BalanceShard.shard == shard)
+            .values(balance=BalanceShard.balance + amount)
+            .returning(BalanceShard.balance)
+            .execution_options(synchronize_session=False)
+        ).scalar_one_or_none()
+
+    @classmethod
+    def consolidate(cls, db: Session, user_id: int) -> Decimal:
+        """Moves balance of user shards to users row, returns moved amount."""
+        if not cls._lock_user(db, user_id):
+            return Decimal(0)
+        amount = cls.drain(db, user_id)
+        if amount:
+            cls._add_to_user(db, user_id, amount)
+        return amount
+
+    @classmethod
+    def drain(cls, db: Session, user_id: int) -> Decimal:
+        """
+        Sets balance of user shards to zero and returns their sum, caller holds lock of users row and adds the sum
+        to it in the same transaction.
+        """
+        balances = db.scalars(
+            select(BalanceShard.balance).where(BalanceShard.user_id == user_id).order_by(BalanceShard.shard).with_for_update()
+        ).all()
+        amount = sum(balances, Decimal(0))
+        if amount:
+            db.execute(
+                update(BalanceShard)
+                .where(BalanceShard.user_id == user_id, BalanceShard.balance != 0)
+                .values(balance=0)
+                .execution_options(synchronize_session=False)
+            )
+        return amount
+
+    @classmethod
+    def set_shards(cls, db: Session, user_id: int, shards: int) -> bool:
+        """
+        Splits future credits of user over given number of shards, 0 keeps them on users row again. Balance of
+        existing shards is moved to users row first. Returns False if user does not exist.
+        """
+        if not 0 <= shards <= MAX_SHARDS:
+            raise ValueError(f"Number of shards has to be between 0 and {MAX_SHARDS}")
+        if cls._lock_user(db, user_id) is None:
+            return False
+
+        amount = cls.drain(db, user_id)
+        db.execute(delete(BalanceShard).where(BalanceShard.user_id == user_id))
+        if shards:
+            db.execute(insert(BalanceShard), [{"user_id": user_id, "shard": shard, "balance": 0} for shard in range(shards)])
+        db.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(main_balance=User.main_balance + amount, shard_count=shards)
+            .execution_options(synchronize_session=False)
+        )
+        return True
+
+    @classmethod
+    def sharded_users(cls, db: Session) -> List[int]:
+        return db.scalars(select(User.id).where(User.shard_count > 0).order_by(User.id)).all()
+
+    @classmethod
+    def _lock_user(cls, db: Session, user_id: int) -> Optional[int]:
+        """Locks users row, returns shard count of the user or None if user does not exist."""
+        return db.scalar(select(User.shard_count).where(User.id == user_id).with_for_update())
+
+    @classmethod
+    def _add_to_user(cls, db: Session, user_id: int, amount: Decimal):
+        db.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(main_balance=User.main_balance + amount)
+            .execution_options(synchronize_session=False)
+        )
@@ -0,0 +1,43 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JsonCodec:
+    name = "json"
+
+    @staticmethod
+    def dumps(value) -> bytes:
+        return json.dumps(value, separators=(",", ":")).encode()
+
+    @staticmethod
+    def loads(data: bytes):
+        return json.loads(data)
+
+
+class OrjsonCodec:
+    name = "orjson"
+
+    @staticmethod
+    def dumps(value) -> bytes:
+        return orjson.dumps(value)
+
+    @staticmethod
+    def loads(data: bytes):
+        return orjson.loads(data)
+
+
+# fastest json available, cached rows are written to responses as they are, so redis values are json too
+JSON_CODEC = OrjsonCodec if orjson else JsonCodec
+
+
+class EncodedRow(dict):
+    """Decoded row which keeps its json, so it can be written to response as it is."""
+    __slots__ = ("raw",)
+
+    def __init__(self, raw: bytes, row: dict = None):
+        super().__init__(JSON_CODEC.loads(raw) if row is None else row)
+        self.raw = raw
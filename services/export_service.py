@@ -0,0 +1,56 @@
+import csv
+import enum
+import io
+import os
+from typing import AsyncIterator
+
+from sqlalchemy import Select
+
+from db import AsyncSessionLocal
+from models import MoneyTransaction
+from services.codec import JSON_CODEC
+
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", 5000))
+EXPORT_FIELDS = [column.name for column in MoneyTransaction.__table__.columns]
+
+
+class ExportFormat(str, enum.Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
+EXPORT_MEDIA_TYPES = {
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.CSV: "text/csv",
+}
+
+
+class ExportService:
+    """
+    Streams transactions from server side cursor, only one chunk of EXPORT_CHUNK_SIZE rows is kept in memory
+    regardless of table size.
+    """
+
+    @classmethod
+    async def stream_transactions(cls, statement: Select, export_format: ExportFormat) -> AsyncIterator[bytes]:
+        # response is streamed after request dependencies are closed, so export uses its own session
+        async with AsyncSessionLocal() as db:
+            statement = statement.order_by(MoneyTransaction.created_at, MoneyTransaction.id)
+            result = await db.stream_scalars(statement.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+
+            if export_format == ExportFormat.CSV:
+                yield cls._csv_lines([EXPORT_FIELDS])
+            async for transactions in result.partitions():
+                rows = [transaction.to_dict() for transaction in transactions]
+                if export_format == ExportFormat.CSV:
+                    yield cls._csv_lines([[row[field] for field in EXPORT_FIELDS] for row in rows])
+                else:
+                    yield b"".join(JSON_CODEC.dumps(row) + b"\n" for row in rows)
+                # exported rows are not needed anymore, do not let identity map grow with the table
+                db.expunge_all()
+
+    @staticmethod
+    def _csv_lines(rows: list) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode()
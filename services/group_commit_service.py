@@ -0,0 +1,165 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from db import RETRYABLE_SQLSTATES, SessionLocal, get_sqlstate, run_in_transaction
+from models import TransactionType, User
+from pydantic_models.transaction import TransactionCreate, TransactionOut
+from services.transaction_service import TransactionService
+
+# transfers committed together, 1 turns group commit off and every transfer is committed on its own
+GROUP_COMMIT_SIZE = int(os.environ.get("TRANSFER_GROUP_COMMIT_SIZE", 1))
+# how long the first transfer of a group waits for others
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get("TRANSFER_GROUP_COMMIT_WINDOW_MS", 2))
+
+# marks transfer rolled back by deadlock or serialization failure inside the group, it is repeated on its own
+RETRY = object()
+
+
+class TransferGroupCommitter:
+    """
+    Collects transfers submitted by request threads for up to window_ms (or max_size transfers) and applies them in
+    one DB transaction, every transfer in its own savepoint, so the whole group costs one commit. Every caller gets
+    result of its own transfer once the group is committed.
+    """
+
+    def __init__(self, session_factory=SessionLocal, max_size: int = GROUP_COMMIT_SIZE, window_ms: float = GROUP_COMMIT_WINDOW_MS):
+        self.session_factory = session_factory
+        self.max_size = max_size
+        self.window = window_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="transfer-group-commit", daemon=True)
+        self._thread.start()
+
+    def submit(self, transfer: TransactionCreate) -> Future:
+        future = Future()
+        self._queue.put((transfer, future))
+        return future
+
+    def transfer(self, transfer: TransactionCreate) -> TransactionOut:
+        """Blocks until group of the transfer is committed, raises TransferError like TransactionService.transfer_money."""
+        return self.submit(transfer).result()
+
+    def close(self):
+        """Applies transfers submitted so far and stops the thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            group, stopping = self._collect()
+            if group:
+                self.apply(group)
+
+    def _collect(self) -> Tuple[List[tuple], bool]:
+        item = self._queue.get()
+        if item is None:
+            return [], True
+        group = [item]
+        deadline = time.monotonic() + self.window
+        while len(group) < self.max_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                return group, True
+            group.append(item)
+        return group, False
+
+    def apply(self, group: List[tuple]):
+        db = self.session_factory()
+        try:
+            try:
+                results = self._apply_group(db, group)
+            except OperationalError as e:
+                db.rollback()
+                if get_sqlstate(e) not in RETRYABLE_SQLSTATES:
+                    raise
+                logging.warning(f"Group of {len(group)} transfers rolled back ({get_sqlstate(e)}), applying them one by one")
+                results = [RETRY] * len(group)
+
+            for (transfer, future), result in zip(group, results):
+                if result is RETRY:
+                    result = self._apply_one(db, transfer)
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        except Exception as e:
+            logging.exception(e)
+            db.rollback()
+            for _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            db.close()
+
+    def _apply_group(self, db: Session, group: List[tuple]) -> list:
+        """Returns TransactionOut, exception or RETRY for every transfer of the committed group."""
+        user_ids = {transfer.sender_id for transfer, _ in group} | {transfer.receiver_id for transfer, _ in group}
+        # rows are locked in id order up front, later transfers of the group can not deadlock with other transactions,
+        # sharded users are credited on their shards and their users rows are left unlocked
+        db.execute(select(User.id).where(User.id.in_(user_ids), User.shard_count == 0).order_by(User.id).with_for_update())
+
+        results = []
+        for transfer, _ in group:
+            try:
+                with db.begin_nested():
+                    transaction = self._transfer(db, transfer)
+                    db.flush()
+                results.append(TransactionOut.model_validate(transaction, from_attributes=True))
+            except OperationalError as e:
+                # deadlock rolls back only the savepoint, transfer is repeated on its own after the group
+                results.append(RETRY if get_sqlstate(e) in RETRYABLE_SQLSTATES else e)
+            except Exception as e:
+                # insufficient balance, unknown user or failed statement, rest of the group is still committed
+                results.append(e)
+        db.commit()
+        return results
+
+    def _apply_one(self, db: Session, transfer: TransactionCreate):
+        try:
+            transaction = run_in_transaction(db, lambda: self._transfer(db, transfer))
+            return TransactionOut.model_validate(transaction, from_attributes=True)
+        except Exception as e:
+            return e
+
+    @staticmethod
+    def _transfer(db: Session, transfer: TransactionCreate):
+        return TransactionService.transfer_money(
+            db, transfer.sender_id, transfer.receiver_id, transfer.amount, TransactionType.TRANSFER
+        )
+
+
+_committer: Optional[TransferGroupCommitter] = None
+_committer_lock = threading.Lock()
+
+
+def get_transfer_committer() -> TransferGroupCommitter:
+    global _committer
+    if _committer is None:
+        with _committer_lock:
+            if _committer is None:
+                _committer = TransferGroupCommitter()
+    return _committer
+
+
+def close_transfer_committer():
+    global _committer
+    with _committer_lock:
+        if _committer is not None:
+            _committer.close()
+            _committer = None
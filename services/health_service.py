@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import text
+
+from db import async_engine
+from services.rabbit_service import get_async_rabbitmq_publisher, withdrawal_route
+from services.redis_service import get_redis
+
+# seconds every readiness probe may take before its dependency is reported as not ready
+PROBE_TIMEOUT = float(os.environ.get("READINESS_PROBE_TIMEOUT", 2))
+# seconds between failed setup attempts of a dependency, the delay doubles up to STARTUP_MAX_RETRY_DELAY
+STARTUP_RETRY_DELAY = float(os.environ.get("STARTUP_RETRY_DELAY", 1))
+STARTUP_MAX_RETRY_DELAY = float(os.environ.get("STARTUP_MAX_RETRY_DELAY", 30))
+
+
+async def check_postgres():
+    async with async_engine.connect() as connection:
+        await connection.execute(text("SELECT 1"))
+
+
+async def check_redis():
+    await get_redis().ping()
+
+
+async def check_rabbitmq():
+    # exchange of partition 0 exists once withdrawal queues were declared
+    exchange, _ = withdrawal_route(os.environ.get("RABBITMQ_QUEUE"), 0)
+    await get_async_rabbitmq_publisher().check(exchange)
+
+
+class HealthService:
+    """
+    App starts without waiting for its dependencies. One time setup of a dependency (database, partitions, queues)
+    is retried in background until it succeeds, readiness probes report dependency as ready only after that and
+    only while it answers.
+    """
+
+    checks: Dict[str, Callable[[], Awaitable]] = {
+        "postgres": check_postgres,
+        "redis": check_redis,
+        "rabbitmq": check_rabbitmq,
+    }
+    # dependencies whose setup has not succeeded yet
+    pending = set()
+
+    @classmethod
+    def start_setup(cls, name: str, setup: Callable) -> asyncio.Task:
+        """Marks dependency as pending before the task runs, so readiness probe served first does not report it ready."""
+        cls.pending.add(name)
+        return asyncio.create_task(cls.setup_with_retry(name, setup))
+
+    @classmethod
+    async def setup_with_retry(cls, name: str, setup: Callable, delay: float = STARTUP_RETRY_DELAY,
+                               max_delay: float = STARTUP_MAX_RETRY_DELAY):
+        """Runs blocking setup in threadpool until it does not raise, then marks the dependency as set up."""
+        attempt = 1
+        while True:
+            try:
+                await run_in_threadpool(setup)
+                break
+            except Exception as e:
+                logging.warning(f"{name} setup failed (attempt {attempt}): {e!r}. Retrying in {delay} seconds...")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_delay)
+                attempt += 1
+        cls.pending.discard(name)
+        logging.info(f"{name} is set up")
+
+    @classmethod
+    async def probe(cls, name: str, timeout: float = PROBE_TIMEOUT) -> dict:
+        start = time.perf_counter()
+        error = None
+        try:
+            await asyncio.wait_for(cls.checks[name](), timeout)
+        except asyncio.TimeoutError:
+            error = f"No answer in {timeout} seconds"
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        latency_ms = round((time.perf_counter() - start) * 1000, 2)
+        if error is None and name in cls.pending:
+            error = "Setup has not finished yet"
+        return {"ready": error is None, "latency_ms": latency_ms, "error": error}
+
+    @classmethod
+    async def readiness(cls) -> dict:
+        """Probes all dependencies concurrently, so readiness takes as long as the slowest one."""
+        results = await asyncio.gather(*(cls.probe(name) for name in cls.checks))
+        dependencies = dict(zip(cls.checks, results))
+        return {"ready": all(result["ready"] for result in results), "dependencies": dependencies}
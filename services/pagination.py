@@ -0,0 +1,48 @@
+from typing import Type
+
+from fastapi.responses import Response
+from pydantic import BaseModel
+from sqlalchemy import Select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from pydantic_models.page import PageParams, encode_cursor
+from services.codec import JSON_CODEC, EncodedRow
+
+
+async def paginate(db: AsyncSession, statement: Select, model, page: PageParams) -> dict:
+    """
+    Keyset pagination on (created_at, id), deep pages cost the same as the first one since
+    rows before cursor are skipped by index instead of OFFSET.
+    """
+    if page.since:
+        statement = statement.where(model.created_at >= page.since)
+    if page.until:
+        statement = statement.where(model.created_at < page.until)
+    if page.after:
+        # row comparison does not prune partitions, plain created_at condition does
+        statement = statement.where(model.created_at >= page.after[0], tuple_(model.created_at, model.id) > tuple_(*page.after))
+
+    # one extra row tells if there is next page
+    rows = (await db.scalars(statement.order_by(model.created_at, model.id).limit(page.limit + 1))).all()
+    return page_result(rows[:page.limit], len(rows) > page.limit, lambda row: (row.created_at, row.id))
+
+
+def page_result(items: list, has_more: bool, key) -> dict:
+    next_cursor = encode_cursor(*key(items[-1])) if has_more else None
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def page_response(page: dict, response_model: Type[BaseModel]) -> Response:
+    """
+    Writes page as json without validating items against response model again. Items are either cached rows,
+    which are written as they were cached, or ORM rows encoded with fields of response model.
+    """
+    fields = tuple(response_model.model_fields)
+    items = b",".join(
+        item.raw if isinstance(item, EncodedRow) else JSON_CODEC.dumps(type(item).row_encoder(fields)(item))
+        for item in page["items"]
+    )
+    return Response(
+        content=b'{"items":[' + items + b'],"next_cursor":' + JSON_CODEC.dumps(page["next_cursor"]) + b"}",
+        media_type="application/json"
+    )
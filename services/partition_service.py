@@ -0,0 +1,98 @@
+import os
+import re
+from datetime import date
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from models import MoneyTransaction
+
+# partitions are created this many months ahead, so inserts never miss one
+PARTITIONS_AHEAD = int(os.environ.get("TRANSACTIONS_PARTITIONS_AHEAD", 3))
+# partitions older than this many months are dropped, 0 keeps all of them
+RETENTION_MONTHS = int(os.environ.get("TRANSACTIONS_RETENTION_MONTHS", 0))
+
+TABLE = MoneyTransaction.__tablename__
+PARTITION_NAME = re.compile(rf"^{TABLE}_(\d{{4}})_(\d{{2}})$")
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+class PartitionService:
+    """
+    Manages monthly range partitions of transactions table (created by migration 5f3a9c1d7e20). Partition of
+    a month is named transactions_YYYY_MM and holds rows with created_at in that month. On databases where the
+    table is not partitioned (sqlite, tables created by create_all) every method does nothing.
+    """
+
+    @classmethod
+    def partition_name(cls, month: date) -> str:
+        return f"{TABLE}_{month:%Y_%m}"
+
+    @classmethod
+    def is_partitioned(cls, db: Session) -> bool:
+        if db.get_bind().dialect.name != "postgresql":
+            return False
+        return db.execute(
+            text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)"), {"table": TABLE}
+        ).first() is not None
+
+    @classmethod
+    def existing_partitions(cls, db: Session) -> List[date]:
+        names = db.scalars(
+            text("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                 "WHERE i.inhparent = to_regclass(:table)"), {"table": TABLE}
+        )
+        months = []
+        for name in names:
+            match = PARTITION_NAME.match(name)
+            if match:
+                months.append(date(int(match.group(1)), int(match.group(2)), 1))
+        return sorted(months)
+
+    @classmethod
+    def ensure_partitions(cls, db: Session, months_ahead: int = PARTITIONS_AHEAD, today: Optional[date] = None) -> List[str]:
+        """Creates missing partitions from current month to months_ahead months ahead, returns created ones."""
+        if not cls.is_partitioned(db):
+            return []
+        current = (today or date.today()).replace(day=1)
+        existing = set(cls.existing_partitions(db))
+        created = []
+        for month in (add_months(current, i) for i in range(months_ahead + 1)):
+            if month in existing:
+                continue
+            name = cls.partition_name(month)
+            db.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {TABLE} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+            ))
+            created.append(name)
+        return created
+
+    @classmethod
+    def drop_expired_partitions(cls, db: Session, retention_months: int = RETENTION_MONTHS,
+                                today: Optional[date] = None) -> List[str]:
+        """
+        Drops partitions of months which ended more than retention_months months ago, returns dropped ones.
+        Whole month goes at once, which is much cheaper than DELETE followed by vacuum, but transactions table
+        is locked for all reads and writes until caller commits.
+        """
+        if retention_months <= 0 or not cls.is_partitioned(db):
+            return []
+        oldest_kept = add_months((today or date.today()).replace(day=1), -retention_months)
+        dropped = []
+        for month in cls.existing_partitions(db):
+            if month >= oldest_kept:
+                break
+            name = cls.partition_name(month)
+            # DETACH takes ACCESS EXCLUSIVE lock on transactions until commit, ledger reads and writes wait for it,
+            # DETACH ... CONCURRENTLY would avoid that but needs Postgres 14 and can not run in transaction block
+            db.execute(text(f"ALTER TABLE {TABLE} DETACH PARTITION {name}"))
+            db.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+        return dropped
+
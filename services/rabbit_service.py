@@ -1,6 +1,11 @@
+import asyncio
+import logging
 import os
+from typing import List, Optional, Tuple
 
+import aio_pika
 import pika
+from aio_pika import exceptions as aio_exceptions
 from pika.adapters.blocking_connection import BlockingConnection
 from pydantic.v1 import BaseSettings
 
@@ -13,6 +18,17 @@ class RabbitMQConfig(BaseSettings):
 
 
 rabbitmq_config = RabbitMQConfig()
+# seconds async publish waits for broker confirm
+PUBLISH_TIMEOUT = float(os.environ.get("RABBITMQ_PUBLISH_TIMEOUT", 10))
+# withdrawals are split into this many queues by sender, 1 keeps single direct queue
+PARTITIONS = int(os.environ.get("RABBITMQ_PARTITIONS", 1))
+# failed withdrawal is retried with exponential backoff, after MAX_ATTEMPTS failures it goes to dead letter queue
+MAX_ATTEMPTS = int(os.environ.get("WITHDRAWAL_MAX_ATTEMPTS", 5))
+RETRY_BASE_DELAY_MS = int(os.environ.get("WITHDRAWAL_RETRY_BASE_DELAY_MS", 1000))
+RETRY_DELAYS_MS = [RETRY_BASE_DELAY_MS * 2 ** attempt for attempt in range(MAX_ATTEMPTS - 1)]
+RETRY_COUNT_HEADER = "x-retry-count"
+# identifies message in retry queues, so later messages of its sender can wait for it
+RETRY_ID_HEADER = "x-retry-id"
 
 
 class RabbitMQConnection:
@@ -29,3 +45,177 @@ class RabbitMQConnection:
 
 def get_rabbitmq_connection(config: RabbitMQConfig = rabbitmq_config) -> RabbitMQConnection:
     return RabbitMQConnection(config)
+
+
+def partition_queue(queue_name: str, partition: int) -> str:
+    return f"{queue_name}.{partition}"
+
+
+def partitioned_exchange(queue_name: str) -> str:
+    # existing direct exchange can not change its type, partitioned one has its own name
+    return f"{queue_name}.partitioned"
+
+
+def retry_exchange(exchange: str, delay_ms: int) -> str:
+    return f"{exchange}.retry.{delay_ms}ms"
+
+
+def dead_letter_queue(queue_name: str) -> str:
+    return f"{queue_name}.dead"
+
+
+def declare_retry_queues(channel, exchange: str, delays: List[int] = RETRY_DELAYS_MS):
+    """
+    Declares retry queue for every delay. Messages in one queue have the same ttl, so they expire in order and go
+    back to withdrawal exchange with the routing key they were published with, i.e. to the same partition.
+    """
+    for delay in delays:
+        name = retry_exchange(exchange, delay)
+        channel.exchange_declare(exchange=name, exchange_type="fanout", durable=True)
+        channel.queue_declare(queue=name, durable=True, arguments={"x-message-ttl": delay, "x-dead-letter-exchange": exchange})
+        channel.queue_bind(exchange=name, queue=name)
+
+
+def declare_withdrawal_queues(channel, queue_name: str, partitions: int = PARTITIONS) -> List[str]:
+    """
+    Declares withdrawal exchange and queues with their retry and dead letter queues, returns queue names ordered by
+    partition. Partitioned queues are bound to consistent hash exchange (rabbitmq_consistent_hash_exchange plugin)
+    which routes by sender id, so withdrawals of one user always end up in the same queue. Only one consumer of
+    a queue is active at a time, which keeps them in order even when more consumers subscribe to the same partition.
+    """
+    channel.queue_declare(queue=dead_letter_queue(queue_name), durable=True)
+    if partitions <= 1:
+        channel.exchange_declare(exchange=queue_name, exchange_type="direct", durable=True)
+        channel.queue_declare(queue=queue_name, durable=True)
+        channel.queue_bind(exchange=queue_name, queue=queue_name, routing_key="")
+        declare_retry_queues(channel, queue_name)
+        return [queue_name]
+
+    exchange = partitioned_exchange(queue_name)
+    channel.exchange_declare(exchange=exchange, exchange_type="x-consistent-hash", durable=True)
+    queue_names = []
+    for partition in range(partitions):
+        partition_name = partition_queue(queue_name, partition)
+        channel.queue_declare(queue=partition_name, durable=True, arguments={"x-single-active-consumer": True})
+        # routing key of binding is its weight, all partitions get the same share of senders
+        channel.queue_bind(exchange=exchange, queue=partition_name, routing_key="1")
+        queue_names.append(partition_name)
+    declare_retry_queues(channel, exchange)
+    return queue_names
+
+
+def withdrawal_route(queue_name: str, sender_id: int, partitions: int = PARTITIONS) -> Tuple[str, str]:
+    """Returns (exchange, routing key) withdrawal of the sender is published with."""
+    if partitions <= 1:
+        return queue_name, ""
+    return partitioned_exchange(queue_name), str(sender_id)
+
+
+def parse_partitions(spec: Optional[str], partitions: int = PARTITIONS) -> List[int]:
+    """Parses partitions assigned to consumer, e.g. "0,2" or "4-7", empty spec means all of them."""
+    if not spec:
+        return list(range(max(partitions, 1)))
+    selected = set()
+    for part in spec.split(","):
+        first, _, last = part.strip().partition("-")
+        selected.update(range(int(first), int(last or first) + 1))
+    if max(selected) >= max(partitions, 1):
+        raise ValueError(f"Partition {max(selected)} does not exist, there are {partitions} partitions")
+    return sorted(selected)
+
+
+class AsyncRabbitMQPublisher:
+    """
+    Publisher for async endpoints. One connection and one confirm mode channel are shared by all requests of the
+    event loop, publishes are pipelined on the channel and every publish waits only for confirm of its own message,
+    so concurrency is not limited by threads or pooled channels. Lost connection is reopened on next publish.
+    """
+
+    def __init__(self, config: RabbitMQConfig, timeout: float = PUBLISH_TIMEOUT):
+        self.config = config
+        self.timeout = timeout
+        self._connection: Optional[aio_pika.abc.AbstractConnection] = None
+        self._channel: Optional[aio_pika.abc.AbstractChannel] = None
+        # requests waiting for connection share the one being opened
+        self._lock = asyncio.Lock()
+
+    async def _connect(self) -> aio_pika.abc.AbstractConnection:
+        return await aio_pika.connect(
+            host=self.config.host, port=self.config.port, login=self.config.username, password=self.config.password
+        )
+
+    async def _get_channel(self) -> aio_pika.abc.AbstractChannel:
+        async with self._lock:
+            if self._channel is None or self._channel.is_closed:
+                if self._connection is None or self._connection.is_closed:
+                    self._connection = await self._connect()
+                # unroutable message is returned by broker, it must fail publish like nack does
+                self._channel = await self._connection.channel(publisher_confirms=True, on_return_raises=True)
+            return self._channel
+
+    async def publish(self, exchange: str, routing_key: str, body: bytes, retries: int = 1):
+        """Returns after broker confirmed the message, raises AMQPError when it was not accepted."""
+        message = aio_pika.Message(body, delivery_mode=aio_pika.DeliveryMode.PERSISTENT)
+        for attempt in range(retries + 1):
+            try:
+                channel = await self._get_channel()
+                target = channel.default_exchange if not exchange else await channel.get_exchange(exchange, ensure=False)
+                await target.publish(message, routing_key=routing_key, mandatory=True, timeout=self.timeout)
+                return
+            except (aio_exceptions.AMQPConnectionError, aio_exceptions.AMQPChannelError,
+                    aio_exceptions.ChannelInvalidStateError) as e:
+                logging.warning(f"RabbitMQ publish failed: {e}")
+                await self._reset()
+                if attempt == retries:
+                    raise aio_exceptions.AMQPConnectionError(f"RabbitMQ publish failed: {e}") from e
+
+    async def check(self, exchange: str):
+        """
+        Passively declares exchange, raises when broker is not reachable or exchange was not declared yet. Check has
+        its own short-lived channel, failed declare closes only that one and publishes are not affected. Connection of
+        publishes is used while it is open, otherwise check opens and closes its own.
+        """
+        connection = self._connection
+        temporary = connection is None or connection.is_closed
+        if temporary:
+            connection = await self._connect()
+        try:
+            channel = await connection.channel(publisher_confirms=False)
+            try:
+                if exchange:
+                    await channel.get_exchange(exchange, ensure=True)
+            finally:
+                if not channel.is_closed:
+                    await channel.close()
+        finally:
+            if temporary:
+                await connection.close()
+
+    async def close(self):
+        await self._reset()
+
+    async def _reset(self):
+        connection, self._connection, self._channel = self._connection, None, None
+        if connection is not None and not connection.is_closed:
+            try:
+                await connection.close()
+            except aio_exceptions.AMQPError:
+                pass
+
+
+_async_publisher: Optional[AsyncRabbitMQPublisher] = None
+
+
+def get_async_rabbitmq_publisher() -> AsyncRabbitMQPublisher:
+    """Process wide async publisher, it is bound to event loop of the app and closed by app lifespan."""
+    global _async_publisher
+    if _async_publisher is None:
+        _async_publisher = AsyncRabbitMQPublisher(rabbitmq_config)
+    return _async_publisher
+
+
+async def close_async_rabbitmq_publisher():
+    global _async_publisher
+    if _async_publisher is not None:
+        await _async_publisher.close()
+        _async_publisher = None
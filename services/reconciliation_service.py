@@ -0,0 +1,148 @@
+import logging
+import os
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from typing import Iterable, List, Optional
+
+from sqlalchemy import DateTime, cast, func, select, union_all
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from models import LedgerTotal, MoneyTransaction, ReconciliationCheckpoint, User
+
+RECONCILE_CHUNK_SIZE = int(os.environ.get("RECONCILE_CHUNK_SIZE", 10000))
+# only transactions older than this are folded, newer ones could still be followed by lower uncommitted ids
+RECONCILE_LAG = timedelta(seconds=int(os.environ.get("RECONCILE_LAG_SECONDS", 300)))
+CHECKPOINT_NAME = "ledger"
+
+
+class ReconciliationService:
+    """
+    Checks users.balance against the ledger. Transactions are folded into per user totals (LedgerTotal) in id order,
+    checkpoint keeps last folded id, so every run reads only transactions added since the previous one.
+    Balance of a user has to be opening_balance + credits - debits.
+    """
+
+    @classmethod
+    def reconcile(cls, db: Session, chunk_size: int = RECONCILE_CHUNK_SIZE, lag: timedelta = RECONCILE_LAG,
+                  full: bool = False) -> dict:
+        """
+        Folds new transactions chunk by chunk, every chunk is committed together with checkpoint, so interrupted
+        run continues where it stopped. Returns number of folded transactions, checkpoint and mismatched balances
+        of users with new transactions (of all users when full).
+        """
+        # ids are taken before commit, only ids of transactions older than lag are sure not to get committed later
+        now = db.scalar(select(cast(func.now(), DateTime)))
+        horizon = db.scalar(
+            cls._after_checkpoint(select(func.max(MoneyTransaction.id)), cls.lock_checkpoint(db), lag)
+            .where(MoneyTransaction.created_at < now - lag)
+        )
+        db.rollback()
+
+        reconciled = 0
+        user_ids = set()
+        while horizon is not None:
+            checkpoint = cls.lock_checkpoint(db)
+            rows = db.execute(
+                cls._after_checkpoint(select(
+                    MoneyTransaction.id, MoneyTransaction.sender_id, MoneyTransaction.receiver_id,
+                    MoneyTransaction.amount, MoneyTransaction.created_at
+                ), checkpoint, lag)
+                .where(MoneyTransaction.id <= horizon)
+                .order_by(MoneyTransaction.id)
+                .limit(chunk_size)
+            ).all()
+            if not rows:
+                db.rollback()
+                break
+            user_ids.update(cls.add_totals(db, rows))
+            checkpoint.last_transaction_id = rows[-1].id
+            checkpoint.last_created_at = rows[-1].created_at
+            db.commit()
+            reconciled += len(rows)
+
+        checkpoint = cls.lock_checkpoint(db)
+        mismatches = cls.find_mismatches(db, checkpoint, lag, None if full else user_ids, chunk_size)
+        db.rollback()
+        for mismatch in mismatches:
+            logging.warning(f"Balance of user {mismatch['user_id']} is {mismatch['balance']}, ledger says {mismatch['expected']}")
+        return {"reconciled": reconciled, "checkpoint": checkpoint.last_transaction_id, "mismatches": mismatches}
+
+    @classmethod
+    def lock_checkpoint(cls, db: Session) -> ReconciliationCheckpoint:
+        """
+        Returns checkpoint locked until end of transaction. Concurrent run waits for the lock and then continues
+        after the chunk folded by this one, so no transaction is counted twice.
+        """
+        db.execute(insert(ReconciliationCheckpoint).values(name=CHECKPOINT_NAME, last_transaction_id=0).on_conflict_do_nothing())
+        return db.get(ReconciliationCheckpoint, CHECKPOINT_NAME, with_for_update=True, populate_existing=True)
+
+    @classmethod
+    def add_totals(cls, db: Session, rows: Iterable) -> List[int]:
+        """Adds sender debits and receiver credits of the rows to ledger totals, returns users whose totals changed."""
+        totals = defaultdict(lambda: [Decimal(0), Decimal(0), 0])
+        for row in rows:
+            if row.sender_id is not None:
+                totals[row.sender_id][0] += row.amount
+                totals[row.sender_id][2] += 1
+            if row.receiver_id is not None:
+                totals[row.receiver_id][1] += row.amount
+                totals[row.receiver_id][2] += 1
+
+        statement = insert(LedgerTotal).values([
+            {"user_id": user_id, "debits": debits, "credits": credits, "transaction_count": count}
+            for user_id, (debits, credits, count) in sorted(totals.items())
+        ])
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[LedgerTotal.user_id],
+            set_={
+                "debits": LedgerTotal.debits + statement.excluded.debits,
+                "credits": LedgerTotal.credits + statement.excluded.credits,
+                "transaction_count": LedgerTotal.transaction_count + statement.excluded.transaction_count,
+            }
+        ))
+        return sorted(totals)
+
+    @classmethod
+    def find_mismatches(cls, db: Session, checkpoint: ReconciliationCheckpoint, lag: timedelta,
+                        user_ids: Optional[Iterable[int]] = None, chunk_size: int = RECONCILE_CHUNK_SIZE) -> List[dict]:
+        """
+        Balances which do not match the ledger. Transactions above checkpoint are not in totals yet, they are summed
+        on the fly, one statement sees balances and transactions in the same snapshot.
+        """
+        pending_rows = union_all(
+            cls._after_checkpoint(select(MoneyTransaction.sender_id.label("user_id"), (-MoneyTransaction.amount).label("amount")), checkpoint, lag)
+            .where(MoneyTransaction.sender_id.isnot(None)),
+            cls._after_checkpoint(select(MoneyTransaction.receiver_id.label("user_id"), MoneyTransaction.amount.label("amount")), checkpoint, lag)
+            .where(MoneyTransaction.receiver_id.isnot(None)),
+        ).subquery()
+        pending = select(pending_rows.c.user_id, func.sum(pending_rows.c.amount).label("amount")).group_by(pending_rows.c.user_id).subquery()
+        expected = (
+            User.opening_balance + func.coalesce(LedgerTotal.credits, 0) - func.coalesce(LedgerTotal.debits, 0)
+            + func.coalesce(pending.c.amount, 0)
+        )
+        statement = (
+            select(User.id, User.balance, expected.label("expected"))
+            .outerjoin(LedgerTotal, LedgerTotal.user_id == User.id)
+            .outerjoin(pending, pending.c.user_id == User.id)
+            .where(User.balance != expected)
+            .order_by(User.id)
+        )
+
+        if user_ids is None:
+            rows = db.execute(statement).all()
+        else:
+            user_ids = sorted(user_ids)
+            rows = []
+            for offset in range(0, len(user_ids), chunk_size):
+                rows += db.execute(statement.where(User.id.in_(user_ids[offset:offset + chunk_size]))).all()
+        return [{"user_id": row.id, "balance": str(row.balance), "expected": str(row.expected)} for row in rows]
+
+    @classmethod
+    def _after_checkpoint(cls, statement, checkpoint: ReconciliationCheckpoint, lag: timedelta):
+        statement = statement.where(MoneyTransaction.id > checkpoint.last_transaction_id)
+        if checkpoint.last_created_at:
+            # transactions above checkpoint can not be much older than it, older partitions are skipped
+            statement = statement.where(MoneyTransaction.created_at >= checkpoint.last_created_at - lag)
+        return statement
@@ -1,22 +1,32 @@
-import json
 import os
+from typing import Dict, List, Optional, Tuple
+
+import redis
 import redis.asyncio as aioredis
 
+from services.codec import JSON_CODEC
+
 REDIS_URL = os.getenv("REDIS_URL")
 
 
 class RedisService:
-    def __init__(self):
-        self.redis = aioredis.from_url(REDIS_URL, decode_responses=True)
+    """Values are encoded with JSON_CODEC, client returns bytes, so they are decoded without going through str."""
+
+    def __init__(self, client: aioredis.Redis):
+        self.redis = client
+
+    def pipeline(self) -> aioredis.client.Pipeline:
+        """Commands queued on pipeline are sent in one round trip on execute()."""
+        return self.redis.pipeline(transaction=False)
 
     async def get(self, key: str):
         data = await self.redis.get(key)
         if data:
-            return json.loads(data)
+            return JSON_CODEC.loads(data)
         return None
 
     async def set(self, key: str, value, ex: int = 60):
-        return await self.redis.set(key, json.dumps(value), ex=ex)
+        return await self.redis.set(key, JSON_CODEC.dumps(value), ex=ex)
 
     async def delete(self, key: str):
         return await self.redis.delete(key)
@@ -24,7 +34,55 @@ class RedisService:
     async def exists(self, key: str):
         return await self.redis.exists(key)
 
+    async def zadd(self, key: str, mapping: dict, ex: int = 60):
+        return await self.zadd_many([(key, mapping, ex)])
+
+    async def zadd_many(self, items: List[Tuple[str, Dict[str, float], int]]):
+        """Writes (key, mapping, ex) sorted sets in one round trip."""
+        # members and expiry are written together, so key never lives without ttl
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for key, mapping, ex in items:
+                pipe.zadd(key, mapping)
+                pipe.expire(key, ex)
+            return await pipe.execute()
+
+    async def zscore(self, key: str, member: str):
+        return await self.redis.zscore(key, member)
+
+    async def zrangebyscore(self, key: str, min, max, start: int = None, num: int = None, withscores: bool = False):
+        return await self.redis.zrangebyscore(key, min, max, start=start, num=num, withscores=withscores)
+
+
+_redis: Optional[aioredis.Redis] = None
+_sync_redis: Optional[redis.Redis] = None
+
+
+def get_redis() -> aioredis.Redis:
+    """Process wide client, its connection pool is shared by all requests. Opened and closed by app lifespan."""
+    global _redis
+    if _redis is None:
+        _redis = aioredis.from_url(REDIS_URL)
+    return _redis
+
+
+def get_sync_redis() -> redis.Redis:
+    """Process wide client for code running outside of event loop (commit hooks, consumer), it is thread safe."""
+    global _sync_redis
+    if _sync_redis is None:
+        _sync_redis = redis.Redis.from_url(REDIS_URL)
+    return _sync_redis
+
+
+async def close_redis():
+    global _redis, _sync_redis
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
+    if _sync_redis is not None:
+        _sync_redis.close()
+        _sync_redis = None
+
 
 # Dependency to get the RedisService instance
 async def get_redis_service() -> RedisService:
-    return RedisService()
+    return RedisService(get_redis())
@@ -0,0 +1,238 @@
+import logging
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Awaitable, Callable, List, Optional
+
+import redis
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from db import SessionLocal
+from models import MoneyTransaction, TransactionType
+from pydantic_models.page import PageParams
+from services.codec import JSON_CODEC, EncodedRow
+from services.pagination import page_result
+from services.redis_service import RedisService, get_sync_redis
+
+# transactions newer than this many days are "recent" and can still change, older ones never do
+RECENT_DAYS = int(os.environ.get("TRANSACTIONS_CACHE_RECENT_DAYS", 7))
+# new transactions are written through on commit, so recent segment ttl only bounds its size
+RECENT_TTL = int(os.environ.get("TRANSACTIONS_CACHE_RECENT_TTL", 60 * 60))
+HISTORY_TTL = int(os.environ.get("TRANSACTIONS_CACHE_HISTORY_TTL", 24 * 60 * 60))
+# segment with more rows is not cached, request would have to load and encode all of them to serve one page
+SEGMENT_MAX_ROWS = int(os.environ.get("TRANSACTIONS_CACHE_SEGMENT_MAX_ROWS", 1000))
+
+EPOCH = datetime(1970, 1, 1)
+ROW_FIELDS = [column.name for column in MoneyTransaction.__table__.columns]
+# bumped when member format changes, so old members are not read
+CACHE_VERSION = 2
+# redis can not store empty sorted set, this member marks segment as loaded
+LOADED_MARKER = b""
+# score of the marker when segment has more than SEGMENT_MAX_ROWS rows, pages of the view are read from DB until it expires
+OVERSIZED_SCORE = -1
+# session.info key with transactions flushed in current transaction
+PENDING_KEY = "cached_transactions"
+
+# adds member to every segment, segment which did not exist gets ttl, existing ones keep theirs
+APPEND_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    local created = redis.call('EXISTS', key) == 0
+    redis.call('ZADD', key, ARGV[2], ARGV[3])
+    if created then
+        redis.call('EXPIRE', key, ARGV[1])
+    end
+end
+"""
+
+# loader(since, until, limit) returns first limit transactions of a view with since <= created_at < until
+SegmentLoader = Callable[[Optional[datetime], Optional[datetime], int], Awaitable[List[MoneyTransaction]]]
+# reads one page of a view from DB with keyset pagination
+PageLoader = Callable[[PageParams], Awaitable[dict]]
+
+
+class TransactionCacheService:
+    """
+    Every view (user transactions, user transactions of one type, transfers between two users) is cached as two
+    sorted sets scored by created_at: history segment that is immutable and can live long, and recent segment
+    which gets new transactions appended after commit. History segment key contains boundary date, so it is
+    rebuilt once boundary moves. Segments of big views are not cached, their pages are read from DB by index.
+    """
+
+    @classmethod
+    def user_view(cls, user_id: int, transaction_type: TransactionType = None) -> str:
+        if transaction_type:
+            return f"transactions:v{CACHE_VERSION}:user:{user_id}:{transaction_type.value}"
+        return f"transactions:v{CACHE_VERSION}:user:{user_id}"
+
+    @classmethod
+    def pair_view(cls, user1_id: int, user2_id: int) -> str:
+        low_id, high_id = sorted((user1_id, user2_id))
+        return f"transactions:v{CACHE_VERSION}:pair:{low_id}:{high_id}"
+
+    @classmethod
+    def views(cls, transaction: MoneyTransaction) -> List[str]:
+        """Views which list the transaction."""
+        views = []
+        for user_id in filter(None, (transaction.sender_id, transaction.receiver_id)):
+            views += [cls.user_view(user_id), cls.user_view(user_id, TransactionType(transaction.type))]
+        if transaction.type == TransactionType.TRANSFER:
+            views.append(cls.pair_view(transaction.sender_id, transaction.receiver_id))
+        return views
+
+    @classmethod
+    def recent_boundary(cls) -> datetime:
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        return today - timedelta(days=RECENT_DAYS)
+
+    @classmethod
+    def score(cls, created_at: datetime) -> int:
+        # microseconds fit into float mantissa exactly, so scores keep full created_at precision
+        return (created_at - EPOCH) // timedelta(microseconds=1)
+
+    @classmethod
+    def encode(cls, transaction: MoneyTransaction) -> bytes:
+        """Member is json of the row in TransactionOut shape, so it can be written to response without re-encoding."""
+        row = MoneyTransaction.row_encoder()(transaction)
+        # not yet reloaded amount of new transaction could have less decimal places than the stored one
+        row["amount"] = str(Decimal(row["amount"]).quantize(Decimal("0.01")))
+        # zero padded id prefix keeps members with same created_at ordered by id
+        return b"%012d:" % row["id"] + JSON_CODEC.dumps(row)
+
+    @classmethod
+    def decode(cls, member: bytes) -> EncodedRow:
+        return EncodedRow(member[13:])
+
+    @classmethod
+    async def get_view(cls, redis_service: RedisService, view: str, loader: SegmentLoader, fallback: PageLoader,
+                       page: PageParams) -> dict:
+        boundary = cls.recent_boundary()
+        since = max(filter(None, (page.since, page.after and page.after[0])), default=None)
+        segments = []
+        if not since or since < boundary:
+            segments.append((f"{view}:history:{boundary:%Y%m%d}", HISTORY_TTL, None, boundary))
+        if not page.until or page.until > boundary:
+            segments.append((f"{view}:recent", RECENT_TTL, boundary, None))
+
+        # loaded marker and first range of every segment are read in one round trip
+        # rows sharing created_at with cursor come first and are skipped, ask for one more to cover the cursor row
+        num = page.limit + 2 if page.after else page.limit + 1
+        pipe = redis_service.pipeline()
+        for key, ex, segment_since, segment_until in segments:
+            pipe.zscore(key, LOADED_MARKER)
+            pipe.zrangebyscore(key, *cls._score_range(segment_since, page), start=0, num=num, withscores=True)
+        replies = await pipe.execute()
+
+        if OVERSIZED_SCORE in replies[::2]:
+            return await fallback(page)
+
+        rows = []
+        loaded = []
+        for (key, ex, segment_since, segment_until), marker, members in zip(segments, replies[::2], replies[1::2]):
+            count = page.limit + 1 - len(rows)
+            # segment could exist with only written through transactions, it is complete only with the marker
+            if marker is None:
+                transactions = await loader(segment_since, segment_until, SEGMENT_MAX_ROWS + 1)
+                if len(transactions) > SEGMENT_MAX_ROWS:
+                    # only the marker is written, next requests of the view go to DB without loading the segment
+                    loaded.append((key, {LOADED_MARKER: OVERSIZED_SCORE}, ex))
+                    await redis_service.zadd_many(loaded)
+                    return await fallback(page)
+                mapping = {cls.encode(transaction): cls.score(transaction.created_at) for transaction in transactions}
+                mapping[LOADED_MARKER] = 0
+                loaded.append((key, mapping, ex))
+                loaded_rows = [(cls.decode(member), score) for member, score in mapping.items() if member != LOADED_MARKER]
+                rows += [row for row, score in loaded_rows if cls._in_page(row, score, page)][:count]
+            else:
+                rows += await cls._read_segment(redis_service, key, segment_since, page, count, members, num)
+            if len(rows) > page.limit:
+                break
+
+        if loaded:
+            # loaded segments are written together, second round trip only on miss
+            await redis_service.zadd_many(loaded)
+        return page_result(rows[:page.limit], len(rows) > page.limit, lambda row: (datetime.fromisoformat(row["created_at"]), row["id"]))
+
+    @classmethod
+    def append(cls, client: redis.Redis, transactions: List[MoneyTransaction]):
+        """
+        Adds committed transactions to recent segments of their views. Segments are updated even if they were
+        not loaded yet, loader adds its rows next to them, so transaction committed while segment is being loaded
+        can not be lost.
+        """
+        boundary = cls.recent_boundary()
+        script = client.register_script(APPEND_SCRIPT)
+        with client.pipeline(transaction=False) as pipe:
+            for transaction in transactions:
+                if transaction.created_at < boundary:
+                    continue
+                keys = [f"{view}:recent" for view in cls.views(transaction)]
+                script(keys=keys, args=[RECENT_TTL, cls.score(transaction.created_at), cls.encode(transaction)], client=pipe)
+            pipe.execute()
+
+    @classmethod
+    async def _read_segment(cls, redis_service: RedisService, key: str, since: Optional[datetime], page: PageParams,
+                            count: int, members: list, num: int) -> List[dict]:
+        """Filters already read members, next ranges are read only when too many of them were skipped."""
+        rows = []
+        offset = 0
+        while True:
+            offset += len(members)
+            for member, score in members:
+                row = cls.decode(member)
+                if cls._in_page(row, int(score), page):
+                    rows.append(row)
+            if len(rows) >= count or len(members) < num:
+                return rows[:count]
+            members = await redis_service.zrangebyscore(key, *cls._score_range(since, page), start=offset, num=num, withscores=True)
+
+    @classmethod
+    def _score_range(cls, since: Optional[datetime], page: PageParams) -> tuple:
+        # recent segment could be built with older boundary, rows before current boundary are in history already
+        lower = max(filter(None, (since, page.since, page.after and page.after[0])), default=None)
+        min_score = cls.score(lower) if lower else "(0"
+        max_score = f"({cls.score(page.until)}" if page.until else "+inf"
+        return min_score, max_score
+
+    @classmethod
+    def _in_page(cls, row: dict, score: int, page: PageParams) -> bool:
+        if page.since and score < cls.score(page.since):
+            return False
+        if page.until and score >= cls.score(page.until):
+            return False
+        if page.after:
+            return (score, row["id"]) > (cls.score(page.after[0]), page.after[1])
+        return True
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def collect_transactions(session: Session, flush_context):
+    # id and created_at are known after flush, after commit attributes are expired and can not be loaded anymore
+    transactions = [obj for obj in session.new if isinstance(obj, MoneyTransaction)]
+    if transactions:
+        session.info.setdefault(PENDING_KEY, []).extend(
+            (transaction, MoneyTransaction(**{field: getattr(transaction, field) for field in ROW_FIELDS}))
+            for transaction in transactions
+        )
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def append_transactions(session: Session):
+    # released savepoint fires after_commit too, its rows are appended only once the outer transaction commits
+    if session.in_nested_transaction():
+        return
+    # transactions flushed in rolled back savepoint are not persistent anymore
+    committed = [row for transaction, row in session.info.pop(PENDING_KEY, []) if inspect(transaction).persistent]
+    if not committed:
+        return
+    try:
+        TransactionCacheService.append(get_sync_redis(), committed)
+    except redis.RedisError as e:
+        # transaction is committed already, views are stale until recent segment expires
+        logging.warning(f"Failed to append transactions to cache: {e}")
+
+
+@event.listens_for(SessionLocal, "after_soft_rollback")
+def discard_transactions(session: Session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop(PENDING_KEY, None)
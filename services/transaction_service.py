@@ -1,43 +1,116 @@
+from datetime import datetime
 from decimal import Decimal
 from typing import List
 
+from sqlalchemy import Select, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
+from errors.transfer_error import TransferBatchError, TransferError
 from errors.withdraw_error import WithdrawError
 from models import MoneyTransaction, TransactionType, User
-from pydantic_models.transaction import WithdrawCreate
+from pydantic_models.page import PageParams
+from pydantic_models.transaction import (
+    TransactionCreate, TransactionOut, TransferBatchMode, TransferResult, WithdrawCreate
+)
+from services.balance_shard_service import BalanceShardService
+from services.pagination import paginate
 from services.redis_service import RedisService
+from services.transaction_cache_service import TransactionCacheService
+from services.transfer_pair_service import TransferPairService
 from services.user_service import UserService
+from services.user_stats_service import UserStatsService
+
+# transactions are stored with 2 decimal places
+CENTS = Decimal("0.01")
 
 
 class TransactionService:
     @classmethod
-    def transfer_money(cls, db: Session, sender: User, receiver: User, amount: Decimal, transfer_type: TransactionType) -> MoneyTransaction:
-        sender.balance -= amount
-        receiver.balance += amount
+    def transfer_money(cls, db: Session, sender_id: int, receiver_id: int, amount: Decimal, transfer_type: TransactionType) -> MoneyTransaction:
+        # rows are updated in user id order, so concurrent transfers lock them in the same order and can not deadlock
+        for user_id in sorted({sender_id, receiver_id}):
+            if user_id == sender_id and UserService.debit(db, sender_id, amount) is None:
+                raise TransferError("User not found" if not UserService.exists(db, sender_id) else "Insufficient balance")
+            if user_id == receiver_id and UserService.credit(db, receiver_id, amount) is None:
+                raise TransferError("User not found")
 
         db_transaction = MoneyTransaction(
-            sender_id=sender.id,
-            receiver_id=receiver.id,
+            sender_id=sender_id,
+            receiver_id=receiver_id,
             amount=amount,
             type=transfer_type
         )
 
         db.add(db_transaction)
+        TransferPairService.record(db, [db_transaction])
+        UserStatsService.record(db, [db_transaction])
 
         return db_transaction
 
     @classmethod
-    def withdraw_money(cls, db: Session, transaction: WithdrawCreate):
-        user = UserService.fetch(db, transaction.sender_id)
+    def transfer_batch(cls, db: Session, items: List[TransactionCreate], mode: TransferBatchMode) -> List[TransferResult]:
+        """
+        Applies transfers in given order with all involved users fetched and locked by one query. In all or nothing
+        mode any failed item raises TransferBatchError, otherwise failed items are reported and the rest is applied.
+        """
+        user_ids = {item.sender_id for item in items} | {item.receiver_id for item in items}
+        # rows already in session are overwritten with locked ones, balances read before the lock could be stale
+        users = {
+            user.id: user for user in
+            db.scalars(
+                select(User).where(User.id.in_(user_ids)).order_by(User.id).with_for_update()
+                .execution_options(populate_existing=True)
+            )
+        }
+
+        results = []
+        transactions = []
+        for index, item in enumerate(items):
+            sender = users.get(item.sender_id)
+            receiver = users.get(item.receiver_id)
+            if not sender or not receiver:
+                results.append(TransferResult(index=index, ok=False, error="User not found"))
+                continue
+            if sender.main_balance < item.amount and sender.shard_count:
+                # users row is locked already, shards are locked after it (deadlock with concurrent credit is retried)
+                sender.main_balance += BalanceShardService.drain(db, sender.id)
+            if sender.main_balance < item.amount:
+                results.append(TransferResult(index=index, ok=False, error="Insufficient balance"))
+                continue
+
+            sender.main_balance -= item.amount
+            receiver.main_balance += item.amount
+            transactions.append((index, MoneyTransaction(
+                sender_id=item.sender_id,
+                receiver_id=item.receiver_id,
+                amount=item.amount.quantize(CENTS),
+                type=TransactionType.TRANSFER
+            )))
+
+        if mode == TransferBatchMode.ALL_OR_NOTHING and len(transactions) < len(items):
+            results += [TransferResult(index=index, ok=False, error="Batch rolled back") for index, _ in transactions]
+            raise TransferBatchError(sorted(results, key=lambda result: result.index))
+
+        # one flush writes balances and inserts all rows in batches
+        db.add_all([transaction for _, transaction in transactions])
+        db.flush()
+        TransferPairService.record(db, [transaction for _, transaction in transactions])
+        UserStatsService.record(db, [transaction for _, transaction in transactions])
+
+        results += [
+            TransferResult(index=index, ok=True, transaction=TransactionOut.model_validate(transaction, from_attributes=True))
+            for index, transaction in transactions
+        ]
+        return sorted(results, key=lambda result: result.index)
 
-        if not user:
-            raise WithdrawError("User not found")
-        if user.balance < transaction.amount:
+    @classmethod
+    def withdraw_money(cls, db: Session, transaction: WithdrawCreate):
+        if UserService.debit(db, transaction.sender_id, transaction.amount) is None:
+            if not UserService.exists(db, transaction.sender_id):
+                raise WithdrawError("User not found")
             raise WithdrawError("Insufficient balance")
 
-        user.balance -= Decimal(transaction.amount)
-
         db_transaction = MoneyTransaction(
             sender_id=transaction.sender_id,
             amount=transaction.amount,
@@ -45,43 +118,56 @@ class TransactionService:
         )
 
         db.add(db_transaction)
+        UserStatsService.record(db, [db_transaction])
 
         return db_transaction
 
     @classmethod
-    async def get_all_transactions(cls, db: Session, redis_service: RedisService) -> List[dict]:
-        await redis_service.delete("all_transactions")
-        transactions_cache = await redis_service.get("all_transactions")
-        if transactions_cache:
-            return transactions_cache
+    def filter_transactions(cls, statement: Select, user_id: int = None, transaction_type: TransactionType = None,
+                            since: datetime = None, until: datetime = None) -> Select:
+        if user_id:
+            statement = statement.where(or_(MoneyTransaction.sender_id == user_id, MoneyTransaction.receiver_id == user_id))
+        if transaction_type:
+            statement = statement.where(MoneyTransaction.type == transaction_type)
+        if since:
+            statement = statement.where(MoneyTransaction.created_at >= since)
+        if until:
+            statement = statement.where(MoneyTransaction.created_at < until)
+        return statement
 
-        transactions = db.query(MoneyTransaction).all()
-        transactions_dicts = [transaction.to_dict() for transaction in transactions]
-        await redis_service.set("all_transactions", transactions_dicts)
-        return transactions_dicts
+    @classmethod
+    async def get_all_transactions(cls, db: AsyncSession, page: PageParams = None) -> dict:
+        return await paginate(db, select(MoneyTransaction), MoneyTransaction, page or PageParams())
 
     @classmethod
-    async def get_user_transactions(cls, db: Session, redis_service: RedisService, user_id: int, transaction_type: TransactionType = None):
-        transactions = await cls.get_all_transactions(db, redis_service)
-        if not transactions:
-            return []
+    async def get_user_transactions(cls, db: AsyncSession, redis_service: RedisService, user_id: int, transaction_type: TransactionType = None,
+                                    page: PageParams = None) -> dict:
+        statement = cls.filter_transactions(select(MoneyTransaction), user_id, transaction_type)
+        view = TransactionCacheService.user_view(user_id, transaction_type)
+        return await TransactionCacheService.get_view(
+            redis_service, view, lambda since, until, limit: cls._load_segment(db, statement, since, until, limit),
+            lambda params: paginate(db, statement, MoneyTransaction, params), page or PageParams()
+        )
 
-        filtered_transactions = [t for t in transactions if t['sender_id'] == user_id or t['receiver_id'] == user_id]
-        if transaction_type:
-            filtered_transactions = [t for t in filtered_transactions if t['type'] == transaction_type.value]
-        return filtered_transactions
+    @classmethod
+    async def get_transactions_between_users(cls, db: AsyncSession, redis_service: RedisService, user1_id: int, user2_id: int,
+                                             page: PageParams = None) -> dict:
+        low_user_id, high_user_id = TransferPairService.pair_key(user1_id, user2_id)
+        # matches ix_transactions_pair_created_at, both directions are read with one index range
+        statement = select(MoneyTransaction).where(
+            func.least(MoneyTransaction.sender_id, MoneyTransaction.receiver_id) == low_user_id,
+            func.greatest(MoneyTransaction.sender_id, MoneyTransaction.receiver_id) == high_user_id,
+            MoneyTransaction.type == TransactionType.TRANSFER
+        )
+
+        view = TransactionCacheService.pair_view(user1_id, user2_id)
+        return await TransactionCacheService.get_view(
+            redis_service, view, lambda since, until, limit: cls._load_segment(db, statement, since, until, limit),
+            lambda params: paginate(db, statement, MoneyTransaction, params), page or PageParams()
+        )
 
     @classmethod
-    async def get_transactions_between_users(cls, db: Session, redis_service: RedisService, user1_id: int, user2_id: int):
-        transactions = await cls.get_all_transactions(db, redis_service)
-        if not transactions:
-            return []
-
-        filtered_transactions = [
-            t for t in transactions
-            if (
-                       (t['sender_id'] == user1_id and t['receiver_id'] == user2_id) or
-                       (t['sender_id'] == user2_id and t['receiver_id'] == user1_id)
-               ) and t['type'] == TransactionType.TRANSFER
-        ]
-        return filtered_transactions
+    async def _load_segment(cls, db: AsyncSession, statement: Select, since: datetime = None, until: datetime = None,
+                            limit: int = None) -> List[MoneyTransaction]:
+        statement = cls.filter_transactions(statement, since=since, until=until)
+        return (await db.scalars(statement.order_by(MoneyTransaction.created_at, MoneyTransaction.id).limit(limit))).all()
@@ -0,0 +1,84 @@
+from collections import defaultdict
+from decimal import Decimal
+from typing import List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from models import MoneyTransaction, TransferPair
+
+
+class TransferPairService:
+
+    @classmethod
+    def pair_key(cls, user1_id: int, user2_id: int) -> tuple:
+        return min(user1_id, user2_id), max(user1_id, user2_id)
+
+    @classmethod
+    def record(cls, db: Session, transactions: List[MoneyTransaction]):
+        """Adds transfers to pair totals, has to run in the same DB transaction as transfers themselves."""
+        totals = defaultdict(lambda: [Decimal(0), 0, Decimal(0), 0])
+        for transaction in transactions:
+            pair = cls.pair_key(transaction.sender_id, transaction.receiver_id)
+            # low_to_high totals are at 0 and 1, high_to_low at 2 and 3
+            offset = 0 if transaction.sender_id == pair[0] else 2
+            totals[pair][offset] += transaction.amount
+            totals[pair][offset + 1] += 1
+        if not totals:
+            return
+
+        # rows are upserted in key order, so concurrent batches lock pairs in the same order
+        statement = insert(TransferPair).values([
+            {
+                "low_user_id": low_user_id,
+                "high_user_id": high_user_id,
+                "low_to_high_amount": low_to_high_amount,
+                "low_to_high_count": low_to_high_count,
+                "high_to_low_amount": high_to_low_amount,
+                "high_to_low_count": high_to_low_count,
+                "first_transfer_at": func.now(),
+                "last_transfer_at": func.now(),
+            }
+            for (low_user_id, high_user_id), (low_to_high_amount, low_to_high_count, high_to_low_amount, high_to_low_count)
+            in sorted(totals.items())
+        ])
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[TransferPair.low_user_id, TransferPair.high_user_id],
+            set_={
+                "low_to_high_amount": TransferPair.low_to_high_amount + statement.excluded.low_to_high_amount,
+                "low_to_high_count": TransferPair.low_to_high_count + statement.excluded.low_to_high_count,
+                "high_to_low_amount": TransferPair.high_to_low_amount + statement.excluded.high_to_low_amount,
+                "high_to_low_count": TransferPair.high_to_low_count + statement.excluded.high_to_low_count,
+                "last_transfer_at": statement.excluded.last_transfer_at,
+            }
+        ))
+
+    @classmethod
+    async def get_summary(cls, db: AsyncSession, user1_id: int, user2_id: int) -> dict:
+        pair: Optional[TransferPair] = await db.get(TransferPair, cls.pair_key(user1_id, user2_id))
+        summary = {
+            "user1_id": user1_id,
+            "user2_id": user2_id,
+            "sent_amount": Decimal(0),
+            "sent_count": 0,
+            "received_amount": Decimal(0),
+            "received_count": 0,
+            "first_transfer_at": None,
+            "last_transfer_at": None,
+        }
+        if not pair:
+            return summary
+
+        # summary is told from user1 point of view
+        forward = user1_id <= user2_id
+        summary.update({
+            "sent_amount": pair.low_to_high_amount if forward else pair.high_to_low_amount,
+            "sent_count": pair.low_to_high_count if forward else pair.high_to_low_count,
+            "received_amount": pair.high_to_low_amount if forward else pair.low_to_high_amount,
+            "received_count": pair.high_to_low_count if forward else pair.low_to_high_count,
+            "first_transfer_at": pair.first_transfer_at,
+            "last_transfer_at": pair.last_transfer_at,
+        })
+        return summary
@@ -0,0 +1,121 @@
+import csv
+import enum
+import io
+import json
+import os
+import tempfile
+from decimal import Decimal
+from typing import AsyncIterator, Iterable, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import DateTime, cast, func, select
+from sqlalchemy.orm import Session
+
+from models import User
+from pydantic_models.user import UserCreate
+
+IMPORT_CHUNK_SIZE = int(os.environ.get("USER_IMPORT_CHUNK_SIZE", 10000))
+# request body above this size is spooled to disk instead of memory
+IMPORT_SPOOL_SIZE = int(os.environ.get("USER_IMPORT_SPOOL_SIZE", 16 * 1024 * 1024))
+
+COPY_USERS_SQL = "COPY users (name, balance, opening_balance, created_at) FROM STDIN WITH (FORMAT csv)"
+# UserCreate allows balances above numeric(12,2) of the column, one such row would fail the whole COPY
+MAX_BALANCE = Decimal(10) ** (User.main_balance.type.precision - User.main_balance.type.scale)
+
+
+class ImportFormat(str, enum.Enum):
+    JSONL = "jsonl"
+    CSV = "csv"
+
+
+class UserImportService:
+    """
+    Loads users with COPY in chunks of IMPORT_CHUNK_SIZE rows. Invalid rows are reported and skipped,
+    they do not abort the load. Whole load is one transaction, commit is left to caller.
+    """
+
+    @classmethod
+    def import_users(cls, db: Session, lines: Iterable[str], import_format: ImportFormat) -> dict:
+        # same value as created_at default of ORM insert, which is transaction time
+        created_at = db.scalar(select(cast(func.now(), DateTime)))
+        imported, rejected, chunk = 0, [], []
+
+        for line, row in cls.parse(lines, import_format):
+            if isinstance(row, str):
+                rejected.append({"line": line, "error": row})
+                continue
+            try:
+                user = UserCreate(**row)
+            except ValidationError as e:
+                rejected.append({"line": line, "error": cls._validation_message(e)})
+                continue
+            error = cls._column_error(user)
+            if error:
+                rejected.append({"line": line, "error": error})
+            else:
+                chunk.append(user)
+
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                imported += cls.copy_users(db, chunk, created_at)
+                chunk = []
+        if chunk:
+            imported += cls.copy_users(db, chunk, created_at)
+
+        return {"imported": imported, "rejected": rejected}
+
+    @classmethod
+    def parse(cls, lines: Iterable[str], import_format: ImportFormat) -> Iterator[Tuple[int, object]]:
+        """Yields (line number, row dict) or (line number, error message) when line can not be parsed."""
+        if import_format == ImportFormat.CSV:
+            reader = csv.DictReader(lines)
+            for row in reader:
+                # empty cells fall back to UserCreate defaults, extra cells are ignored
+                yield reader.line_num, {key: value for key, value in row.items() if key and value not in ("", None)}
+            return
+
+        for line, text in enumerate(lines, start=1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except json.JSONDecodeError:
+                yield line, "Invalid JSON"
+                continue
+            yield line, row if isinstance(row, dict) else "Expected JSON object"
+
+    @classmethod
+    def copy_users(cls, db: Session, users: List[UserCreate], created_at) -> int:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows([user.name, user.balance, user.balance, created_at.isoformat()] for user in users)
+        buffer.seek(0)
+
+        # COPY is not supported by SQLAlchemy, it goes through psycopg2 cursor of session connection
+        cursor = db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(COPY_USERS_SQL, buffer)
+        finally:
+            cursor.close()
+        return len(users)
+
+    @staticmethod
+    async def spool(stream: AsyncIterator[bytes]) -> io.TextIOWrapper:
+        """Buffers request body so it can be imported line by line in worker thread."""
+        body = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_SIZE)
+        async for chunk in stream:
+            body.write(chunk)
+        body.seek(0)
+        # undecodable bytes end up as invalid rows instead of failing whole import
+        return io.TextIOWrapper(body, encoding="utf-8", errors="replace", newline="")
+
+    @staticmethod
+    def _column_error(user: UserCreate) -> Optional[str]:
+        """Catches rows that pass UserCreate but are refused by Postgres, they must not abort the COPY."""
+        if "\x00" in user.name:
+            return "name: NUL character is not allowed"
+        if user.balance >= MAX_BALANCE:
+            return f"balance: Input should be less than {MAX_BALANCE}"
+        return None
+
+    @staticmethod
+    def _validation_message(error: ValidationError) -> str:
+        return "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in error.errors())
@@ -1,6 +1,14 @@
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import exists, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from models import User
+from pydantic_models.page import PageParams
 from pydantic_models.user import UserCreate
+from services.balance_shard_service import BalanceShardService
+from services.pagination import paginate
 
 
 class UserService:
@@ -9,15 +17,64 @@ class UserService:
     def fetch(cls, db: Session, user_id: int) -> User:
         return db.query(User).get(user_id)
 
+    @classmethod
+    def exists(cls, db: Session, user_id: int) -> bool:
+        return db.scalar(select(exists().where(User.id == user_id)))
+
+    @classmethod
+    def debit(cls, db: Session, user_id: int, amount: Decimal) -> Optional[Decimal]:
+        """
+        Takes amount from users row in one statement, returns its new balance or None if user has not enough money.
+        When users row of sharded user does not have enough, its shards are consolidated into it first.
+        """
+        balance = cls._debit(db, user_id, amount)
+        if balance is None and BalanceShardService.consolidate(db, user_id):
+            balance = cls._debit(db, user_id, amount)
+        return balance
+
+    @classmethod
+    def credit(cls, db: Session, user_id: int, amount: Decimal) -> Optional[Decimal]:
+        """
+        Adds amount to user balance in one statement, returns new balance of credited row or None if user does not
+        exist. Sharded user is credited on one of its shards, so its users row is not locked.
+        """
+        balance = cls._credit(db, user_id, amount, User.shard_count == 0)
+        if balance is None:
+            balance = BalanceShardService.credit(db, user_id, amount)
+        if balance is None:
+            # user has no shards (anymore), users row is part of balance of every user
+            balance = cls._credit(db, user_id, amount)
+        return balance
+
+    @classmethod
+    def _debit(cls, db: Session, user_id: int, amount: Decimal) -> Optional[Decimal]:
+        return db.execute(
+            update(User)
+            .where(User.id == user_id, User.main_balance >= amount)
+            .values(main_balance=User.main_balance - amount)
+            .returning(User.main_balance)
+            .execution_options(synchronize_session=False)
+        ).scalar_one_or_none()
+
+    @classmethod
+    def _credit(cls, db: Session, user_id: int, amount: Decimal, *conditions) -> Optional[Decimal]:
+        return db.execute(
+            update(User)
+            .where(User.id == user_id, *conditions)
+            .values(main_balance=User.main_balance + amount)
+            .returning(User.main_balance)
+            .execution_options(synchronize_session=False)
+        ).scalar_one_or_none()
+
     @classmethod
     def create_user(cls, db: Session, user: UserCreate) -> User:
         db_user = User()
         db_user.name = user.name
-        db_user.balance = user.balance
+        db_user.main_balance = user.balance
         db.add(db_user)
 
         return db_user
 
     @classmethod
-    def get_users(cls, db: Session):
-        return db.query(User).order_by(User.name).all()
+    async def get_users(cls, db: AsyncSession, page: PageParams = None) -> dict:
+        return await paginate(db, select(User), User, page or PageParams())
@@ -0,0 +1,87 @@
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from typing import List, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from models import MoneyTransaction, TransactionType, UserDailyStat
+
+STAT_FIELDS = ("sent_amount", "sent_count", "received_amount", "received_count", "withdrawn_amount", "withdrawn_count")
+
+
+class UserStatsService:
+
+    @classmethod
+    def record(cls, db: Session, transactions: List[MoneyTransaction]):
+        """Adds transactions to daily stats of their users, has to run in the same DB transaction as transactions themselves."""
+        totals = defaultdict(lambda: [Decimal(0), 0, Decimal(0), 0])
+        for transaction in transactions:
+            if transaction.sender_id is not None:
+                totals[(transaction.sender_id, transaction.type)][0] += transaction.amount
+                totals[(transaction.sender_id, transaction.type)][1] += 1
+            if transaction.receiver_id is not None:
+                totals[(transaction.receiver_id, transaction.type)][2] += transaction.amount
+                totals[(transaction.receiver_id, transaction.type)][3] += 1
+        if not totals:
+            return
+
+        # created_at of new transactions is start of DB transaction, current_date is the day of it, rows are upserted
+        # in key order, so concurrent batches lock them in the same order
+        statement = insert(UserDailyStat).values([
+            {
+                "user_id": user_id,
+                "day": func.current_date(),
+                "type": transaction_type,
+                "sent_amount": sent_amount,
+                "sent_count": sent_count,
+                "received_amount": received_amount,
+                "received_count": received_count,
+            }
+            for (user_id, transaction_type), (sent_amount, sent_count, received_amount, received_count)
+            in sorted(totals.items())
+        ])
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[UserDailyStat.user_id, UserDailyStat.day, UserDailyStat.type],
+            set_={
+                "sent_amount": UserDailyStat.sent_amount + statement.excluded.sent_amount,
+                "sent_count": UserDailyStat.sent_count + statement.excluded.sent_count,
+                "received_amount": UserDailyStat.received_amount + statement.excluded.received_amount,
+                "received_count": UserDailyStat.received_count + statement.excluded.received_count,
+            }
+        ))
+
+    @classmethod
+    async def get_stats(cls, db: AsyncSession, user_id: int, since: Optional[date] = None, until: Optional[date] = None) -> dict:
+        """Totals of user per day from since (inclusive) to until (exclusive) and over the whole range."""
+        statement = select(UserDailyStat).where(UserDailyStat.user_id == user_id)
+        if since:
+            statement = statement.where(UserDailyStat.day >= since)
+        if until:
+            statement = statement.where(UserDailyStat.day < until)
+
+        days = {}
+        for stat in await db.scalars(statement.order_by(UserDailyStat.day)):
+            day = days.setdefault(stat.day, cls._empty({"day": stat.day}))
+            if stat.type == TransactionType.WITHDRAWAL:
+                day["withdrawn_amount"] += stat.sent_amount
+                day["withdrawn_count"] += stat.sent_count
+            else:
+                day["sent_amount"] += stat.sent_amount
+                day["sent_count"] += stat.sent_count
+            day["received_amount"] += stat.received_amount
+            day["received_count"] += stat.received_count
+
+        stats = cls._empty({"user_id": user_id, "since": since, "until": until, "days": list(days.values())})
+        for day in days.values():
+            for field in STAT_FIELDS:
+                stats[field] += day[field]
+        return stats
+
+    @classmethod
+    def _empty(cls, stats: dict) -> dict:
+        stats.update({field: Decimal(0) if field.endswith("_amount") else 0 for field in STAT_FIELDS})
+        return stats
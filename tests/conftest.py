@@ -1,7 +1,10 @@
 import pytest
+import pytest_asyncio
 from decimal import Decimal
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from sqlalchemy_utils import database_exists, create_database, drop_database
 from models.base_model import Base
 from pydantic_models.user import UserCreate
@@ -15,6 +18,14 @@ if not database_exists(engine.url):
     create_database(engine.url)
 
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# connections are not shared between event loops of different tests
+async_engine = create_async_engine(engine.url.set(drivername="postgresql+asyncpg"), poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+@pytest.fixture
+def mock_db_session(mocker):
+    return mocker.MagicMock()
 
 
 @pytest.fixture(scope="function")
@@ -29,6 +40,12 @@ def session():
         db.close()
 
 
+@pytest_asyncio.fixture(scope="function")
+async def async_session():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
 @pytest.fixture(scope="module", autouse=True)
 def setup_and_teardown():
     # Setup: Clear the database before each test
@@ -40,6 +57,33 @@ def setup_and_teardown():
     # Teardown: Close the database session
 
 
+@pytest.fixture
+def app_session_factory():
+    """Sessions of the app sessionmaker (with its cache hooks) bound to test database."""
+    from db import SessionLocal
+    sessions = []
+
+    def factory():
+        sessions.append(SessionLocal(bind=engine))
+        return sessions[-1]
+
+    yield factory
+    for db in sessions:
+        db.close()
+
+
+@pytest.fixture
+def appended_transactions(mocker):
+    """Collects ids of transactions the commit hook appends to cached views."""
+    appended = []
+    mocker.patch("services.transaction_cache_service.get_sync_redis")
+    mocker.patch(
+        "services.transaction_cache_service.TransactionCacheService.append",
+        side_effect=lambda client, transactions: appended.extend(transaction.id for transaction in transactions)
+    )
+    return appended
+
+
 @pytest.fixture(scope="function")
 def override_get_db():
     try:
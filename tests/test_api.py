@@ -1,9 +1,12 @@
 import pytest
+import redis.asyncio as aioredis
 from fastapi.testclient import TestClient
 
-from db import get_db
+from db import get_db, get_async_db
 from main import app
-from tests.conftest import TestingSessionLocal
+from services.rabbit_service import AsyncRabbitMQPublisher, get_async_rabbitmq_publisher, rabbitmq_config
+from services.redis_service import REDIS_URL, RedisService, get_redis_service
+from tests.conftest import TestingSessionLocal, TestingAsyncSessionLocal
 
 
 # override DB connection
@@ -17,7 +20,32 @@ def override_get_db():
         db.close()
 
 
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
+# client without lifespan runs every request in new event loop, shared client can not be used
+async def override_get_redis_service():
+    client = aioredis.from_url(REDIS_URL)
+    try:
+        yield RedisService(client)
+    finally:
+        await client.aclose()
+
+
+async def override_get_async_rabbitmq_publisher():
+    publisher = AsyncRabbitMQPublisher(rabbitmq_config)
+    try:
+        yield publisher
+    finally:
+        await publisher.close()
+
+
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
+app.dependency_overrides[get_redis_service] = override_get_redis_service
+app.dependency_overrides[get_async_rabbitmq_publisher] = override_get_async_rabbitmq_publisher
 # Create a TestClient instance to make requests to your FastAPI app
 client = TestClient(app)
 
@@ -35,7 +63,7 @@ def test_create_user():
 def test_get_users():
     response = client.get("/users/")
     assert response.status_code == 200
-    data = response.json()
+    data = response.json()["items"]
     assert isinstance(data, list)
     assert len(data) == 1  # We only have one user in the test database
 
@@ -55,11 +83,30 @@ def test_get_transactions_history():
     # Send a GET request to retrieve transaction history between two users
     response = client.get("/transactions/history/1/2")
     assert response.status_code == 200
-    data = response.json()
+    data = response.json()["items"]
     assert isinstance(data, list)
     assert len(data) == 1  # Including the transfer transaction from user with ID 1 to user with ID 2
 
 
+def test_get_transactions_history_summary():
+    response = client.get("/transactions/history/2/1/summary")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["received_count"] == 1
+    assert data["received_amount"] == '50.00'
+    assert data["sent_count"] == 0
+
+
+def test_get_user_stats():
+    response = client.get("/users/1/stats")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["sent_count"] == 1
+    assert data["sent_amount"] == '50.00'
+    assert len(data["days"]) == 1
+    assert data["days"][0]["received_count"] == 0
+
+
 def test_withdraw_money():
     # Send a POST request to withdraw money from a user
     response = client.post("/transactions/withdraw", json={"sender_id": 1, "amount": 50.0})
@@ -73,7 +120,7 @@ def test_get_all_transactions():
     # Send a GET request to retrieve all transactions
     response = client.get("/transactions/")
     assert response.status_code == 200
-    data = response.json()
+    data = response.json()["items"]
     assert isinstance(data, list)
     assert len(data) == 1  # Including the transfer and withdrawal transactions
 
@@ -82,6 +129,64 @@ def test_get_transactions_for_user():
     # Send a GET request to retrieve transactions for a specific user
     response = client.get("/transactions/1")
     assert response.status_code == 200
-    data = response.json()
+    data = response.json()["items"]
     assert isinstance(data, list)
     assert len(data) == 1  # Including the transfer and withdrawal transactions for user with ID 1
+
+
+def test_get_transactions_page_limit():
+    client.post("/transactions/transfer", json={"sender_id": 2, "receiver_id": 1, "amount": 10.0})
+    response = client.get("/transactions/", params={"limit": 1})
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["items"]) == 1
+    assert data["next_cursor"]
+
+    response = client.get("/transactions/", params={"limit": 1, "cursor": data["next_cursor"]})
+    assert response.status_code == 200
+    next_data = response.json()
+    assert len(next_data["items"]) == 1
+    assert next_data["items"][0]["id"] != data["items"][0]["id"]
+
+
+def test_get_transactions_invalid_cursor():
+    response = client.get("/transactions/", params={"cursor": "not a cursor"})
+    assert response.status_code == 400
+
+
+def test_transfer_money_batch():
+    response = client.post("/transactions/transfer/batch", json={
+        "mode": "best_effort",
+        "items": [
+            {"sender_id": 2, "receiver_id": 1, "amount": 1.0},
+            {"sender_id": 2, "receiver_id": 999, "amount": 1.0},
+        ]
+    })
+    assert response.status_code == 200
+    data = response.json()
+    assert data["committed"] is True
+    assert data["results"][0]["ok"] is True
+    assert data["results"][0]["transaction"]["amount"] == '1.00'
+    assert data["results"][1] == {"index": 1, "ok": False, "transaction": None, "error": "User not found"}
+
+
+def test_transfer_money_batch_all_or_nothing():
+    response = client.post("/transactions/transfer/batch", json={
+        "items": [
+            {"sender_id": 2, "receiver_id": 1, "amount": 1.0},
+            {"sender_id": 2, "receiver_id": 999, "amount": 1.0},
+        ]
+    })
+    assert response.status_code == 200
+    data = response.json()
+    assert data["committed"] is False
+    assert [result["error"] for result in data["results"]] == ["Batch rolled back", "User not found"]
+
+
+def test_import_users():
+    body = '{"name": "Imported user", "balance": 10}\n{"name": "x"}\n'
+    response = client.post("/users/import", content=body)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["imported"] == 1
+    assert data["rejected"] == [{"line": 2, "error": "name: String should have at least 3 characters"}]
@@ -0,0 +1,83 @@
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import select
+
+from models import BalanceShard, User
+from pydantic_models.transaction import TransactionCreate, TransferBatchMode
+from services.balance_shard_service import BalanceShardService
+from services.transaction_service import TransactionService
+from services.user_service import UserService
+
+
+def shard_balances(session, user_id):
+    return session.scalars(select(BalanceShard.balance).where(BalanceShard.user_id == user_id).order_by(BalanceShard.shard)).all()
+
+
+def fetch(session, user_id) -> User:
+    return session.get(User, user_id, populate_existing=True)
+
+
+@pytest.mark.usefixtures("session")
+@pytest.mark.usefixtures("create_user")
+def test_credit_goes_to_shard_and_balance_is_the_sum(session, create_user):
+    merchant = create_user("Merchant", Decimal("10"))
+    assert BalanceShardService.set_shards(session, merchant.id, 4)
+
+    for _ in range(3):
+        assert UserService.credit(session, merchant.id, Decimal("5")) is not None
+
+    user = fetch(session, merchant.id)
+    assert user.main_balance == Decimal("10")
+    assert sum(shard_balances(session, merchant.id)) == Decimal("15")
+    assert user.balance == Decimal("25")
+
+
+@pytest.mark.usefixtures("session")
+@pytest.mark.usefixtures("create_user")
+def test_debit_consolidates_shards_when_users_row_has_not_enough(session, create_user):
+    merchant = create_user("Merchant", Decimal("10"))
+    BalanceShardService.set_shards(session, merchant.id, 2)
+    UserService.credit(session, merchant.id, Decimal("30"))
+
+    assert UserService.debit(session, merchant.id, Decimal("5")) == Decimal("5")
+    assert shard_balances(session, merchant.id) != [Decimal(0), Decimal(0)]
+
+    assert UserService.debit(session, merchant.id, Decimal("20")) == Decimal("15")
+    assert shard_balances(session, merchant.id) == [Decimal(0), Decimal(0)]
+    assert UserService.debit(session, merchant.id, Decimal("100")) is None
+    assert fetch(session, merchant.id).balance == Decimal("15")
+
+
+@pytest.mark.usefixtures("session")
+@pytest.mark.usefixtures("create_user")
+def test_transfer_batch_draws_from_sender_shards(session, create_user):
+    merchant = create_user("Merchant", Decimal("0"))
+    customer = create_user("Customer", Decimal("0"))
+    BalanceShardService.set_shards(session, merchant.id, 2)
+    UserService.credit(session, merchant.id, Decimal("50"))
+
+    results = TransactionService.transfer_batch(session, [
+        TransactionCreate(sender_id=merchant.id, receiver_id=customer.id, amount=Decimal("40"))
+    ], TransferBatchMode.ALL_OR_NOTHING)
+
+    assert results[0].ok
+    assert fetch(session, merchant.id).balance == Decimal("10")
+    assert fetch(session, customer.id).balance == Decimal("40")
+
+
+@pytest.mark.usefixtures("session")
+@pytest.mark.usefixtures("create_user")
+def test_removing_shards_keeps_balance(session, create_user):
+    merchant = create_user("Merchant", Decimal("10"))
+    BalanceShardService.set_shards(session, merchant.id, 3)
+    UserService.credit(session, merchant.id, Decimal("7"))
+
+    assert BalanceShardService.set_shards(session, merchant.id, 0)
+
+    user = fetch(session, merchant.id)
+    assert shard_balances(session, merchant.id) == []
+    assert (user.main_balance, user.shard_count, user.balance) == (Decimal("17"), 0, Decimal("17"))
+    assert not BalanceShardService.set_shards(session, 999999, 2)
+    with pytest.raises(ValueError):
+        BalanceShardService.set_shards(session, merchant.id, -1)
@@ -0,0 +1,22 @@
+from benchmarks.runner import compare, percentile, summarize
+
+
+def test_percentile_nearest_rank():
+    values = [i / 1000 for i in range(1, 101)]
+    assert percentile(values, 50) == 0.05
+    assert percentile(values, 99) == 0.099
+    assert percentile([0.5], 95) == 0.5
+
+
+def test_summarize():
+    result = summarize([0.002, 0.001, 0.003, 0.002])
+    assert result["ops"] == 4
+    assert result["ops_per_sec"] == 500.0
+    assert result["p50_ms"] == 2.0
+    assert result["p99_ms"] == 3.0
+
+
+def test_compare_reports_p95_regressions():
+    baseline = {"fast": {"p95_ms": 10.0}, "slow": {"p95_ms": 10.0}}
+    results = {"fast": {"p95_ms": 11.0}, "slow": {"p95_ms": 12.5}, "new": {"p95_ms": 1.0}}
+    assert compare(results, baseline, tolerance=0.2) == ["slow"]
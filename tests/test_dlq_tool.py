@@ -0,0 +1,19 @@
+from pika import BasicProperties
+
+from dlq_tool import replay_messages
+
+
+def test_replay_resets_retry_count(mocker):
+    channel = mocker.MagicMock()
+    method = mocker.MagicMock(delivery_tag=1)
+    channel.basic_get.side_effect = [
+        (method, BasicProperties(headers={"x-retry-count": 5, "x-retry-id": "1f0c"}), b'{"sender_id": 7, "amount": 10.0}'),
+        (None, None, None),
+    ]
+
+    assert replay_messages(channel, "withdrawals.dead", "withdrawals", limit=10) == 1
+
+    publish = channel.basic_publish.call_args.kwargs
+    assert (publish["exchange"], publish["routing_key"]) == ("withdrawals", "")
+    assert publish["properties"].headers == {}
+    channel.basic_ack.assert_called_once_with(delivery_tag=1)
@@ -0,0 +1,64 @@
+import json
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import select
+
+from models import MoneyTransaction, TransactionType
+from services.export_service import ExportFormat, ExportService
+
+
+class StreamResult:
+    def __init__(self, partitions):
+        self._partitions = partitions
+
+    async def partitions(self):
+        for partition in self._partitions:
+            yield partition
+
+
+@pytest.fixture
+def transactions():
+    created_at = datetime(2024, 1, 1, 12, 0)
+    return [
+        MoneyTransaction(id=1, sender_id=1, receiver_id=2, amount=Decimal("10.00"), type=TransactionType.TRANSFER, created_at=created_at),
+        MoneyTransaction(id=2, sender_id=2, receiver_id=None, amount=Decimal("5.50"), type=TransactionType.WITHDRAWAL, created_at=created_at),
+    ]
+
+
+@pytest.fixture
+def mock_export_session(mocker, transactions):
+    db = mocker.AsyncMock()
+    db.expunge_all = mocker.Mock()
+    db.stream_scalars.return_value = StreamResult([transactions[:1], transactions[1:]])
+    session = mocker.patch("services.export_service.AsyncSessionLocal")
+    session.return_value.__aenter__.return_value = db
+    return db
+
+
+async def collect(export_format):
+    return [chunk async for chunk in ExportService.stream_transactions(select(MoneyTransaction), export_format)]
+
+
+@pytest.mark.asyncio
+async def test_export_ndjson(mock_export_session):
+    chunks = await collect(ExportFormat.NDJSON)
+
+    assert len(chunks) == 2
+    rows = [json.loads(line) for line in b"".join(chunks).splitlines()]
+    assert [row["id"] for row in rows] == [1, 2]
+    assert rows[1]["receiver_id"] is None
+    statement = mock_export_session.stream_scalars.call_args.args[0]
+    assert statement.get_execution_options()["yield_per"] > 0
+    assert mock_export_session.expunge_all.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_export_csv(mock_export_session):
+    chunks = await collect(ExportFormat.CSV)
+
+    lines = b"".join(chunks).decode().splitlines()
+    assert lines[0] == "id,type,sender_id,receiver_id,amount,created_at"
+    assert lines[1] == "1,transfer,1,2,10.00,2024-01-01T12:00:00"
+    assert lines[2] == "2,withdrawal,2,,5.50,2024-01-01T12:00:00"
@@ -0,0 +1,120 @@
+from datetime import datetime
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+
+from errors.transfer_error import TransferError
+from models import MoneyTransaction
+from pydantic_models.transaction import TransactionCreate
+from services.group_commit_service import TransferGroupCommitter
+
+
+@pytest.fixture
+def transfers(mocker):
+    """TransactionService.transfer_money which fails for sender 99 and records applied transfers."""
+    applied = []
+
+    def transfer_money(db, sender_id, receiver_id, amount, transfer_type):
+        if sender_id == 99:
+            raise TransferError("Insufficient balance")
+        applied.append(sender_id)
+        return MoneyTransaction(
+            id=len(applied), sender_id=sender_id, receiver_id=receiver_id, amount=amount, type=transfer_type,
+            created_at=datetime(2024, 6, 1)
+        )
+
+    mocker.patch('services.transaction_service.TransactionService.transfer_money', side_effect=transfer_money)
+    return applied
+
+
+def transfer(sender_id: int) -> TransactionCreate:
+    return TransactionCreate(sender_id=sender_id, receiver_id=2, amount=Decimal('10.00'))
+
+
+def test_group_is_committed_once_and_every_caller_gets_own_result(mock_db_session, transfers):
+    committer = TransferGroupCommitter(lambda: mock_db_session, max_size=3, window_ms=10000)
+    try:
+        futures = [committer.submit(transfer(sender_id)) for sender_id in (1, 99, 3)]
+
+        assert futures[0].result(5).sender_id == 1
+        with pytest.raises(TransferError, match="Insufficient balance"):
+            futures[1].result(5)
+        assert futures[2].result(5).sender_id == 3
+    finally:
+        committer.close()
+
+    mock_db_session.commit.assert_called_once()
+    # every transfer in own savepoint, failed one does not roll back the others
+    assert mock_db_session.begin_nested.call_count == 3
+    assert transfers == [1, 3]
+
+
+def test_close_applies_queued_transfers(mock_db_session, transfers):
+    committer = TransferGroupCommitter(lambda: mock_db_session, max_size=10, window_ms=10000)
+    future = committer.submit(transfer(1))
+
+    committer.close()
+
+    assert future.result(0).sender_id == 1
+    mock_db_session.commit.assert_called_once()
+
+
+def test_deadlocked_group_is_applied_one_by_one(mock_db_session, transfers):
+    deadlock = OperationalError("COMMIT", {}, MagicMock(pgcode="40P01"))
+    mock_db_session.commit.side_effect = [deadlock, None, None]
+    committer = TransferGroupCommitter(lambda: mock_db_session, max_size=2, window_ms=10000)
+    try:
+        futures = [committer.submit(transfer(sender_id)) for sender_id in (1, 3)]
+
+        assert [future.result(5).sender_id for future in futures] == [1, 3]
+    finally:
+        committer.close()
+
+    assert mock_db_session.commit.call_count == 3
+    assert transfers == [1, 3, 1, 3]
+
+
+def test_failed_group_commit_fails_every_transfer(mock_db_session, transfers):
+    mock_db_session.commit.side_effect = OperationalError("COMMIT", {}, MagicMock(pgcode="08006"))
+    committer = TransferGroupCommitter(lambda: mock_db_session, max_size=2, window_ms=10000)
+    try:
+        futures = [committer.submit(transfer(sender_id)) for sender_id in (1, 3)]
+
+        for future in futures:
+            with pytest.raises(OperationalError):
+                future.result(5)
+    finally:
+        committer.close()
+
+
+@pytest.mark.usefixtures("create_user")
+def test_cache_gets_only_transfers_of_committed_transaction(create_user, app_session_factory, appended_transactions):
+    alice, bob = create_user("Alice", Decimal("100")), create_user("Bob", Decimal("100"))
+    db = app_session_factory()
+    commit = db.commit
+    commits = []
+
+    def deadlock_first_commit():
+        # group deadlocks, its transfers are applied again one by one with new ids
+        commits.append(len(commits))
+        if len(commits) == 1:
+            raise OperationalError("COMMIT", {}, MagicMock(pgcode="40P01"))
+        commit()
+
+    db.commit = deadlock_first_commit
+    committer = TransferGroupCommitter(lambda: db, max_size=2, window_ms=10000)
+    try:
+        futures = [
+            committer.submit(TransactionCreate(sender_id=alice.id, receiver_id=bob.id, amount=Decimal("1.00"))),
+            committer.submit(TransactionCreate(sender_id=bob.id, receiver_id=alice.id, amount=Decimal("2.00"))),
+        ]
+        results = [future.result(5) for future in futures]
+    finally:
+        committer.close()
+
+    assert len(commits) == 3
+    committed = db.scalars(select(MoneyTransaction.id).where(MoneyTransaction.sender_id.in_([alice.id, bob.id]))).all()
+    assert sorted(appended_transactions) == sorted(committed) == sorted(result.id for result in results)
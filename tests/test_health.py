@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from main import app
+from services.health_service import HealthService
+
+client = TestClient(app)
+
+
+async def reachable():
+    pass
+
+
+async def unreachable():
+    raise ConnectionError("Connection refused")
+
+
+async def hanging():
+    await asyncio.sleep(10)
+
+
+@pytest.fixture
+def checks(mocker):
+    mocker.patch.object(HealthService, "pending", set())
+    return mocker.patch.dict(HealthService.checks, {"postgres": reachable, "redis": reachable, "rabbitmq": reachable})
+
+
+def test_health_does_not_probe_dependencies(checks):
+    checks["postgres"] = unreachable
+
+    response = client.get("/health")
+
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok"}
+
+
+def test_ready_when_all_dependencies_answer(checks):
+    response = client.get("/ready")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["ready"]
+    assert set(body["dependencies"]) == {"postgres", "redis", "rabbitmq"}
+    assert all(dependency["latency_ms"] >= 0 for dependency in body["dependencies"].values())
+
+
+def test_not_ready_reports_failing_dependencies(checks, mocker):
+    mocker.patch("services.health_service.PROBE_TIMEOUT", 0.05)
+    checks["redis"] = unreachable
+    checks["rabbitmq"] = hanging
+    HealthService.pending.add("postgres")
+
+    response = client.get("/ready")
+
+    assert response.status_code == 503
+    dependencies = response.json()["dependencies"]
+    assert dependencies["postgres"]["error"] == "Setup has not finished yet"
+    assert not dependencies["redis"]["ready"]
+    assert dependencies["redis"]["error"] == "Connection refused"
+    assert not dependencies["rabbitmq"]["ready"]
+    assert dependencies["rabbitmq"]["latency_ms"] < 5000
+
+
+@pytest.mark.asyncio
+async def test_setup_is_retried_until_it_succeeds(mocker):
+    mocker.patch.object(HealthService, "pending", set())
+    sleep = mocker.patch("services.health_service.asyncio.sleep")
+    setup = mocker.Mock(side_effect=[ConnectionError("down"), ConnectionError("down"), None])
+
+    await HealthService.setup_with_retry("rabbitmq", setup, delay=1, max_delay=1.5)
+
+    assert setup.call_count == 3
+    assert [call.args[0] for call in sleep.call_args_list] == [1, 1.5]
+    assert HealthService.pending == set()
+
+
+@pytest.mark.asyncio
+async def test_dependency_is_pending_before_setup_task_runs(mocker):
+    mocker.patch.object(HealthService, "pending", set())
+    setup = mocker.Mock()
+
+    task = HealthService.start_setup("postgres", setup)
+
+    assert HealthService.pending == {"postgres"}
+    setup.assert_not_called()
+    await task
+    assert HealthService.pending == set()
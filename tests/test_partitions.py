@@ -0,0 +1,57 @@
+from datetime import date
+
+import pytest
+
+from services.partition_service import PartitionService, add_months
+
+
+@pytest.fixture
+def partitioned_db(mocker):
+    mocker.patch.object(PartitionService, 'is_partitioned', return_value=True)
+    return mocker.MagicMock()
+
+
+def executed_sql(db) -> list:
+    return [str(call.args[0]) for call in db.execute.call_args_list]
+
+
+def test_add_months_crosses_year():
+    assert add_months(date(2024, 11, 1), 3) == date(2025, 2, 1)
+    assert add_months(date(2024, 1, 1), -1) == date(2023, 12, 1)
+
+
+def test_ensure_partitions_creates_missing_months(mocker, partitioned_db):
+    mocker.patch.object(PartitionService, 'existing_partitions', return_value=[date(2024, 12, 1)])
+
+    created = PartitionService.ensure_partitions(partitioned_db, months_ahead=2, today=date(2024, 11, 20))
+
+    assert created == ["transactions_2024_11", "transactions_2025_01"]
+    assert executed_sql(partitioned_db)[1] == (
+        "CREATE TABLE IF NOT EXISTS transactions_2025_01 PARTITION OF transactions "
+        "FOR VALUES FROM ('2025-01-01') TO ('2025-02-01')"
+    )
+
+
+def test_drop_expired_partitions_keeps_retention(mocker, partitioned_db):
+    months = [date(2024, 1, 1), date(2024, 2, 1), date(2024, 3, 1)]
+    mocker.patch.object(PartitionService, 'existing_partitions', return_value=months)
+
+    dropped = PartitionService.drop_expired_partitions(partitioned_db, retention_months=12, today=date(2025, 2, 15))
+
+    assert dropped == ["transactions_2024_01"]
+    assert executed_sql(partitioned_db) == [
+        "ALTER TABLE transactions DETACH PARTITION transactions_2024_01", "DROP TABLE transactions_2024_01"
+    ]
+
+
+def test_retention_is_off_by_default(partitioned_db):
+    assert PartitionService.drop_expired_partitions(partitioned_db, retention_months=0) == []
+    partitioned_db.execute.assert_not_called()
+
+
+def test_not_partitioned_table_is_left_alone(mocker):
+    db = mocker.MagicMock()
+    db.get_bind.return_value.dialect.name = "sqlite"
+
+    assert PartitionService.ensure_partitions(db) == []
+    db.execute.assert_not_called()
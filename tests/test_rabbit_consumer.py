@@ -0,0 +1,301 @@
+import pytest
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+from pika import BasicProperties, exceptions
+from sqlalchemy.exc import OperationalError
+
+from errors.withdraw_error import WithdrawError
+import rabbit_consumer
+from rabbit_consumer import SenderRetries, consume, process_batch, process_withdrawal, stop_workers, worker_queues
+
+
+@pytest.fixture(autouse=True)
+def no_random_failure():
+    with patch('rabbit_consumer.random.random', return_value=1):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def retry_config(mocker):
+    mocker.patch.multiple('rabbit_consumer', QUEUE_NAME="withdrawals", MAX_ATTEMPTS=3, RETRY_DELAYS_MS=[1000, 2000])
+
+
+@pytest.fixture(autouse=True)
+def sender_retries(mocker):
+    return mocker.patch.object(rabbit_consumer, "sender_retries", SenderRetries())
+
+
+@pytest.fixture
+def mock_channel(mocker):
+    return mocker.MagicMock()
+
+
+def delivery(tag: int):
+    return MagicMock(delivery_tag=tag)
+
+
+def published(channel) -> list:
+    # retry id is random, tests which follow messages through retry queues use retried()
+    return [
+        (call.kwargs["exchange"], {key: value for key, value in call.kwargs["properties"].headers.items() if key != "x-retry-id"})
+        for call in channel.basic_publish.call_args_list
+    ]
+
+
+def retried(channel, index: int):
+    """(properties, body) of published retry copy, as it comes back from retry queue."""
+    call = channel.basic_publish.call_args_list[index]
+    return call.kwargs["properties"], call.kwargs["body"]
+
+
+def withdrawn(withdraw_money) -> list:
+    return [(call.args[1].sender_id, call.args[1].amount) for call in withdraw_money.call_args_list]
+
+
+def test_process_withdrawal_success(mock_db_session, mock_channel):
+    with patch('rabbit_consumer.TransactionService.withdraw_money') as withdraw_money:
+        process_withdrawal(mock_db_session, mock_channel, delivery(1), None, '{"sender_id": 1, "amount": 10.0}')
+
+    assert withdraw_money.call_args.args[1].amount == Decimal('10.0')
+    mock_db_session.commit.assert_called_once()
+    mock_channel.basic_ack.assert_called_once_with(delivery_tag=1)
+
+
+def test_process_withdrawal_invalid_json_is_acked(mock_db_session, mock_channel):
+    process_withdrawal(mock_db_session, mock_channel, delivery(1), None, 'not json')
+
+    mock_db_session.commit.assert_not_called()
+    mock_channel.basic_ack.assert_called_once_with(delivery_tag=1)
+
+
+def test_process_withdrawal_failure_is_retried(mock_db_session, mock_channel):
+    with patch('rabbit_consumer.TransactionService.withdraw_money', side_effect=Exception("DB is down")):
+        process_withdrawal(mock_db_session, mock_channel, delivery(1), None, '{"sender_id": 1, "amount": 10.0}')
+
+    assert published(mock_channel) == [("withdrawals.retry.1000ms", {"x-retry-count": 1})]
+    # message is acked only after its retry copy is published
+    mock_channel.basic_ack.assert_called_once_with(delivery_tag=1, multiple=False)
+    mock_channel.basic_nack.assert_not_called()
+
+
+def test_process_withdrawal_backoff_grows(mock_db_session, mock_channel):
+    properties = BasicProperties(headers={"x-retry-count": 1})
+    with patch('rabbit_consumer.TransactionService.withdraw_money', side_effect=Exception("DB is down")):
+        process_withdrawal(mock_db_session, mock_channel, delivery(1), properties, '{"sender_id": 1, "amount": 10.0}')
+
+    assert published(mock_channel) == [("withdrawals.retry.2000ms", {"x-retry-count": 2})]
+
+
+def test_process_withdrawal_out_of_attempts_is_dead_lettered(mock_db_session, mock_channel):
+    properties = BasicProperties(headers={"x-retry-count": 2})
+    with patch('rabbit_consumer.TransactionService.withdraw_money', side_effect=Exception("DB is down")):
+        process_withdrawal(mock_db_session, mock_channel, delivery(1), properties, '{"sender_id": 1, "amount": 10.0}')
+
+    assert published(mock_channel) == [("", {"x-retry-count": 3})]
+    assert mock_channel.basic_publish.call_args.kwargs["routing_key"] == "withdrawals.dead"
+    mock_channel.basic_ack.assert_called_once_with(delivery_tag=1, multiple=False)
+
+
+def test_process_withdrawal_is_requeued_when_retry_fails(mock_db_session, mock_channel):
+    mock_channel.basic_publish.side_effect = exceptions.UnroutableError([])
+    with patch('rabbit_consumer.TransactionService.withdraw_money', side_effect=Exception("DB is down")):
+        process_withdrawal(mock_db_session, mock_channel, delivery(1), None, '{"sender_id": 1, "amount": 10.0}')
+
+    mock_channel.basic_nack.assert_called_once_with(delivery_tag=1)
+    mock_channel.basic_ack.assert_not_called()
+
+
+def test_process_batch_commits_once_and_multi_acks(mock_db_session, mock_channel):
+    batch = [
+        (delivery(1), None, '{"sender_id": 1, "amount": 10.0}'),
+        (delivery(2), None, '{"sender_id": 2, "amount": 10.0}'),
+        (delivery(3), None, '{"sender_id": 3, "amount": 10.0}'),
+        (delivery(4), None, 'not json'),
+    ]
+    side_effects = [None, Exception("DB is down"), WithdrawError("Insufficient balance")]
+    with patch('rabbit_consumer.TransactionService.withdraw_money', side_effect=side_effects):
+        process_batch(mock_db_session, mock_channel, batch)
+
+    assert mock_db_session.begin_nested.call_count == 4
+    mock_db_session.commit.assert_called_once()
+    assert published(mock_channel) == [("withdrawals.retry.1000ms", {"x-retry-count": 1})]
+    mock_channel.basic_nack.assert_not_called()
+    mock_channel.basic_ack.assert_called_once_with(delivery_tag=4, multiple=True)
+
+
+def test_process_batch_commit_failure_nacks_whole_batch(mock_db_session, mock_channel):
+    mock_db_session.commit.side_effect = Exception("DB is down")
+    batch = [(delivery(1), None, '{"sender_id": 1, "amount": 10.0}'), (delivery(2), None, '{"sender_id": 2, "amount": 10.0}')]
+    with patch('rabbit_consumer.TransactionService.withdraw_money'):
+        process_batch(mock_db_session, mock_channel, batch)
+
+    mock_db_session.rollback.assert_called_once()
+    assert mock_channel.basic_publish.call_count == 2
+    mock_channel.basic_ack.assert_called_once_with(delivery_tag=2, multiple=True)
+
+
+def test_process_batch_keeps_failed_sender_order(mock_db_session, mock_channel):
+    batch = [
+        (delivery(1), None, '{"sender_id": 1, "amount": 10.0}'),
+        (delivery(2), None, '{"sender_id": 2, "amount": 10.0}'),
+        (delivery(3), None, '{"sender_id": 1, "amount": 20.0}'),
+    ]
+    with patch('rabbit_consumer.TransactionService.withdraw_money', side_effect=[Exception("DB is down"), None]) as withdraw_money:
+        process_batch(mock_db_session, mock_channel, batch)
+
+    # second withdrawal of sender 1 must not overtake the failed one, it follows it to the same retry queue
+    assert withdraw_money.call_count == 2
+    assert published(mock_channel) == [
+        ("withdrawals.retry.1000ms", {"x-retry-count": 1}), ("withdrawals.retry.1000ms", {"x-retry-count": 0})
+    ]
+    mock_channel.basic_ack.assert_called_once_with(delivery_tag=3, multiple=True)
+
+
+def test_later_withdrawal_waits_for_pending_retry(mock_db_session, mock_channel, sender_retries):
+    with patch('rabbit_consumer.TransactionService.withdraw_money', side_effect=[Exception("DB is down"), None, None, None]) as withdraw_money:
+        process_withdrawal(mock_db_session, mock_channel, delivery(1), None, '{"sender_id": 1, "amount": 10.0}')
+        # arrives while the failed one waits in retry queue, it is parked behind it with its attempts kept
+        process_withdrawal(mock_db_session, mock_channel, delivery(2), None, '{"sender_id": 1, "amount": 20.0}')
+        process_withdrawal(mock_db_session, mock_channel, delivery(3), None, '{"sender_id": 2, "amount": 30.0}')
+        assert published(mock_channel) == [
+            ("withdrawals.retry.1000ms", {"x-retry-count": 1}), ("withdrawals.retry.1000ms", {"x-retry-count": 0})
+        ]
+        process_withdrawal(mock_db_session, mock_channel, delivery(4), *retried(mock_channel, 0))
+        process_withdrawal(mock_db_session, mock_channel, delivery(5), *retried(mock_channel, 1))
+
+    assert withdrawn(withdraw_money) == [(1, Decimal("10.0")), (2, Decimal("30.0")), (1, Decimal("10.0")), (1, Decimal("20.0"))]
+    assert sender_retries.waiting == {}
+
+
+def test_parked_withdrawal_follows_retry_to_longer_delay(mock_db_session, mock_channel):
+    with patch('rabbit_consumer.TransactionService.withdraw_money', side_effect=Exception("DB is down")) as withdraw_money:
+        process_withdrawal(mock_db_session, mock_channel, delivery(1), None, '{"sender_id": 1, "amount": 10.0}')
+        process_withdrawal(mock_db_session, mock_channel, delivery(2), None, '{"sender_id": 1, "amount": 20.0}')
+        # failed one comes back first and fails again, parked one comes back while it waits in the next queue
+        process_withdrawal(mock_db_session, mock_channel, delivery(3), *retried(mock_channel, 0))
+        process_withdrawal(mock_db_session, mock_channel, delivery(4), *retried(mock_channel, 1))
+
+    assert withdraw_money.call_count == 2
+    assert published(mock_channel)[2:] == [
+        ("withdrawals.retry.2000ms", {"x-retry-count": 2}), ("withdrawals.retry.2000ms", {"x-retry-count": 0})
+    ]
+    assert retried(mock_channel, 3)[0].headers["x-retry-id"] == retried(mock_channel, 1)[0].headers["x-retry-id"]
+
+
+def test_dead_lettered_withdrawal_releases_its_sender(mock_db_session, mock_channel, sender_retries):
+    sender_retries.retried(1, "a", 2000)
+    sender_retries.retried(1, "b", 2000)
+    with patch('rabbit_consumer.TransactionService.withdraw_money', side_effect=[Exception("DB is down"), None]) as withdraw_money:
+        process_withdrawal(mock_db_session, mock_channel, delivery(1), BasicProperties(headers={"x-retry-count": 2, "x-retry-id": "a"}),
+                           '{"sender_id": 1, "amount": 10.0}')
+        process_withdrawal(mock_db_session, mock_channel, delivery(2), BasicProperties(headers={"x-retry-count": 0, "x-retry-id": "b"}),
+                           '{"sender_id": 1, "amount": 20.0}')
+
+    assert published(mock_channel) == [("", {"x-retry-count": 3})]
+    assert withdrawn(withdraw_money)[-1] == (1, Decimal("20.0"))
+    assert sender_retries.waiting == {}
+
+
+def test_process_batch_parks_sender_waiting_from_previous_batch(mock_db_session, mock_channel, sender_retries):
+    with patch('rabbit_consumer.TransactionService.withdraw_money', side_effect=[Exception("DB is down"), None, None, None, None]) as withdraw_money:
+        process_batch(mock_db_session, mock_channel, [(delivery(1), None, '{"sender_id": 1, "amount": 10.0}')])
+        process_batch(mock_db_session, mock_channel, [
+            (delivery(2), None, '{"sender_id": 1, "amount": 20.0}'),
+            (delivery(3), None, '{"sender_id": 2, "amount": 30.0}'),
+        ])
+        assert published(mock_channel)[1:] == [("withdrawals.retry.1000ms", {"x-retry-count": 0})]
+        # both come back in one batch, the parked one is applied right after the one it waited for
+        process_batch(mock_db_session, mock_channel, [
+            (delivery(4), *retried(mock_channel, 0)), (delivery(5), *retried(mock_channel, 1))
+        ])
+
+    assert withdrawn(withdraw_money) == [(1, Decimal("10.0")), (2, Decimal("30.0")), (1, Decimal("10.0")), (1, Decimal("20.0"))]
+    assert mock_channel.basic_publish.call_count == 2
+    assert sender_retries.waiting == {}
+
+
+def test_worker_queues_split_partitions():
+    queues = ["withdrawals.0", "withdrawals.1", "withdrawals.2"]
+
+    assert [worker_queues(queues, worker, 2) for worker in range(2)] == [["withdrawals.0", "withdrawals.2"], ["withdrawals.1"]]
+    # more workers than partitions, extra workers consume the same partitions
+    assert [worker_queues(queues[:1], worker, 2) for worker in range(2)] == [["withdrawals.0"], ["withdrawals.0"]]
+
+
+def test_consume_drains_batch_on_shutdown(mocker):
+    rabbitmq = mocker.MagicMock()
+    channel = rabbitmq.connection.channel.return_value
+    process_batch_mock = mocker.patch('rabbit_consumer.process_batch')
+    mocker.patch('rabbit_consumer.SessionLocal')
+    mocker.patch.object(rabbit_consumer, 'shutdown', rabbit_consumer.threading.Event())
+
+    def deliver_and_stop(time_limit):
+        on_message = channel.basic_consume.call_args.kwargs["on_message_callback"]
+        on_message(channel, delivery(1), None, '{"sender_id": 1, "amount": 10.0}')
+        rabbit_consumer.shutdown.set()
+
+    rabbitmq.connection.process_data_events.side_effect = deliver_and_stop
+    consume(rabbitmq, ["withdrawals"], batch_size=10, timeout_ms=60000)
+
+    # batch is not full and its timeout did not pass, still it is applied before consumer stops
+    channel.basic_cancel.assert_called_once_with(channel.basic_consume.return_value)
+    assert process_batch_mock.call_args.args[1:] == (channel, [(mocker.ANY, None, '{"sender_id": 1, "amount": 10.0}')])
+
+
+def test_stop_workers_shares_one_deadline(mocker):
+    now = [100.0]
+    mocker.patch('rabbit_consumer.time.monotonic', side_effect=lambda: now[0])
+
+    def join(timeout=None):
+        # stuck worker takes its whole join timeout
+        now[0] += timeout or 0
+
+    processes = [mocker.MagicMock(is_alive=mocker.MagicMock(return_value=True), join=mocker.MagicMock(side_effect=join)) for _ in range(3)]
+
+    stop_workers(processes, timeout=30)
+
+    assert [process.join.call_args_list[0].args[0] for process in processes] == [30, 0, 0]
+    for process in processes:
+        process.terminate.assert_called_once()
+        process.kill.assert_called_once()
+
+
+def withdrawals_of(user_id: int, count: int) -> list:
+    return [(delivery(tag), BasicProperties(), f'{{"sender_id": {user_id}, "amount": 1.0}}') for tag in range(1, count + 1)]
+
+
+@pytest.mark.usefixtures("create_user")
+def test_batch_is_appended_to_cache_only_after_final_commit(create_user, app_session_factory, appended_transactions):
+    user = create_user("Alice", Decimal("10"))
+    db = app_session_factory()
+    commit = db.commit
+    events = []
+
+    def final_commit():
+        events.append(("commit", list(appended_transactions)))
+        commit()
+
+    db.commit = final_commit
+    channel = MagicMock()
+
+    process_batch(db, channel, withdrawals_of(user.id, 3))
+
+    # savepoints of the messages were released before, nothing reached the cache until the batch committed
+    assert events == [("commit", [])]
+    assert len(appended_transactions) == 3
+    channel.basic_ack.assert_called_once_with(delivery_tag=3, multiple=True)
+
+
+@pytest.mark.usefixtures("create_user")
+def test_failed_batch_commit_appends_nothing(create_user, app_session_factory, appended_transactions):
+    user = create_user("Alice", Decimal("10"))
+    db = app_session_factory()
+    db.commit = MagicMock(side_effect=OperationalError("COMMIT", {}, MagicMock(pgcode="08006")))
+    channel = MagicMock()
+
+    process_batch(db, channel, withdrawals_of(user.id, 3))
+
+    assert appended_transactions == []
+    # nothing was applied, every message is retried
+    assert len(published(channel)) == 3
@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+from aio_pika import exceptions as aio_exceptions
+
+from services.rabbit_service import AsyncRabbitMQPublisher, declare_retry_queues, declare_withdrawal_queues, parse_partitions, rabbitmq_config, withdrawal_route
+
+
+def test_declare_single_queue(mocker):
+    channel = mocker.MagicMock()
+
+    assert declare_withdrawal_queues(channel, "withdrawals", partitions=1) == ["withdrawals"]
+    channel.exchange_declare.assert_any_call(exchange="withdrawals", exchange_type="direct", durable=True)
+    channel.queue_declare.assert_any_call(queue="withdrawals.dead", durable=True)
+    assert withdrawal_route("withdrawals", 7, partitions=1) == ("withdrawals", "")
+
+
+def test_declare_partitioned_queues(mocker):
+    channel = mocker.MagicMock()
+
+    assert declare_withdrawal_queues(channel, "withdrawals", partitions=3) == ["withdrawals.0", "withdrawals.1", "withdrawals.2"]
+    channel.exchange_declare.assert_any_call(
+        exchange="withdrawals.partitioned", exchange_type="x-consistent-hash", durable=True
+    )
+    channel.queue_declare.assert_any_call(queue="withdrawals.2", durable=True, arguments={"x-single-active-consumer": True})
+    channel.queue_bind.assert_any_call(exchange="withdrawals.partitioned", queue="withdrawals.2", routing_key="1")
+    assert withdrawal_route("withdrawals", 7, partitions=3) == ("withdrawals.partitioned", "7")
+
+
+def test_parse_partitions():
+    assert parse_partitions(None, partitions=4) == [0, 1, 2, 3]
+    assert parse_partitions("0, 2-3", partitions=4) == [0, 2, 3]
+    with pytest.raises(ValueError):
+        parse_partitions("4", partitions=4)
+
+
+def test_declare_retry_queues(mocker):
+    channel = mocker.MagicMock()
+
+    declare_retry_queues(channel, "withdrawals.partitioned", delays=[1000, 2000])
+
+    # expired messages go back to withdrawal exchange, consistent hash routes them to the same partition
+    channel.queue_declare.assert_any_call(
+        queue="withdrawals.partitioned.retry.2000ms", durable=True,
+        arguments={"x-message-ttl": 2000, "x-dead-letter-exchange": "withdrawals.partitioned"}
+    )
+    channel.queue_bind.assert_any_call(exchange="withdrawals.partitioned.retry.1000ms", queue="withdrawals.partitioned.retry.1000ms")
+
+
+@pytest.fixture
+def mock_aio_connect(mocker):
+    connection = mocker.MagicMock(is_closed=False)
+    connection.close = mocker.AsyncMock()
+    channel = mocker.MagicMock(is_closed=False)
+    connection.channel = mocker.AsyncMock(return_value=channel)
+    exchange = channel.get_exchange = mocker.AsyncMock()
+    exchange.return_value.publish = mocker.AsyncMock()
+    return mocker.patch('services.rabbit_service.aio_pika.connect', mocker.AsyncMock(return_value=connection))
+
+
+@pytest.mark.asyncio
+async def test_async_publisher_shares_channel(mock_aio_connect):
+    publisher = AsyncRabbitMQPublisher(rabbitmq_config)
+
+    await asyncio.gather(*(publisher.publish(exchange="withdrawals", routing_key="", body=b"{}") for _ in range(10)))
+
+    mock_aio_connect.assert_awaited_once()
+    connection = mock_aio_connect.return_value
+    connection.channel.assert_awaited_once_with(publisher_confirms=True, on_return_raises=True)
+    assert connection.channel.return_value.get_exchange.return_value.publish.await_count == 10
+
+
+@pytest.mark.asyncio
+async def test_async_publisher_reconnects_on_lost_connection(mock_aio_connect):
+    publisher = AsyncRabbitMQPublisher(rabbitmq_config)
+    exchange = mock_aio_connect.return_value.channel.return_value.get_exchange.return_value
+    exchange.publish.side_effect = [aio_exceptions.ChannelInvalidStateError("closed"), None]
+
+    await publisher.publish(exchange="withdrawals", routing_key="", body=b"{}")
+
+    assert mock_aio_connect.await_count == 2
+    mock_aio_connect.return_value.close.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_async_publisher_gives_up_after_retries(mock_aio_connect):
+    publisher = AsyncRabbitMQPublisher(rabbitmq_config)
+    exchange = mock_aio_connect.return_value.channel.return_value.get_exchange.return_value
+    exchange.publish.side_effect = aio_exceptions.ChannelInvalidStateError("closed")
+
+    with pytest.raises(aio_exceptions.AMQPConnectionError):
+        await publisher.publish(exchange="withdrawals", routing_key="", body=b"{}")
+
+
+@pytest.mark.asyncio
+async def test_async_publisher_check_uses_channel_of_its_own(mock_aio_connect, mocker):
+    publisher = AsyncRabbitMQPublisher(rabbitmq_config)
+    await publisher.publish(exchange="withdrawals", routing_key="", body=b"{}")
+    connection = mock_aio_connect.return_value
+    publish_channel = publisher._channel
+    check_channel = mocker.MagicMock(is_closed=False, get_exchange=mocker.AsyncMock(), close=mocker.AsyncMock())
+    connection.channel.return_value = check_channel
+
+    await publisher.check("withdrawals")
+
+    connection.channel.assert_awaited_with(publisher_confirms=False)
+    check_channel.get_exchange.assert_awaited_once_with("withdrawals", ensure=True)
+    check_channel.close.assert_awaited_once()
+    # publish channel and shared connection stay open
+    assert publisher._channel is publish_channel
+    mock_aio_connect.assert_awaited_once()
+    connection.close.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_async_publisher_check_opens_temporary_connection(mock_aio_connect, mocker):
+    publisher = AsyncRabbitMQPublisher(rabbitmq_config)
+    connection = mock_aio_connect.return_value
+    connection.channel.return_value.close = mocker.AsyncMock()
+
+    await publisher.check("withdrawals")
+
+    connection.channel.return_value.get_exchange.assert_awaited_once_with("withdrawals", ensure=True)
+    connection.close.assert_awaited_once()
+    assert publisher._connection is None
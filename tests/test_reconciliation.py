@@ -0,0 +1,77 @@
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql
+
+from models import LedgerTotal, MoneyTransaction, User
+from models.money_transaction import TransactionType
+from services.reconciliation_service import ReconciliationService
+from services.user_service import UserService
+
+Row = namedtuple("Row", "id sender_id receiver_id amount created_at")
+
+
+def test_add_totals_folds_debits_and_credits(mocker):
+    db = mocker.MagicMock()
+    rows = [
+        Row(1, 1, 2, Decimal("5.00"), None),
+        Row(2, 1, None, Decimal("3.00"), None),
+        Row(3, 2, 1, Decimal("1.00"), None),
+    ]
+
+    user_ids = ReconciliationService.add_totals(db, rows)
+
+    assert user_ids == [1, 2]
+    statement = db.execute.call_args.args[0].compile(dialect=postgresql.dialect())
+    assert "ON CONFLICT (user_id) DO UPDATE" in str(statement)
+    assert statement.params["debits_m0"] == Decimal("8.00")
+    assert statement.params["credits_m0"] == Decimal("1.00")
+    assert statement.params["transaction_count_m0"] == 3
+    assert statement.params["debits_m1"] == Decimal("1.00")
+    assert statement.params["credits_m1"] == Decimal("5.00")
+    assert statement.params["transaction_count_m1"] == 2
+
+
+def transfer(db, sender_id, receiver_id, amount):
+    UserService.debit(db, sender_id, amount)
+    UserService.credit(db, receiver_id, amount)
+    db.add(MoneyTransaction(type=TransactionType.TRANSFER, sender_id=sender_id, receiver_id=receiver_id, amount=amount))
+    db.commit()
+
+
+@pytest.mark.usefixtures("session")
+@pytest.mark.usefixtures("create_user")
+def test_reconcile_continues_from_checkpoint(session, create_user):
+    alice = create_user("Alice", Decimal("100"))
+    bob = create_user("Bob", Decimal("50"))
+    transfer(session, alice.id, bob.id, Decimal("10"))
+    transfer(session, bob.id, alice.id, Decimal("2.5"))
+
+    result = ReconciliationService.reconcile(session, chunk_size=1, lag=timedelta(0))
+
+    assert result["reconciled"] == 2
+    assert result["mismatches"] == []
+    totals = session.get(LedgerTotal, alice.id)
+    assert (totals.debits, totals.credits, totals.transaction_count) == (Decimal("10"), Decimal("2.5"), 2)
+
+    transfer(session, alice.id, bob.id, Decimal("1"))
+    result = ReconciliationService.reconcile(session, lag=timedelta(0))
+
+    assert result["reconciled"] == 1
+    assert result["mismatches"] == []
+    assert session.get(LedgerTotal, alice.id, populate_existing=True).transaction_count == 3
+
+
+@pytest.mark.usefixtures("session")
+@pytest.mark.usefixtures("create_user")
+def test_reconcile_reports_balance_not_matching_ledger(session, create_user):
+    user = create_user("Carol", Decimal("20"))
+    session.execute(update(User).where(User.id == user.id).values(main_balance=User.main_balance + 1))
+    session.commit()
+
+    result = ReconciliationService.reconcile(session, lag=timedelta(0), full=True)
+
+    assert result["mismatches"] == [{"user_id": user.id, "balance": "21.00", "expected": "20.00"}]
@@ -0,0 +1,22 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from services.redis_service import RedisService
+
+
+@pytest.fixture
+def client():
+    client = MagicMock()
+    client.pipeline.return_value.__aenter__.return_value.execute = AsyncMock(return_value=[True])
+    return client
+
+
+@pytest.mark.asyncio
+async def test_zadd_many_writes_all_keys_in_one_pipeline(client):
+    await RedisService(client).zadd_many([("a", {"x": 1}, 10), ("b", {"y": 2}, 20)])
+
+    pipe = client.pipeline.return_value.__aenter__.return_value
+    assert [call.args for call in pipe.zadd.call_args_list] == [("a", {"x": 1}), ("b", {"y": 2})]
+    assert [call.args for call in pipe.expire.call_args_list] == [("a", 10), ("b", 20)]
+    pipe.execute.assert_awaited_once()
@@ -0,0 +1,61 @@
+import json
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import MoneyTransaction, TransactionType, User
+from pydantic_models.page import Page
+from pydantic_models.transaction import TransactionOut
+from pydantic_models.user import UserOut
+from services.codec import EncodedRow, JSON_CODEC, JsonCodec, OrjsonCodec, orjson
+from services.pagination import page_response
+from services.transaction_cache_service import TransactionCacheService
+
+
+@pytest.fixture
+def transaction():
+    return MoneyTransaction(
+        id=1, sender_id=1, receiver_id=None, amount=Decimal("10.50"),
+        type=TransactionType.WITHDRAWAL, created_at=datetime(2024, 6, 5, 19, 21, 4, 673558)
+    )
+
+
+@pytest.mark.parametrize("codec", [JsonCodec, OrjsonCodec])
+def test_codec_roundtrip(codec):
+    if codec is OrjsonCodec and orjson is None:
+        pytest.skip("orjson is not installed")
+    value = {"id": 1, "amount": "10.50", "items": [1, None, "a"]}
+
+    assert codec.loads(codec.dumps(value)) == value
+
+
+def test_row_encoder(transaction):
+    assert transaction.to_dict() == {
+        "id": 1, "type": TransactionType.WITHDRAWAL, "sender_id": 1, "receiver_id": None,
+        "amount": "10.50", "created_at": "2024-06-05T19:21:04.673558",
+    }
+    assert MoneyTransaction.row_encoder(("id",))(transaction) == {"id": 1}
+
+
+def test_page_response_matches_response_model(transaction):
+    cached = TransactionCacheService.decode(TransactionCacheService.encode(transaction))
+    page = {"items": [transaction, cached], "next_cursor": "abc"}
+
+    response = page_response(page, TransactionOut)
+
+    assert isinstance(cached, EncodedRow)
+    expected = Page[TransactionOut](items=[TransactionOut.model_validate(transaction, from_attributes=True)] * 2, next_cursor="abc")
+    assert json.loads(response.body) == json.loads(expected.model_dump_json())
+
+
+def test_page_response_uses_response_model_fields():
+    user = User(id=1, name="John Doe", created_at=datetime(2024, 1, 1))
+    # balance is read only, it is set like loaded from DB
+    set_committed_value(user, "balance", Decimal("100.00"))
+
+    response = page_response({"items": [user], "next_cursor": None}, UserOut)
+
+    assert json.loads(response.body) == {"items": [{"id": 1, "name": "John Doe", "balance": "100.00"}], "next_cursor": None}
+    assert JSON_CODEC.loads(response.body)["items"][0] == UserOut.model_validate(user, from_attributes=True).model_dump(mode="json")
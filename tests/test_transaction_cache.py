@@ -0,0 +1,210 @@
+import pytest
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock
+
+from models import MoneyTransaction, TransactionType
+from pydantic_models.page import PageParams, decode_cursor
+from services.redis_service import RedisService
+from services.transaction_cache_service import TransactionCacheService, HISTORY_TTL, LOADED_MARKER, OVERSIZED_SCORE, RECENT_TTL
+
+
+@pytest.fixture
+def mock_redis_service():
+    service = MagicMock(RedisService)
+    # every segment is missing, replies are (marker score, members) per segment
+    service.pipeline.return_value.execute = AsyncMock(return_value=[None, [], None, []])
+    service.zadd_many = AsyncMock(return_value=None)
+    service.zrangebyscore = AsyncMock(return_value=[])
+    return service
+
+
+def make_transaction(transaction_id: int, created_at: datetime) -> MoneyTransaction:
+    return MoneyTransaction(
+        id=transaction_id, sender_id=1, receiver_id=2, amount=Decimal('10.00'),
+        type=TransactionType.TRANSFER, created_at=created_at
+    )
+
+
+def test_encode_decode_roundtrip():
+    transaction = make_transaction(7, datetime(2024, 6, 5, 19, 21, 4, 673558))
+
+    member = TransactionCacheService.encode(transaction)
+
+    assert member.startswith(b"000000000007:")
+    assert TransactionCacheService.decode(member) == transaction.to_dict()
+
+
+def test_score_keeps_microseconds():
+    created_at = datetime(2024, 6, 5, 19, 21, 4, 673558)
+
+    assert TransactionCacheService.score(created_at + timedelta(microseconds=1)) - TransactionCacheService.score(created_at) == 1
+
+
+@pytest.mark.asyncio
+async def test_get_view_miss_loads_both_segments(mock_redis_service):
+    boundary = TransactionCacheService.recent_boundary()
+    old = make_transaction(1, boundary - timedelta(days=30))
+    new = make_transaction(2, boundary + timedelta(hours=1))
+    loader = AsyncMock(side_effect=lambda since, until, limit: [old] if until else [new])
+
+    page = await TransactionCacheService.get_view(mock_redis_service, "transactions:v2:user:1", loader, AsyncMock(), PageParams())
+
+    assert [row["id"] for row in page["items"]] == [1, 2]
+    assert page["next_cursor"] is None
+    loader.assert_any_call(None, boundary, 1001)
+    loader.assert_any_call(boundary, None, 1001)
+    (history_key, history_mapping, history_ex), (recent_key, recent_mapping, recent_ex) = mock_redis_service.zadd_many.call_args.args[0]
+    assert history_key == f"transactions:v2:user:1:history:{boundary:%Y%m%d}"
+    assert history_ex == HISTORY_TTL
+    assert list(history_mapping) == [TransactionCacheService.encode(old), LOADED_MARKER]
+    assert recent_key == "transactions:v2:user:1:recent"
+    assert recent_ex == RECENT_TTL
+
+
+@pytest.mark.asyncio
+async def test_get_view_hit_reads_ranges(mock_redis_service):
+    boundary = TransactionCacheService.recent_boundary()
+    member = TransactionCacheService.encode(make_transaction(3, boundary + timedelta(hours=1)))
+    pipe = mock_redis_service.pipeline.return_value
+    pipe.execute.return_value = [0, [], 0, [(member, TransactionCacheService.score(boundary + timedelta(hours=1)))]]
+    loader = AsyncMock()
+
+    page = await TransactionCacheService.get_view(mock_redis_service, "transactions:v2:user:1", loader, AsyncMock(), PageParams())
+
+    assert [row["id"] for row in page["items"]] == [3]
+    loader.assert_not_called()
+    # both segments are read in one round trip
+    pipe.execute.assert_awaited_once()
+    mock_redis_service.zrangebyscore.assert_not_called()
+    mock_redis_service.zadd_many.assert_not_called()
+    # recent segment skips rows that already moved to history
+    assert pipe.zrangebyscore.call_args_list[1].args[1] == TransactionCacheService.score(boundary)
+
+
+@pytest.mark.asyncio
+async def test_get_view_page_skips_cursor_and_history(mock_redis_service):
+    created_at = TransactionCacheService.recent_boundary() + timedelta(hours=1)
+    score = TransactionCacheService.score(created_at)
+    members = [(TransactionCacheService.encode(make_transaction(i, created_at)), score) for i in (4, 5, 6, 7)]
+    pipe = mock_redis_service.pipeline.return_value
+    pipe.execute.return_value = [0, members]
+
+    page = await TransactionCacheService.get_view(
+        mock_redis_service, "transactions:v2:user:1", AsyncMock(), AsyncMock(), PageParams(limit=2, after=(created_at, 4))
+    )
+
+    assert [row["id"] for row in page["items"]] == [5, 6]
+    assert decode_cursor(page["next_cursor"]) == (created_at, 6)
+    # cursor is newer than recent boundary, history segment is not touched
+    pipe.zrangebyscore.assert_called_once()
+    assert pipe.zrangebyscore.call_args.args[0] == "transactions:v2:user:1:recent"
+
+
+@pytest.mark.asyncio
+async def test_get_view_does_not_cache_oversized_segment(mock_redis_service, mocker):
+    mocker.patch("services.transaction_cache_service.SEGMENT_MAX_ROWS", 1)
+    boundary = TransactionCacheService.recent_boundary()
+    rows = [make_transaction(i, boundary - timedelta(days=i)) for i in (1, 2)]
+    loader = AsyncMock(return_value=rows)
+    fallback = AsyncMock(return_value={"items": [], "next_cursor": None})
+    page = PageParams(limit=10)
+
+    assert await TransactionCacheService.get_view(mock_redis_service, "transactions:v2:user:1", loader, fallback, page) == fallback.return_value
+
+    loader.assert_awaited_once_with(None, boundary, 2)
+    fallback.assert_awaited_once_with(page)
+    # only the marker is written, rows of the segment are not
+    assert mock_redis_service.zadd_many.call_args.args[0] == [
+        (f"transactions:v2:user:1:history:{boundary:%Y%m%d}", {LOADED_MARKER: OVERSIZED_SCORE}, HISTORY_TTL)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_get_view_reads_oversized_view_from_db(mock_redis_service):
+    mock_redis_service.pipeline.return_value.execute.return_value = [-1.0, [], 0, []]
+    loader = AsyncMock()
+    fallback = AsyncMock(return_value={"items": [], "next_cursor": None})
+
+    await TransactionCacheService.get_view(mock_redis_service, "transactions:v2:user:1", loader, fallback, PageParams())
+
+    loader.assert_not_called()
+    fallback.assert_awaited_once()
+    mock_redis_service.zadd_many.assert_not_called()
+
+
+def test_views_of_transfer():
+    transaction = make_transaction(1, datetime.utcnow())
+
+    assert TransactionCacheService.views(transaction) == [
+        "transactions:v2:user:1", "transactions:v2:user:1:transfer",
+        "transactions:v2:user:2", "transactions:v2:user:2:transfer",
+        "transactions:v2:pair:1:2",
+    ]
+
+
+def test_encode_normalizes_amount_of_new_transaction():
+    transaction = make_transaction(1, datetime(2024, 6, 5))
+    stored = make_transaction(1, datetime(2024, 6, 5))
+    transaction.amount = Decimal("10")
+
+    assert TransactionCacheService.encode(transaction) == TransactionCacheService.encode(stored)
+
+
+def test_append_adds_to_recent_segments():
+    client = MagicMock()
+    script = client.register_script.return_value
+    pipe = client.pipeline.return_value.__enter__.return_value
+    new = make_transaction(2, datetime.utcnow())
+    old = make_transaction(1, TransactionCacheService.recent_boundary() - timedelta(days=1))
+
+    TransactionCacheService.append(client, [old, new])
+
+    script.assert_called_once_with(
+        keys=[f"{view}:recent" for view in TransactionCacheService.views(new)],
+        args=[RECENT_TTL, TransactionCacheService.score(new.created_at), TransactionCacheService.encode(new)],
+        client=pipe
+    )
+    pipe.execute.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_get_view_reads_next_range_when_rows_are_skipped(mock_redis_service):
+    created_at = TransactionCacheService.recent_boundary() + timedelta(hours=1)
+    score = TransactionCacheService.score(created_at)
+    members = [(TransactionCacheService.encode(make_transaction(i, created_at)), score) for i in (1, 2, 3, 4, 5)]
+    mock_redis_service.pipeline.return_value.execute.return_value = [0, members[:3]]
+    mock_redis_service.zrangebyscore.return_value = members[3:]
+
+    page = await TransactionCacheService.get_view(
+        mock_redis_service, "transactions:v2:user:1", AsyncMock(), AsyncMock(), PageParams(limit=1, after=(created_at, 3))
+    )
+
+    assert [row["id"] for row in page["items"]] == [4]
+    assert page["next_cursor"]
+    assert mock_redis_service.zrangebyscore.call_args.kwargs["start"] == 3
+
+
+def add_transaction(db, sender_id: int, receiver_id: int) -> MoneyTransaction:
+    transaction = MoneyTransaction(sender_id=sender_id, receiver_id=receiver_id, amount=Decimal("1.00"), type=TransactionType.TRANSFER)
+    db.add(transaction)
+    db.flush()
+    return transaction
+
+
+@pytest.mark.usefixtures("create_user")
+def test_released_savepoint_is_not_appended_before_commit(create_user, app_session_factory, appended_transactions):
+    alice, bob = create_user("Alice", Decimal("10")), create_user("Bob", Decimal("10"))
+    db = app_session_factory()
+
+    with db.begin_nested():
+        add_transaction(db, alice.id, bob.id)
+    assert appended_transactions == []
+
+    db.rollback()
+    assert appended_transactions == []
+
+    with db.begin_nested():
+        transaction = add_transaction(db, alice.id, bob.id)
+    db.commit()
+    assert appended_transactions == [transaction.id]
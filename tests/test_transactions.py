@@ -1,15 +1,17 @@
 import pytest
+from datetime import datetime
 from decimal import Decimal
 from unittest.mock import AsyncMock, MagicMock, patch
+from sqlalchemy.exc import OperationalError
+
+from db import run_in_transaction
+from errors.transfer_error import TransferBatchError, TransferError
 from models import MoneyTransaction, TransactionType, User
-from pydantic_models.transaction import WithdrawCreate
+from pydantic_models.page import PageParams, decode_cursor
+from pydantic_models.transaction import TransactionCreate, TransferBatchMode, WithdrawCreate
 from services.transaction_service import TransactionService
 from services.redis_service import RedisService
-
-
-@pytest.fixture
-def mock_db_session(mocker):
-    return mocker.MagicMock()
+from services.transaction_cache_service import TransactionCacheService
 
 
 @pytest.fixture
@@ -27,102 +29,286 @@ def mock_user_service(mocker):
 
 @pytest.fixture
 def sender_user():
-    return User(id=1, balance=Decimal('1000.00'))
+    return User(id=1, main_balance=Decimal('1000.00'), shard_count=0)
 
 
 @pytest.fixture
 def receiver_user():
-    return User(id=2, balance=Decimal('500.00'))
+    return User(id=2, main_balance=Decimal('500.00'), shard_count=0)
 
 
-def test_transfer_money(mock_db_session, sender_user, receiver_user):
+@pytest.fixture
+def balances(mocker, sender_user, receiver_user):
+    """In memory users table behind UserService.debit/credit, records order in which rows are updated."""
+    users = {sender_user.id: sender_user, receiver_user.id: receiver_user}
+    updates = []
+
+    def debit(db, user_id, amount):
+        user = users.get(user_id)
+        if not user or user.main_balance < amount:
+            return None
+        updates.append(user_id)
+        user.main_balance -= amount
+        return user.main_balance
+
+    def credit(db, user_id, amount):
+        user = users.get(user_id)
+        if not user:
+            return None
+        updates.append(user_id)
+        user.main_balance += amount
+        return user.main_balance
+
+    mocker.patch('services.user_service.UserService.debit', side_effect=debit)
+    mocker.patch('services.user_service.UserService.credit', side_effect=credit)
+    mocker.patch('services.user_service.UserService.exists', side_effect=lambda db, user_id: user_id in users)
+    return updates
+
+
+def test_transfer_money(mock_db_session, sender_user, receiver_user, balances):
     transaction = TransactionService.transfer_money(
-        mock_db_session, sender_user, receiver_user, Decimal('100.00'), TransactionType.TRANSFER
+        mock_db_session, sender_user.id, receiver_user.id, Decimal('100.00'), TransactionType.TRANSFER
     )
 
-    assert sender_user.balance == Decimal('900.00')
-    assert receiver_user.balance == Decimal('600.00')
+    assert sender_user.main_balance == Decimal('900.00')
+    assert receiver_user.main_balance == Decimal('600.00')
     assert transaction.sender_id == sender_user.id
     assert transaction.receiver_id == receiver_user.id
     assert transaction.amount == Decimal('100.00')
     assert transaction.type == TransactionType.TRANSFER
     mock_db_session.add.assert_called_once_with(transaction)
+    # pair totals and daily stats are updated in the same transaction
+    statements = [str(call.args[0]) for call in mock_db_session.execute.call_args_list]
+    assert any("INSERT INTO transfer_pairs" in statement for statement in statements)
+    assert any("INSERT INTO user_daily_stats" in statement for statement in statements)
+
+
+def test_transfer_money_locks_lower_id_first(mock_db_session, sender_user, receiver_user, balances):
+    TransactionService.transfer_money(
+        mock_db_session, receiver_user.id, sender_user.id, Decimal('100.00'), TransactionType.TRANSFER
+    )
+
+    assert balances == [sender_user.id, receiver_user.id]
+    assert sender_user.main_balance == Decimal('1100.00')
+    assert receiver_user.main_balance == Decimal('400.00')
+
+
+def test_transfer_money_insufficient_balance(mock_db_session, sender_user, receiver_user, balances):
+    with pytest.raises(TransferError, match="Insufficient balance"):
+        TransactionService.transfer_money(
+            mock_db_session, sender_user.id, receiver_user.id, Decimal('2000.00'), TransactionType.TRANSFER
+        )
+
+    mock_db_session.add.assert_not_called()
+
+
+def test_transfer_money_receiver_not_found(mock_db_session, sender_user, balances):
+    with pytest.raises(TransferError, match="User not found"):
+        TransactionService.transfer_money(mock_db_session, sender_user.id, 3, Decimal('100.00'), TransactionType.TRANSFER)
+
+    mock_db_session.add.assert_not_called()
 
 
-def test_withdraw_money_success(mock_db_session, sender_user):
-    with patch('services.user_service.UserService.fetch', return_value=sender_user):
-        transaction = WithdrawCreate(sender_id=1, amount=Decimal('200.00'))
+def test_withdraw_money_success(mock_db_session, sender_user, balances):
+    transaction = WithdrawCreate(sender_id=1, amount=Decimal('200.00'))
 
-        db_transaction = TransactionService.withdraw_money(mock_db_session, transaction)
+    db_transaction = TransactionService.withdraw_money(mock_db_session, transaction)
 
-        assert sender_user.balance == Decimal('800.00')
-        assert db_transaction.sender_id == sender_user.id
-        assert db_transaction.amount == Decimal('200.00')
-        assert db_transaction.type == TransactionType.WITHDRAWAL
-        mock_db_session.add.assert_called_once_with(db_transaction)
+    assert sender_user.main_balance == Decimal('800.00')
+    assert db_transaction.sender_id == sender_user.id
+    assert db_transaction.amount == Decimal('200.00')
+    assert db_transaction.type == TransactionType.WITHDRAWAL
+    mock_db_session.add.assert_called_once_with(db_transaction)
+    assert "INSERT INTO user_daily_stats" in str(mock_db_session.execute.call_args.args[0])
 
 
-def test_withdraw_money_insufficient_balance(mock_db_session, sender_user):
-    with patch('services.user_service.UserService.fetch', return_value=sender_user):
-        transaction = WithdrawCreate(sender_id=1, amount=Decimal('2000.00'))
+def test_withdraw_money_insufficient_balance(mock_db_session, sender_user, balances):
+    transaction = WithdrawCreate(sender_id=1, amount=Decimal('2000.00'))
 
-        with pytest.raises(Exception, match="Insufficient balance"):
-            TransactionService.withdraw_money(mock_db_session, transaction)
+    with pytest.raises(Exception, match="Insufficient balance"):
+        TransactionService.withdraw_money(mock_db_session, transaction)
+
+    assert sender_user.main_balance == Decimal('1000.00')
+    mock_db_session.add.assert_not_called()
+
+
+def test_withdraw_money_user_not_found(mock_db_session, balances):
+    transaction = WithdrawCreate(sender_id=3, amount=Decimal('200.00'))
+
+    with pytest.raises(Exception, match="User not found"):
+        TransactionService.withdraw_money(mock_db_session, transaction)
+
+    mock_db_session.add.assert_not_called()
+
+
+def test_transfer_batch_best_effort(mock_db_session, sender_user, receiver_user):
+    mock_db_session.scalars.return_value = [sender_user, receiver_user]
+    # flush assigns primary keys
+    mock_db_session.flush.side_effect = lambda: [
+        setattr(transaction, "id", transaction_id)
+        for transaction_id, transaction in enumerate(mock_db_session.add_all.call_args.args[0], 1)
+    ]
+    items = [
+        TransactionCreate(sender_id=1, receiver_id=2, amount=Decimal('600.00')),
+        TransactionCreate(sender_id=1, receiver_id=2, amount=Decimal('600.00')),
+        TransactionCreate(sender_id=2, receiver_id=3, amount=Decimal('1.00')),
+        TransactionCreate(sender_id=2, receiver_id=1, amount=Decimal('100.00')),
+    ]
+
+    results = TransactionService.transfer_batch(mock_db_session, items, TransferBatchMode.BEST_EFFORT)
+
+    assert [result.ok for result in results] == [True, False, False, True]
+    assert [result.error for result in results] == [None, "Insufficient balance", "User not found", None]
+    assert results[0].transaction.amount == Decimal('600.00')
+    assert sender_user.main_balance == Decimal('500.00')
+    assert receiver_user.main_balance == Decimal('1000.00')
+    # users are fetched once and rows are inserted with one flush
+    mock_db_session.scalars.assert_called_once()
+    assert len(mock_db_session.add_all.call_args.args[0]) == 2
+    mock_db_session.flush.assert_called_once()
+
+
+def test_transfer_batch_all_or_nothing(mock_db_session, sender_user, receiver_user):
+    mock_db_session.scalars.return_value = [sender_user, receiver_user]
+    items = [
+        TransactionCreate(sender_id=1, receiver_id=2, amount=Decimal('100.00')),
+        TransactionCreate(sender_id=1, receiver_id=3, amount=Decimal('100.00')),
+    ]
 
-        assert sender_user.balance == Decimal('1000.00')
-        mock_db_session.add.assert_not_called()
+    with pytest.raises(TransferBatchError) as e:
+        TransactionService.transfer_batch(mock_db_session, items, TransferBatchMode.ALL_OR_NOTHING)
 
+    assert [result.error for result in e.value.results] == ["Batch rolled back", "User not found"]
+    mock_db_session.add_all.assert_not_called()
 
-def test_withdraw_money_user_not_found(mock_db_session):
-    with patch('services.user_service.UserService.fetch', return_value=None):
-        transaction = WithdrawCreate(sender_id=1, amount=Decimal('200.00'))
 
-        with pytest.raises(Exception, match="User not found"):
-            TransactionService.withdraw_money(mock_db_session, transaction)
+def test_run_in_transaction_retries_serialization_failure(mock_db_session):
+    failure = OperationalError("UPDATE users", {}, MagicMock(pgcode="40001"))
+    work = MagicMock(side_effect=[failure, "done"])
 
-        mock_db_session.add.assert_not_called()
+    assert run_in_transaction(mock_db_session, work) == "done"
+    assert work.call_count == 2
+    mock_db_session.rollback.assert_called_once()
+    mock_db_session.commit.assert_called_once()
+
+
+def test_run_in_transaction_does_not_retry_other_errors(mock_db_session):
+    work = MagicMock(side_effect=OperationalError("UPDATE users", {}, MagicMock(pgcode="08006")))
+
+    with pytest.raises(OperationalError):
+        run_in_transaction(mock_db_session, work)
+    work.assert_called_once()
+
+
+@pytest.fixture
+def mock_async_db_session(mocker):
+    db = mocker.MagicMock()
+    db.scalars = AsyncMock()
+    return db
+
+
+def returns_rows(db, rows):
+    db.scalars.return_value = MagicMock(all=MagicMock(return_value=rows))
+
+
+def executed_sql(db) -> str:
+    return str(db.scalars.call_args.args[0].compile(compile_kwargs={"literal_binds": True}))
+
+
+@pytest.fixture
+def mock_cache_view(mocker):
+    # cache always misses and loads whole view with one query
+    async def get_view(redis_service, view, loader, fallback, page):
+        return {"items": [transaction.to_dict() for transaction in await loader(None, None, None)], "next_cursor": None}
+
+    return mocker.patch.object(TransactionCacheService, "get_view", side_effect=get_view)
 
 
 @pytest.mark.asyncio
-async def test_get_all_transactions(mock_db_session, mock_redis_service):
-    mock_db_session.query(MoneyTransaction).all.return_value = [
+async def test_get_all_transactions(mock_async_db_session):
+    returns_rows(mock_async_db_session, [
         MoneyTransaction(id=1, sender_id=1, receiver_id=2, amount=Decimal('100.00'), type=TransactionType.TRANSFER)
-    ]
+    ])
 
-    transactions = await TransactionService.get_all_transactions(mock_db_session, mock_redis_service)
+    page = await TransactionService.get_all_transactions(mock_async_db_session)
+    transactions = page["items"]
 
     assert len(transactions) == 1
-    assert transactions[0]['id'] == 1
-    assert transactions[0]['sender_id'] == 1
-    assert transactions[0]['receiver_id'] == 2
-    assert transactions[0]['amount'] == '100.00'
-    assert transactions[0]['type'] == TransactionType.TRANSFER
+    assert transactions[0].id == 1
+    assert transactions[0].sender_id == 1
+    assert transactions[0].receiver_id == 2
+    assert transactions[0].amount == Decimal('100.00')
+    assert transactions[0].type == TransactionType.TRANSFER
+    assert page["next_cursor"] is None
 
 
 @pytest.mark.asyncio
-async def test_get_user_transactions(mock_db_session, mock_redis_service, sender_user):
-    mock_db_session.query(MoneyTransaction).all.return_value = [
+async def test_get_all_transactions_next_cursor(mock_async_db_session):
+    created_at = datetime(2024, 6, 5, 19, 21, 4)
+    returns_rows(mock_async_db_session, [
+        MoneyTransaction(id=i, sender_id=1, receiver_id=2, amount=Decimal('1.00'), type=TransactionType.TRANSFER, created_at=created_at)
+        for i in (5, 6, 7)
+    ])
+
+    page = await TransactionService.get_all_transactions(
+        mock_async_db_session, PageParams(limit=2, after=(created_at, 4))
+    )
+
+    assert [transaction.id for transaction in page["items"]] == [5, 6]
+    assert decode_cursor(page["next_cursor"]) == (created_at, 6)
+    sql = executed_sql(mock_async_db_session)
+    assert "(transactions.created_at, transactions.id) > ('2024-06-05 19:21:04', 4)" in sql
+    # lets postgres skip partitions older than the cursor
+    assert "transactions.created_at >= '2024-06-05 19:21:04'" in sql
+    assert "LIMIT 3" in sql
+    assert "OFFSET" not in sql
+
+
+@pytest.mark.asyncio
+async def test_get_user_transactions(mock_async_db_session, mock_redis_service, mock_cache_view, sender_user):
+    returns_rows(mock_async_db_session, [
         MoneyTransaction(id=1, sender_id=1, receiver_id=2, amount=Decimal('100.00'), type=TransactionType.TRANSFER),
         MoneyTransaction(id=2, sender_id=2, receiver_id=1, amount=Decimal('50.00'), type=TransactionType.TRANSFER)
-    ]
-    mock_redis_service.get.return_value = None
+    ])
 
-    transactions = await TransactionService.get_user_transactions(mock_db_session, mock_redis_service, user_id=1)
+    transactions = (await TransactionService.get_user_transactions(mock_async_db_session, mock_redis_service, user_id=1))["items"]
 
     assert len(transactions) == 2
     assert transactions[0]['sender_id'] == 1 or transactions[0]['receiver_id'] == 1
+    assert mock_cache_view.call_args.args[1] == "transactions:v2:user:1"
+    # filtering happens in SQL, the whole ledger is never loaded
+    assert "transactions.sender_id = 1 OR transactions.receiver_id = 1" in executed_sql(mock_async_db_session)
 
 
 @pytest.mark.asyncio
-async def test_get_transactions_between_users(mock_db_session, mock_redis_service, sender_user, receiver_user):
-    mock_db_session.query(MoneyTransaction).all.return_value = [
+async def test_get_user_transactions_by_type(mock_async_db_session, mock_redis_service, mock_cache_view):
+    returns_rows(mock_async_db_session, [
+        MoneyTransaction(id=3, sender_id=1, receiver_id=None, amount=Decimal('10.00'), type=TransactionType.WITHDRAWAL)
+    ])
+
+    transactions = (await TransactionService.get_user_transactions(
+        mock_async_db_session, mock_redis_service, user_id=1, transaction_type=TransactionType.WITHDRAWAL
+    ))["items"]
+
+    assert len(transactions) == 1
+    assert transactions[0]['type'] == TransactionType.WITHDRAWAL
+    assert mock_cache_view.call_args.args[1] == "transactions:v2:user:1:withdrawal"
+    assert "transactions.type = 'WITHDRAWAL'" in executed_sql(mock_async_db_session)
+
+
+@pytest.mark.asyncio
+async def test_get_transactions_between_users(mock_async_db_session, mock_redis_service, mock_cache_view, sender_user, receiver_user):
+    returns_rows(mock_async_db_session, [
         MoneyTransaction(id=1, sender_id=1, receiver_id=2, amount=Decimal('100.00'), type=TransactionType.TRANSFER),
         MoneyTransaction(id=2, sender_id=2, receiver_id=1, amount=Decimal('50.00'), type=TransactionType.TRANSFER),
-        MoneyTransaction(id=3, sender_id=1, receiver_id=3, amount=Decimal('30.00'), type=TransactionType.TRANSFER)
-    ]
-    mock_redis_service.get.return_value = None
+    ])
 
-    transactions = await TransactionService.get_transactions_between_users(mock_db_session, mock_redis_service, user1_id=1, user2_id=2)
+    transactions = (await TransactionService.get_transactions_between_users(mock_async_db_session, mock_redis_service, user1_id=2, user2_id=1))["items"]
 
     assert len(transactions) == 2
     assert all((t['sender_id'] in [1, 2] and t['receiver_id'] in [1, 2]) for t in transactions)
+    assert mock_cache_view.call_args.args[1] == "transactions:v2:pair:1:2"
+    sql = executed_sql(mock_async_db_session)
+    assert "least(transactions.sender_id, transactions.receiver_id) = 1" in sql
+    assert "greatest(transactions.sender_id, transactions.receiver_id) = 2" in sql
+    assert "transactions.type = 'TRANSFER'" in sql
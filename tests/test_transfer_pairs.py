@@ -0,0 +1,65 @@
+import pytest
+from datetime import datetime
+from decimal import Decimal
+from unittest.mock import AsyncMock
+
+from models import MoneyTransaction, TransactionType, TransferPair
+from services.transfer_pair_service import TransferPairService
+
+
+def transfer(sender_id: int, receiver_id: int, amount: str) -> MoneyTransaction:
+    return MoneyTransaction(sender_id=sender_id, receiver_id=receiver_id, amount=Decimal(amount), type=TransactionType.TRANSFER)
+
+
+def test_record_aggregates_pairs_in_one_statement(mock_db_session):
+    TransferPairService.record(mock_db_session, [
+        transfer(3, 1, '5.00'),
+        transfer(1, 3, '2.00'),
+        transfer(1, 3, '1.50'),
+        transfer(2, 1, '4.00'),
+    ])
+
+    mock_db_session.execute.assert_called_once()
+    params = mock_db_session.execute.call_args.args[0].compile().params
+    assert params["low_user_id_m0"] == 1 and params["high_user_id_m0"] == 2
+    assert params["high_to_low_amount_m0"] == Decimal('4.00')
+    assert params["low_user_id_m1"] == 1 and params["high_user_id_m1"] == 3
+    assert params["low_to_high_amount_m1"] == Decimal('3.50')
+    assert params["low_to_high_count_m1"] == 2
+    assert params["high_to_low_amount_m1"] == Decimal('5.00')
+    assert params["high_to_low_count_m1"] == 1
+
+
+def test_record_without_transfers(mock_db_session):
+    TransferPairService.record(mock_db_session, [])
+
+    mock_db_session.execute.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_get_summary_from_higher_user_point_of_view(mock_db_session):
+    mock_db_session.get = AsyncMock(return_value=TransferPair(
+        low_user_id=1, high_user_id=3,
+        low_to_high_amount=Decimal('3.50'), low_to_high_count=2,
+        high_to_low_amount=Decimal('5.00'), high_to_low_count=1,
+        first_transfer_at=datetime(2024, 6, 5), last_transfer_at=datetime(2024, 6, 6)
+    ))
+
+    summary = await TransferPairService.get_summary(mock_db_session, 3, 1)
+
+    assert mock_db_session.get.call_args.args == (TransferPair, (1, 3))
+    assert summary["sent_amount"] == Decimal('5.00')
+    assert summary["sent_count"] == 1
+    assert summary["received_amount"] == Decimal('3.50')
+    assert summary["received_count"] == 2
+
+
+@pytest.mark.asyncio
+async def test_get_summary_without_transfers(mock_db_session):
+    mock_db_session.get = AsyncMock(return_value=None)
+
+    summary = await TransferPairService.get_summary(mock_db_session, 1, 2)
+
+    assert summary["sent_count"] == 0
+    assert summary["received_amount"] == Decimal(0)
+    assert summary["last_transfer_at"] is None
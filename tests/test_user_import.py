@@ -0,0 +1,84 @@
+import csv
+import io
+from datetime import datetime
+
+import pytest
+
+from services.user_import_service import COPY_USERS_SQL, ImportFormat, UserImportService
+
+
+@pytest.fixture
+def copied_rows(mocker):
+    """Mocks session and collects rows sent to COPY."""
+    db = mocker.MagicMock()
+    db.scalar.return_value = datetime(2024, 1, 1, 12, 0)
+    cursor = db.connection.return_value.connection.cursor.return_value
+    rows = []
+
+    def copy_expert(sql, buffer):
+        assert sql == COPY_USERS_SQL
+        rows.append(list(csv.reader(io.StringIO(buffer.read()))))
+
+    cursor.copy_expert.side_effect = copy_expert
+    return db, rows
+
+
+def test_import_users_jsonl(copied_rows):
+    db, rows = copied_rows
+    lines = [
+        '{"name": "John Doe", "balance": 100}\n',
+        '{"name": "Al"}\n',
+        '\n',
+        'not json\n',
+        '[1, 2]\n',
+        '{"name": "Alice"}\n',
+    ]
+
+    result = UserImportService.import_users(db, lines, ImportFormat.JSONL)
+
+    assert result["imported"] == 2
+    assert [reject["line"] for reject in result["rejected"]] == [2, 4, 5]
+    assert result["rejected"][0]["error"].startswith("name: ")
+    assert result["rejected"][1]["error"] == "Invalid JSON"
+    assert rows == [[["John Doe", "100", "100", "2024-01-01T12:00:00"], ["Alice", "0.0", "0.0", "2024-01-01T12:00:00"]]]
+
+
+def test_import_users_csv(copied_rows):
+    db, rows = copied_rows
+    lines = ["name,balance\n", "John Doe,100.50\n", "Alice,\n", "Bob,-1\n"]
+
+    result = UserImportService.import_users(db, lines, ImportFormat.CSV)
+
+    assert result["imported"] == 2
+    assert result["rejected"] == [{"line": 4, "error": "balance: Input should be greater than or equal to 0"}]
+    assert [row[:2] for row in rows[0]] == [["John Doe", "100.50"], ["Alice", "0.0"]]
+
+
+def test_import_users_rejects_rows_the_column_refuses(copied_rows):
+    db, rows = copied_rows
+    lines = [
+        '{"name": "Rich", "balance": 10000000000}\n',
+        '{"name": "Nul\\u0000name"}\n',
+        '{"name": "Max", "balance": 9999999999.99}\n',
+    ]
+
+    result = UserImportService.import_users(db, lines, ImportFormat.JSONL)
+
+    assert result["imported"] == 1
+    assert result["rejected"] == [
+        {"line": 1, "error": "balance: Input should be less than 10000000000"},
+        {"line": 2, "error": "name: NUL character is not allowed"},
+    ]
+    assert [row[:2] for row in rows[0]] == [["Max", "9999999999.99"]]
+
+
+def test_import_users_copies_in_chunks(copied_rows, mocker):
+    db, rows = copied_rows
+    mocker.patch("services.user_import_service.IMPORT_CHUNK_SIZE", 2)
+    lines = [f'{{"name": "user {i}"}}\n' for i in range(5)]
+
+    result = UserImportService.import_users(db, lines, ImportFormat.JSONL)
+
+    assert result == {"imported": 5, "rejected": []}
+    assert [len(chunk) for chunk in rows] == [2, 2, 1]
+    db.commit.assert_not_called()
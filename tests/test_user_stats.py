@@ -0,0 +1,75 @@
+import pytest
+from datetime import date
+from decimal import Decimal
+from unittest.mock import AsyncMock
+
+from models import MoneyTransaction, TransactionType, UserDailyStat
+from services.user_stats_service import UserStatsService
+
+
+def transaction(sender_id, receiver_id, amount: str, transaction_type=TransactionType.TRANSFER) -> MoneyTransaction:
+    return MoneyTransaction(sender_id=sender_id, receiver_id=receiver_id, amount=Decimal(amount), type=transaction_type)
+
+
+def test_record_aggregates_users_and_types_in_one_statement(mock_db_session):
+    UserStatsService.record(mock_db_session, [
+        transaction(2, 1, '5.00'),
+        transaction(1, 2, '2.00'),
+        transaction(1, None, '1.50', TransactionType.WITHDRAWAL),
+    ])
+
+    mock_db_session.execute.assert_called_once()
+    params = mock_db_session.execute.call_args.args[0].compile().params
+    assert params["user_id_m0"] == 1 and params["type_m0"] == TransactionType.TRANSFER
+    assert params["sent_amount_m0"] == Decimal('2.00') and params["sent_count_m0"] == 1
+    assert params["received_amount_m0"] == Decimal('5.00') and params["received_count_m0"] == 1
+    assert params["user_id_m1"] == 1 and params["type_m1"] == TransactionType.WITHDRAWAL
+    assert params["sent_amount_m1"] == Decimal('1.50') and params["received_count_m1"] == 0
+    assert params["user_id_m2"] == 2
+    assert params["sent_amount_m2"] == Decimal('5.00') and params["received_amount_m2"] == Decimal('2.00')
+
+
+def test_record_without_transactions(mock_db_session):
+    UserStatsService.record(mock_db_session, [])
+
+    mock_db_session.execute.assert_not_called()
+
+
+def stat(day: date, transaction_type: TransactionType, sent: str, received: str = '0') -> UserDailyStat:
+    return UserDailyStat(
+        user_id=1, day=day, type=transaction_type,
+        sent_amount=Decimal(sent), sent_count=1 if Decimal(sent) else 0,
+        received_amount=Decimal(received), received_count=1 if Decimal(received) else 0
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_stats_folds_types_per_day(mock_db_session):
+    mock_db_session.scalars = AsyncMock(return_value=[
+        stat(date(2024, 6, 1), TransactionType.TRANSFER, '10.00', '3.00'),
+        stat(date(2024, 6, 1), TransactionType.WITHDRAWAL, '4.00'),
+        stat(date(2024, 6, 3), TransactionType.TRANSFER, '0', '2.50'),
+    ])
+
+    stats = await UserStatsService.get_stats(mock_db_session, 1, since=date(2024, 6, 1), until=date(2024, 7, 1))
+
+    sql = str(mock_db_session.scalars.call_args.args[0])
+    assert "FROM user_daily_stats" in sql and "transactions" not in sql
+    assert [day["day"] for day in stats["days"]] == [date(2024, 6, 1), date(2024, 6, 3)]
+    assert stats["days"][0]["sent_amount"] == Decimal('10.00')
+    assert stats["days"][0]["withdrawn_amount"] == Decimal('4.00')
+    assert stats["days"][0]["withdrawn_count"] == 1
+    assert stats["received_amount"] == Decimal('5.50')
+    assert stats["received_count"] == 2
+    assert stats["sent_count"] == 1
+
+
+@pytest.mark.asyncio
+async def test_get_stats_without_transactions(mock_db_session):
+    mock_db_session.scalars = AsyncMock(return_value=[])
+
+    stats = await UserStatsService.get_stats(mock_db_session, 1)
+
+    assert stats["days"] == []
+    assert stats["sent_amount"] == Decimal(0)
+    assert stats["withdrawn_count"] == 0
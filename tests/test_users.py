@@ -1,6 +1,7 @@
 from decimal import Decimal
 
 import pytest
+from models import User
 from services.user_service import UserService
 
 
@@ -23,15 +24,20 @@ def test_fetch_user(session, create_user):
     assert fetched_user.balance == user.balance
 
 
-@pytest.mark.usefixtures("session")
-def test_get_users(session):
+@pytest.mark.asyncio
+async def test_get_users(async_session):
     users_data = [
         {"name": "John Doe", "balance": 100.0},
         {"name": "Alice", "balance": 200.0}
     ]
 
-    users = UserService.get_users(session)
+    users = (await UserService.get_users(async_session))["items"]
 
     assert len(users) == len(users_data)
     assert all(user.name in [user_data["name"] for user_data in users_data] for user in users)
     assert all(user.balance in [user_data["balance"] for user_data in users_data] for user in users)
+
+
+def test_balance_is_read_only():
+    with pytest.raises(AttributeError, match="main_balance"):
+        User(name="John Doe", balance=Decimal("10.00"))